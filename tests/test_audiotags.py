@@ -0,0 +1,209 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+import audiotags
+
+
+def syncsafe(value):
+    return bytes(((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F))
+
+
+def unsynchronise(data):
+    return data.replace(b"\xff", b"\xff\x00")
+
+
+def id3v2(version, frames, flags=0):
+    """frames: (frame id, payload, frame flags); payloads are used as given."""
+    body = b""
+    for frame_id, payload, frame_flags in frames:
+        if version == 2:
+            body += frame_id + len(payload).to_bytes(3, "big") + payload
+        elif version == 3:
+            body += frame_id + struct.pack(">IH", len(payload), frame_flags) + payload
+        else:
+            body += frame_id + syncsafe(len(payload)) + struct.pack(">H", frame_flags) + payload
+    if flags & 0x80 and version < 4:
+        body = unsynchronise(body)
+    body += b"\0" * 16  # Padding
+    return b"ID3" + bytes((version, 0, flags)) + syncsafe(len(body)) + body
+
+
+def text(value, encoding=0):
+    return bytes((encoding,)) + value.encode(audiotags._ID3_ENCODINGS[encoding])
+
+
+def id3v1(title="", artist="", album="", year="", track=0):
+    def field(value, size):
+        return value.encode("latin-1").ljust(size, b"\0")
+    return (b"TAG" + field(title, 30) + field(artist, 30) + field(album, 30) + field(year, 4)
+            + b"\0" * 28 + bytes((0, track, 0xFF)))
+
+
+MPEG_FRAMES = b"\xff\xfb\x90\x00" + b"\0" * 400
+
+
+def vorbis_comment(fields, vendor=b"test"):
+    comments = [f"{key}={value}".encode("utf-8") for key, value in fields]
+    return (struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+            + b"".join(struct.pack("<I", len(comment)) + comment for comment in comments))
+
+
+def flac(fields):
+    streaminfo = b"\0" + (34).to_bytes(3, "big") + b"\0" * 34
+    comment = vorbis_comment(fields)
+    return b"fLaC" + streaminfo + b"\x84" + len(comment).to_bytes(3, "big") + comment + b"\xff\xf8" + b"\0" * 64
+
+
+def ogg_pages(packets, serial=1):
+    """Split packets into pages of at most 255 segments."""
+    segments = []
+    for packet in packets:
+        lacing = [255] * (len(packet) // 255) + [len(packet) % 255]
+        pos = 0
+        for size in lacing:
+            segments.append((size, packet[pos:pos + size]))
+            pos += size
+    pages = b""
+    for sequence, start in enumerate(range(0, len(segments), 255)):
+        page = segments[start:start + 255]
+        pages += (b"OggS\0\0" + b"\0" * 8 + struct.pack("<II", serial, sequence) + b"\0" * 4
+                  + bytes((len(page),)) + bytes(size for size, _data in page)
+                  + b"".join(data for _size, data in page))
+    return pages
+
+
+def atom(atom_type, payload):
+    return struct.pack(">I", 8 + len(payload)) + atom_type + payload
+
+
+def mp4(items, full_meta=True):
+    ilst = b"".join(atom(item_type, atom(b"data", struct.pack(">I", data_type) + b"\0" * 4 + value))
+                    for item_type, data_type, value in items)
+    meta = atom(b"hdlr", b"\0" * 8 + b"mdirappl" + b"\0" * 9) + atom(b"ilst", ilst)
+    if full_meta:
+        meta = b"\0\0\0\0" + meta
+    moov = atom(b"moov", atom(b"mvhd", b"\0" * 100) + atom(b"udta", atom(b"meta", meta)))
+    return atom(b"ftyp", b"M4A \0\0\0\0M4A isom") + moov + atom(b"mdat", b"\0" * 64)
+
+
+class AudioTagsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, data):
+        path = os.path.join(self.directory, "track")
+        with open(path, "wb") as f:
+            f.write(data)
+        return audiotags.read_tags(path)
+
+    def test_id3v22(self):
+        tag = id3v2(2, [(b"TT2", text("Title"), 0), (b"TP1", text("Artist"), 0),
+                        (b"TAL", text("Album"), 0), (b"TRK", text("3/12"), 0), (b"TYE", text("1999"), 0)])
+        self.assertEqual(self.read(tag + MPEG_FRAMES),
+                         {"title": "Title", "artist": "Artist", "album": "Album", "track": "3/12", "date": "1999"})
+
+    def test_id3v23_encodings(self):
+        tag = id3v2(3, [(b"TIT2", text("Títle", 1), 0), (b"TPE1", text("Ärtist", 0), 0)])
+        self.assertEqual(self.read(tag + MPEG_FRAMES), {"title": "Títle", "artist": "Ärtist"})
+
+    def test_id3v23_unsynchronised_tag(self):
+        # "ÿ" is 0xFF in Latin-1, so the tag needs unsynchronising
+        tag = id3v2(3, [(b"TIT2", text("ÿÿ title"), 0), (b"TPE1", text("Artist"), 0)], flags=0x80)
+        self.assertIn(b"\xff\x00", tag)
+        self.assertEqual(self.read(tag + MPEG_FRAMES), {"title": "ÿÿ title", "artist": "Artist"})
+
+    def test_id3v23_compressed_frame(self):
+        payload = text("Compressed title")
+        compressed = struct.pack(">I", len(payload)) + zlib.compress(payload)
+        tag = id3v2(3, [(b"TIT2", compressed, 0x0080), (b"TPE1", text("Artist"), 0)])
+        self.assertEqual(self.read(tag + MPEG_FRAMES), {"title": "Compressed title", "artist": "Artist"})
+
+    def test_id3v23_encrypted_frame_skipped(self):
+        tag = id3v2(3, [(b"TIT2", b"\x01secret", 0x0040), (b"TPE1", text("Artist"), 0)])
+        self.assertEqual(self.read(tag + MPEG_FRAMES), {"artist": "Artist"})
+
+    def test_id3v24(self):
+        payload = text("Dåte title", 3)
+        compressed = zlib.compress(payload)
+        frames = [
+            # Data length indicator, then the compressed frame
+            (b"TIT2", syncsafe(len(payload)) + compressed, 0x0008 | 0x0001),
+            # Per-frame unsynchronisation
+            (b"TPE1", unsynchronise(text("ÿ artist")), 0x0002),
+            # Multiple values: the first is kept
+            (b"TDRC", text("2001\x002002", 3), 0),
+        ]
+        self.assertEqual(self.read(id3v2(4, frames) + MPEG_FRAMES),
+                         {"title": "Dåte title", "artist": "ÿ artist", "date": "2001"})
+
+    def test_id3v24_extended_header(self):
+        tag = bytearray(id3v2(4, [(b"TIT2", text("Title"), 0)]))
+        extended = syncsafe(6) + b"\x01\x00"
+        body = extended + bytes(tag[10:])
+        data = b"ID3\x04\x00\x40" + syncsafe(len(body)) + body
+        self.assertEqual(self.read(data + MPEG_FRAMES), {"title": "Title"})
+
+    def test_id3v1(self):
+        data = MPEG_FRAMES + id3v1("Title", "Artist", "Album", "1987", track=7)
+        self.assertEqual(self.read(data),
+                         {"title": "Title", "artist": "Artist", "album": "Album", "date": "1987", "track": "7"})
+
+    def test_id3v2_completed_by_id3v1(self):
+        data = id3v2(3, [(b"TIT2", text("V2 title"), 0)]) + MPEG_FRAMES + id3v1("V1 title", "V1 artist")
+        self.assertEqual(self.read(data), {"title": "V2 title", "artist": "V1 artist"})
+
+    def test_flac(self):
+        data = flac([("ARTIST", "Artist"), ("title", "Title"), ("TRACKNUMBER", "4"), ("ARTIST", "Second")])
+        self.assertEqual(self.read(data), {"artist": "Artist", "title": "Title", "track": "4"})
+
+    def test_flac_with_id3(self):
+        data = id3v2(3, [(b"TIT2", text("ID3 title"), 0)]) + flac([("ARTIST", "Artist"), ("TITLE", "Title")])
+        self.assertEqual(self.read(data), {"title": "ID3 title", "artist": "Artist"})
+
+    def test_ogg_vorbis(self):
+        head = b"\x01vorbis" + b"\0" * 22
+        comment = b"\x03vorbis" + vorbis_comment([("ARTIST", "Artist"), ("ALBUM", "Album")]) + b"\x01"
+        self.assertEqual(self.read(ogg_pages([head, comment, b"\x05vorbis"])),
+                         {"artist": "Artist", "album": "Album"})
+
+    def test_opus_comment_across_pages(self):
+        head = b"OpusHead\x01\x02" + b"\0" * 9
+        # Long enough to span several pages
+        comment = b"OpusTags" + vorbis_comment([("COMMENT", "x" * 200000), ("TITLE", "Title")])
+        self.assertEqual(self.read(ogg_pages([head, comment])), {"title": "Title"})
+
+    def test_ogg_other_codec(self):
+        self.assertEqual(self.read(ogg_pages([b"\x80theora" + b"\0" * 34])), {})
+
+    def test_mp4(self):
+        data = mp4([(b"\xa9nam", 1, "Títle".encode("utf-8")), (b"\xa9ART", 1, b"Artist"),
+                    (b"trkn", 0, struct.pack(">HHHH", 0, 5, 10, 0)), (b"\xa9day", 1, b"2010")])
+        self.assertEqual(self.read(data), {"title": "Títle", "artist": "Artist", "track": "5", "date": "2010"})
+
+    def test_mp4_quicktime_meta(self):
+        data = mp4([(b"\xa9alb", 1, b"Album")], full_meta=False)
+        self.assertEqual(self.read(data), {"album": "Album"})
+
+    def test_untagged_and_truncated(self):
+        self.assertEqual(self.read(MPEG_FRAMES), {})
+        self.assertEqual(self.read(b""), {})
+        for data in (id3v2(3, [(b"TIT2", text("Title"), 0)]), flac([("TITLE", "Title")]),
+                     mp4([(b"\xa9nam", 1, b"Title")])):
+            for size in range(len(data) - 1):
+                # Never raises, whatever is left
+                self.assertIsInstance(self.read(data[:size]), dict)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+import exif
+
+DATE = b"2021:03:04 05:06:07"
+
+
+def build_tiff(order=b"II", date=DATE, make=b"Canon", model=b"EOS R5", subsec=None):
+    """A TIFF structure with Make/Model in IFD0 and the dates in the Exif IFD."""
+    fmt = "<" if order == b"II" else ">"
+    ifd0 = [(exif.TAG_MAKE, make), (exif.TAG_MODEL, model)]
+    exif_ifd = [(exif.TAG_DATETIME_ORIGINAL, date), (exif.TAG_SUBSEC_ORIGINAL, subsec)]
+    ifd0 = [(tag, value + b"\0") for tag, value in ifd0 if value is not None]
+    exif_ifd = [(tag, value + b"\0") for tag, value in exif_ifd if value is not None]
+
+    exif_offset = 8 + 2 + 12 * (len(ifd0) + 1) + 4
+    data_offset = exif_offset + 2 + 12 * len(exif_ifd) + 4
+    data = bytearray()
+
+    def entries(items):
+        out = b""
+        for tag, value in items:
+            if len(value) <= 4:
+                field = value.ljust(4, b"\0")
+            else:
+                field = struct.pack(fmt + "I", data_offset + len(data))
+                data.extend(value)
+            out += struct.pack(fmt + "HHI", tag, exif.TYPE_ASCII, len(value)) + field
+        return out
+
+    ifd0_entries = entries(ifd0) + struct.pack(fmt + "HHII", exif.TAG_EXIF_IFD, exif.TYPE_LONG, 1, exif_offset)
+    exif_entries = entries(exif_ifd)
+    return (order + struct.pack(fmt + "HI", 42, 8)
+            + struct.pack(fmt + "H", len(ifd0) + 1) + ifd0_entries + b"\0\0\0\0"
+            + struct.pack(fmt + "H", len(exif_ifd)) + exif_entries + b"\0\0\0\0"
+            + bytes(data))
+
+
+def jpeg(tiff):
+    app0 = b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\0\x01\x01\0\0\x01\0\x01\0\0"
+    payload = b"Exif\0\0" + tiff
+    app1 = b"\xff\xe1" + struct.pack(">H", len(payload) + 2) + payload
+    return b"\xff\xd8" + app0 + app1 + b"\xff\xda\0\x02" + b"\0" * 64 + b"\xff\xd9"
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + b"\0\0\0\0"
+
+
+def png(tiff):
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", b"\0" * 13) + png_chunk(b"eXIf", tiff)
+            + png_chunk(b"IDAT", b"\0" * 8) + png_chunk(b"IEND", b""))
+
+
+def webp(tiff, prefix=b""):
+    def chunk(chunk_type, data):
+        return chunk_type + struct.pack("<I", len(data)) + data + b"\0" * (len(data) & 1)
+    body = b"WEBP" + chunk(b"VP8X", b"\0" * 10) + chunk(b"ICCP", b"\0" * 3) + chunk(b"EXIF", prefix + tiff)
+    return b"RIFF" + struct.pack("<I", len(body)) + body
+
+
+def box(box_type, payload):
+    return struct.pack(">I", 8 + len(payload)) + box_type + payload
+
+
+def heic(tiff):
+    exif_id = 2
+    ftyp = box(b"ftyp", b"heic\0\0\0\0mif1heic")
+    infe_image = box(b"infe", b"\x02\0\0\0" + struct.pack(">HH", 1, 0) + b"hvc1\0")
+    infe_exif = box(b"infe", b"\x02\0\0\0" + struct.pack(">HH", exif_id, 0) + b"Exif\0")
+    iinf = box(b"iinf", b"\0\0\0\0" + struct.pack(">H", 2) + infe_image + infe_exif)
+
+    def meta(location):
+        # Version 0, 4-byte offsets and lengths, no base offset
+        iloc = box(b"iloc", b"\0\0\0\0" + bytes([0x44, 0x00]) + struct.pack(">H", 1)
+                   + struct.pack(">HHHII", exif_id, 0, 1, location, 4 + len(tiff)))
+        return box(b"meta", b"\0\0\0\0" + box(b"hdlr", b"\0" * 24) + iinf + iloc)
+
+    # Exif item: offset to the TIFF header, then the TIFF structure
+    item = struct.pack(">I", 0) + tiff
+    location = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(location) + box(b"mdat", item)
+
+
+class ExifTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, data, name="photo"):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return exif.read_exif_date(path)
+
+    def assertDate(self, result, camera="Canon EOS R5"):
+        self.assertIsNotNone(result)
+        self.assertEqual(result.timestamp, datetime(2021, 3, 4, 5, 6, 7))
+        self.assertEqual(result.camera, camera)
+
+    def test_containers(self):
+        for order in (b"II", b"MM"):
+            tiff = build_tiff(order)
+            for name, data in (("jpeg", jpeg(tiff)), ("tiff", tiff), ("png", png(tiff)),
+                               ("webp", webp(tiff)), ("webp-prefixed", webp(tiff, b"Exif\0\0")),
+                               ("heic", heic(tiff))):
+                with self.subTest(order=order, container=name):
+                    self.assertDate(self.read(data))
+
+    def test_subsec_and_short_values(self):
+        result = self.read(build_tiff(subsec=b"25", make=b"LG", model=None))
+        self.assertDate(result, camera="LG")
+        self.assertEqual(result.subsec, "25")
+
+    def test_no_camera(self):
+        result = self.read(build_tiff(make=None, model=None))
+        self.assertDate(result, camera=None)
+        self.assertIsNone(result.subsec)
+
+    def test_unset_date(self):
+        for order in (b"II", b"MM"):
+            with self.subTest(order=order):
+                self.assertIsNone(self.read(jpeg(build_tiff(order, date=b"0000:00:00 00:00:00"))))
+
+    def test_missing_date(self):
+        self.assertIsNone(self.read(build_tiff(date=None)))
+
+    def test_truncated(self):
+        for order in (b"II", b"MM"):
+            tiff = build_tiff(order)
+            # The date is the last value; only its NUL terminator may go
+            for size in range(len(tiff) - 1):
+                with self.subTest(order=order, size=size):
+                    self.assertIsNone(self.read(tiff[:size]))
+                    self.assertIsNone(self.read(jpeg(tiff[:size])))
+
+    def test_ifd_entry_count_limit(self):
+        tiff = bytearray(build_tiff())
+        tiff[8:10] = struct.pack("<H", 0xFFFF)
+        self.assertIsNone(self.read(bytes(tiff)))
+
+    def test_jpeg_without_exif(self):
+        self.assertIsNone(self.read(b"\xff\xd8\xff\xe0\0\x04\0\0\xff\xda\0\x02" + b"\0" * 16))
+
+    def test_unknown_format(self):
+        self.assertIsNone(self.read(b"GIF89a" + b"\0" * 32))
+        self.assertIsNone(self.read(b""))
+
+    def test_missing_file(self):
+        self.assertIsNone(exif.read_exif_date(os.path.join(self.directory, "missing.jpg")))
+
+    def test_read_chunk(self):
+        path = os.path.join(self.directory, "a.jpg")
+        with open(path, "wb") as f:
+            f.write(jpeg(build_tiff(subsec=b"5")))
+        missing = os.path.join(self.directory, "missing.jpg")
+        self.assertEqual(exif.read_chunk([path, missing]),
+                         [(path, datetime(2021, 3, 4, 5, 6, 7), "5", "Canon EOS R5"),
+                          (missing, None, None, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
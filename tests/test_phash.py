@@ -0,0 +1,78 @@
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+try:
+    import phash
+except (ImportError, ValueError):
+    # Needs PyGObject with GdkPixbuf
+    phash = None
+
+
+def brute_force(hashes, radius):
+    indexes = [i for i, value in enumerate(hashes) if value is not None]
+    pairs = [(j, i) for position, i in enumerate(indexes) for j in indexes[:position]
+             if bin(hashes[i] ^ hashes[j]).count("1") <= radius]
+    return phash.group(indexes, pairs)
+
+
+def near_copies(rnd, count, originals=15, missing=0.05):
+    """Hashes of a few originals with up to 8 flipped bits each, and some
+    images that could not be hashed."""
+    bases = [rnd.getrandbits(64) for _ in range(originals)]
+    hashes = []
+    for _i in range(count):
+        if rnd.random() < missing:
+            hashes.append(None)
+            continue
+        value = rnd.choice(bases)
+        for _flip in range(rnd.randint(0, 8)):
+            value ^= 1 << rnd.randrange(64)
+        hashes.append(value)
+    return hashes
+
+
+@unittest.skipIf(phash is None, "PyGObject is not available")
+class ClusterTest(unittest.TestCase):
+
+    def test_against_brute_force(self):
+        rnd = random.Random(46)
+        for trial in range(40):
+            hashes = near_copies(rnd, rnd.randint(0, 250))
+            radius = rnd.randint(0, phash.MAX_DISTANCE)
+            with self.subTest(trial=trial, radius=radius):
+                self.assertEqual(phash.cluster(hashes, radius), brute_force(hashes, radius))
+
+    def test_extreme_values(self):
+        hashes = [0, 1, 2 ** 64 - 1, 2 ** 63, 2 ** 64 - 2, 3]
+        for radius in (0, 1, 2, phash.MAX_DISTANCE):
+            with self.subTest(radius=radius):
+                self.assertEqual(phash.cluster(hashes, radius), brute_force(hashes, radius))
+
+    def test_groups(self):
+        # 0 and 3 are 2 bits apart, 3 and 7 are 1 bit apart: one chain
+        self.assertEqual(phash.cluster([0, None, 3, 2 ** 40 - 1, 7], 2), [[0, 2, 4]])
+        self.assertEqual(phash.cluster([5, 5, 5], 0), [[0, 1, 2]])
+        self.assertEqual(phash.cluster([], 4), [])
+        self.assertEqual(phash.cluster([None, 1], 4), [])
+
+    def test_earlier(self):
+        hashes = [0b111, None, 0b110, 0b111, 2 ** 50]
+        index = phash.HashIndex(hashes, 1)
+        self.assertEqual(index.indexes, [0, 2, 3, 4])
+        self.assertEqual(index.earlier(0), [])
+        self.assertEqual(index.earlier(3), [0, 2])
+        self.assertEqual(index.earlier(4), [])
+
+    def test_distance_limit(self):
+        with self.assertRaises(ValueError):
+            phash.cluster([1, 2], phash.MAX_DISTANCE + 1)
+        with self.assertRaises(ValueError):
+            phash.cluster([1, 2], -1)
+
+
+if __name__ == "__main__":
+    unittest.main()
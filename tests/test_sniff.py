@@ -0,0 +1,112 @@
+import io
+import os
+import sys
+import unittest
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+try:
+    import sniff
+except (ImportError, ValueError):
+    # Needs PyGObject with Gio
+    sniff = None
+
+
+def zip_with(first_name, first_data, stored=True):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as archive:
+        info = zipfile.ZipInfo(first_name)
+        info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+        archive.writestr(info, first_data)
+        archive.writestr("content.xml", "<office/>" * 100)
+    return data.getvalue()[:sniff.SNIFF_SIZE]
+
+
+def id3(size, after, footer=False):
+    header = b"ID3\x04\x00" + bytes((0x10 if footer else 0,))
+    header += bytes(((size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F))
+    return header + b"\0" * size + (b"3DI\x04\x00\x10" + header[6:] if footer else b"") + after
+
+
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\0" * 64
+ADTS_FRAME = b"\xff\xf1\x50\x80\x02\x1f\xfc" + b"\0" * 64
+FLAC_HEAD = b"fLaC\0\0\0\x22" + b"\0" * 64
+
+
+@unittest.skipIf(sniff is None, "PyGObject is not available")
+class SniffTest(unittest.TestCase):
+
+    def test_signatures(self):
+        cases = {
+            b"\xff\xd8\xff\xe0\0\x10JFIF": "jpg",
+            b"\x89PNG\r\n\x1a\n\0\0\0\x0dIHDR": "png",
+            b"GIF89a\x01\0\x01\0": "gif",
+            b"RIFF\x24\0\0\0WEBPVP8 ": "webp",
+            b"RIFF\x24\0\0\0WAVEfmt ": "wav",
+            b"%PDF-1.7\n": "pdf",
+            b"\x00\x00\x00\x18ftypheic\0\0\0\0": "heic",
+            b"\x00\x00\x00\x18ftypisom\0\0\0\0": "mp4",
+            b"\x00\x00\x00\x18ftypM4A \0\0\0\0": "m4a",
+            b"\x1a\x45\xdf\xa3\x9f\x42\x86\x81\x01\x42\x82\x84webm": "webm",
+            MP3_FRAME: "mp3",
+            ADTS_FRAME: "aac",
+            FLAC_HEAD: "flac",
+        }
+        for data, ext in cases.items():
+            with self.subTest(ext=ext):
+                self.assertEqual(sniff.sniff(data), ext)
+
+    def test_ogg_codecs(self):
+        page = b"OggS\0\x02" + b"\0" * 20 + b"\x01\x13"
+        self.assertEqual(sniff.sniff(page + b"OpusHead\x01\x02" + b"\0" * 40), "opus")
+        self.assertEqual(sniff.sniff(page + b"\x01vorbis" + b"\0" * 40), "ogg")
+
+    def test_opendocument(self):
+        cases = {
+            "text": "odt", "text-template": "ott", "text-master": "odm",
+            "spreadsheet": "ods", "spreadsheet-template": "ots",
+            "presentation": "odp", "presentation-template": "otp",
+            "graphics": "odg", "graphics-template": "otg",
+        }
+        for subtype, ext in cases.items():
+            with self.subTest(subtype=subtype):
+                data = zip_with("mimetype", f"application/vnd.oasis.opendocument.{subtype}")
+                self.assertEqual(sniff.sniff(data), ext)
+
+    def test_unknown_mimetype_is_zip(self):
+        self.assertEqual(sniff.sniff(zip_with("mimetype", "application/vnd.oasis.opendocument.textual")), "zip")
+        self.assertEqual(sniff.sniff(zip_with("mimetype", "application/epub+zip")), "epub")
+        self.assertEqual(sniff.sniff(zip_with("readme.txt", "hello")), "zip")
+
+    def test_ooxml_and_jar(self):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as archive:
+            archive.writestr("[Content_Types].xml", "<Types/>")
+            archive.writestr("word/document.xml", "<w/>")
+        self.assertEqual(sniff.sniff(data.getvalue()), "docx")
+        self.assertEqual(sniff.sniff(zip_with("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\n", False)), "jar")
+
+    def test_id3_tagged_audio(self):
+        self.assertEqual(sniff.sniff(id3(100, MP3_FRAME)), "mp3")
+        self.assertEqual(sniff.sniff(id3(100, ADTS_FRAME)), "aac")
+        self.assertEqual(sniff.sniff(id3(100, FLAC_HEAD)), "flac")
+        self.assertEqual(sniff.sniff(id3(100, FLAC_HEAD, footer=True)), "flac")
+        self.assertEqual(sniff.sniff(id3(20, id3(30, FLAC_HEAD))), "flac")
+
+    def test_id3_without_audio_in_buffer(self):
+        # Cover art pushes the audio past the sniffed bytes
+        self.assertIsNone(sniff.sniff(id3(10000, MP3_FRAME)[:sniff.SNIFF_SIZE]))
+        self.assertIsNone(sniff.sniff(id3(100, b"%PDF-1.4")))
+        self.assertIsNone(sniff.sniff(b"ID3\x04"))
+
+    def test_matches(self):
+        self.assertTrue(sniff.matches("JPEG", "jpg"))
+        self.assertTrue(sniff.matches("ott", "ott"))
+        self.assertTrue(sniff.matches("m4a", "mp4"))
+        self.assertTrue(sniff.matches("docx", "zip"))
+        self.assertFalse(sniff.matches("", "jpg"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+import templates
+
+
+def lookup(values):
+    return values.get
+
+
+class TemplateTest(unittest.TestCase):
+
+    def render(self, text, index=1, **values):
+        return templates.compile(text).render(index, lookup(values))
+
+    def test_numbering(self):
+        self.assertEqual(self.render("img_%n", 7), "img_7")
+        self.assertEqual(self.render("img_%0n", 7), "img_07")
+        self.assertEqual(self.render("img_%000n", 7), "img_0007")
+        self.assertEqual(self.render("%00n-%n", 12), "012-12")
+
+    def test_numbering_does_not_look_up_fields(self):
+        template = templates.compile("%n")
+        self.assertTrue(template.uses_index)
+        self.assertEqual(template.row_fields, ())
+        self.assertEqual(template.render(3, None), "3")
+
+    def test_plain_text(self):
+        template = templates.compile("plain")
+        self.assertFalse(template.uses_index)
+        self.assertEqual(template.render(5), "plain")
+
+    def test_percent_escape(self):
+        self.assertEqual(self.render("100%%sale", s=5), "100%sale")
+        self.assertEqual(self.render("%%percent", p="dir"), "%percent")
+        self.assertEqual(self.render("%%n", 3), "%n")
+        self.assertEqual(self.render("%%%n", 3), "%3")
+        self.assertEqual(self.render("50%%"), "50%")
+        self.assertEqual(templates.compile("%%n").fields, set())
+
+    def test_unescaped_percent_is_a_token(self):
+        self.assertEqual(self.render("100%sale", s=5), "1005ale")
+
+    def test_dates(self):
+        date = datetime(2024, 1, 2, 3, 4, 5)
+        self.assertEqual(self.render("%d", d=date), "20240102")
+        self.assertEqual(self.render("%d{%Y-%m-%d_%H%M}", d=date), "2024-01-02_0304")
+        self.assertEqual(self.render("%e{%Y}/%d{%m}", d=date, e=date), "2024/01")
+        self.assertEqual(templates.compile("%e{%Y}").row_fields, ("e",))
+
+    def test_missing_values_are_empty(self):
+        self.assertEqual(self.render("a%eb%d{%Y}c%sd%pe"), "abcde")
+
+    def test_size_and_folder(self):
+        self.assertEqual(self.render("%p_%s", p="Photos", s=1234), "Photos_1234")
+
+    def test_braces_in_literal_text(self):
+        self.assertEqual(self.render("{x}_%n_{}", 2), "{x}_2_{}")
+        self.assertEqual(self.render("{%p}", p="dir"), "{dir}")
+        self.assertEqual(self.render("{{}}"), "{{}}")
+
+    def test_unterminated_format_is_literal(self):
+        date = datetime(2024, 1, 2)
+        self.assertEqual(self.render("%d{%Y", d=date), "20240102{%Y")
+
+    def test_compile_is_memoized(self):
+        self.assertIs(templates.compile("%n_x"), templates.compile("%n_x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,223 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "usr", "lib", "bulky"))
+
+import thumbcache
+from thumbcache import SurfaceCache, ThumbnailStore
+
+
+def blob(key, size=48):
+    return (key.encode("utf-8") * size)[:size]
+
+
+class ThumbnailStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store = ThumbnailStore(self.directory)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.directory)
+
+    def put(self, key, size=48):
+        self.store.put(key, blob(key, size), 4, 4, 12, False)
+
+    def assertStored(self, store, key, size=48):
+        self.assertEqual(store.get(key), (blob(key, size), 4, 4, 12, False))
+
+    def reopen(self):
+        self.store.close()
+        self.store = ThumbnailStore(self.directory)
+        return self.store
+
+    def test_put_get(self):
+        self.put("a")
+        self.put("b", 100)
+        self.assertStored(self.store, "a")
+        self.assertStored(self.store, "b", 100)
+        self.assertIsNone(self.store.get("missing"))
+        self.assertIn("a", self.store)
+        self.assertEqual(self.store.stats()['hits'], 2)
+        self.assertEqual(self.store.stats()['misses'], 1)
+
+    def test_reopen(self):
+        self.put("a")
+        self.put("a", 64)  # Replaced: the old blob is dead space
+        self.put("b")
+        self.store.remove("b")
+        store = self.reopen()
+        self.assertStored(store, "a", 64)
+        self.assertNotIn("b", store)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.live_bytes, 64)
+        self.assertEqual(store.dead_bytes, 96)
+
+    def test_torn_index_record(self):
+        self.put("a")
+        self.put("b")
+        self.store.close()
+        with open(self.store.index_path, "ab") as index:
+            index.write(b"\x01" * (thumbcache._RECORD.size // 2))
+        store = self.reopen()
+        self.assertStored(store, "a")
+        self.assertStored(store, "b")
+        # Records written after the torn one stay aligned
+        self.put("c")
+        store = self.reopen()
+        self.assertEqual(len(store), 3)
+        self.assertStored(store, "c")
+
+    def test_record_past_end_of_pack(self):
+        self.put("a")
+        self.put("b")
+        self.store.close()
+        with open(self.store.pack_path, "r+b") as pack:
+            pack.truncate(os.path.getsize(self.store.pack_path) - 1)
+        store = self.reopen()
+        self.assertStored(store, "a")
+        self.assertNotIn("b", store)
+
+    def test_bad_header_resets(self):
+        self.put("a")
+        self.store.close()
+        with open(self.store.index_path, "r+b") as index:
+            index.write(b"garbage!")
+        with self.assertLogs("thumbcache", "WARNING"):
+            store = self.reopen()
+        self.assertEqual(len(store), 0)
+        self.put("b")
+        self.assertStored(self.reopen(), "b")
+
+    def test_compact(self):
+        for i in range(20):
+            self.put(f"k{i}", 32 + i)
+        for i in range(0, 20, 2):
+            self.store.remove(f"k{i}")
+        self.assertGreater(self.store.dead_bytes, 0)
+        self.store.compact()
+        self.assertEqual(self.store.dead_bytes, 0)
+        for reopen in (False, True):
+            store = self.reopen() if reopen else self.store
+            self.assertEqual(len(store), 10)
+            for i in range(1, 20, 2):
+                self.assertStored(store, f"k{i}", 32 + i)
+
+    def test_compact_during_writes(self):
+        for i in range(200):
+            self.put(f"old{i}")
+        for i in range(0, 200, 2):
+            self.store.remove(f"old{i}")
+        stop = threading.Event()
+        written = []
+
+        def writer(name):
+            i = 0
+            while not stop.is_set() or i < 50:
+                key = f"{name}{i}"
+                self.put(key, 40)
+                written.append(key)
+                self.store.get(f"old{i % 200}")
+                i += 1
+
+        threads = [threading.Thread(target=writer, args=(f"w{n}-",)) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        for _i in range(5):
+            self.store.compact()
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        for reopen in (False, True):
+            store = self.reopen() if reopen else self.store
+            for key in written:
+                self.assertStored(store, key, 40)
+            for i in range(1, 200, 2):
+                self.assertStored(store, f"old{i}")
+            self.assertEqual(len(store), 100 + len(written))
+
+    def test_compact_index(self):
+        self.put("a")
+        self.put("b")
+        self.store.remove("b")
+        for _i in range(5):
+            self.store.get("a")
+            self.store.flush_access_times()
+        self.assertGreater(self.store.stale_records, 0)
+        self.store.compact_index()
+        self.assertEqual(self.store.stale_records, 0)
+        store = self.reopen()
+        self.assertStored(store, "a")
+        self.assertEqual(len(store), 1)
+
+    def test_access_times_survive_reopen(self):
+        self.put("a")
+        self.put("b")
+        time.sleep(0.01)
+        self.store.get("a")
+        self.store.flush_access_times()
+        store = self.reopen()
+        # "b" was accessed least recently
+        self.assertEqual(store.evict(max_age_days=30, max_bytes=48), 1)
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+
+    def test_evict_by_age(self):
+        self.put("a")
+        self.assertEqual(self.store.evict(max_age_days=1), 0)
+        self.assertEqual(self.store.evict(max_age_days=-1), 1)
+        self.assertEqual(len(self.store), 0)
+
+    def test_evict_keeps_entries_read_after_the_scan(self):
+        for key in "abcd":
+            self.put(key)
+        steps = self.store.iter_evict(max_age_days=30, max_bytes=0, batch=2)
+        self.assertEqual(next(steps), 2)
+        # "c" is read after the scan picked it
+        self.store.get("c")
+        self.assertEqual(next(steps), 1)
+        self.assertEqual(next(steps, None), None)
+        self.assertIn("c", self.store)
+        self.assertEqual(len(self.store), 1)
+
+
+class SurfaceCacheTest(unittest.TestCase):
+
+    def test_budget(self):
+        cache = SurfaceCache(100)
+        cache.put("a", "A", 40)
+        cache.put("b", "B", 40)
+        self.assertEqual(cache.get("a"), "A")
+        # "b" is the least recently used
+        cache.put("c", "C", 40)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.get("c"), "C")
+        self.assertEqual(cache.stats()['bytes'], 80)
+
+    def test_oversized_entry_is_kept(self):
+        cache = SurfaceCache(10)
+        cache.put("a", "A", 5)
+        cache.put("big", "BIG", 50)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("big"), "BIG")
+
+    def test_free_entries(self):
+        cache = SurfaceCache(100)
+        for i in range(1000):
+            cache.put(i, "shared", 0)
+        cache.put("a", "A", 100)
+        self.assertEqual(len(cache), 1001)
+        cache.discard("a")
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
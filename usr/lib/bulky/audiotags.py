@@ -0,0 +1,444 @@
+"""In-process audio tag reader.
+
+Reads artist, title, album, track and date from ID3v1 and ID3v2.2/2.3/2.4
+(MP3), Vorbis comments (FLAC, Ogg Vorbis, Opus) and iTunes-style MP4
+atoms (M4A/M4B). Only tag headers and frames are read, never the audio
+stream, so a file costs a few small reads and no subprocess.
+
+Other formats (WMA, WAV, APE, ...) go through ffprobe when it is
+installed: one JSON call per file for all tags, with at most
+BULKY_FFPROBE_PROCS processes running at once across the application.
+"""
+import json
+import logging
+import os
+import selectors
+import shutil
+import struct
+import subprocess
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+TAG_NAMES = ("artist", "title", "album", "track", "date")
+
+EXTENSIONS = frozenset(("mp3", "flac", "ogg", "oga", "opus", "m4a", "m4b"))
+FFPROBE_EXTENSIONS = frozenset((
+    "aac", "ac3", "aif", "aifc", "aiff", "ape", "dsf", "mka", "mpc", "wav", "wma", "wv",
+))
+
+PROBE_PROCS = max(1, int(os.getenv("BULKY_FFPROBE_PROCS", str(os.cpu_count() or 1))))
+PROBE_TIMEOUT_SECONDS = 20
+_probe_slots = threading.BoundedSemaphore(PROBE_PROCS)
+_ffprobe = shutil.which("ffprobe")
+
+# Vorbis comment packets and MP4 item lists can embed cover art; don't read
+# more than this looking for the text fields
+MAX_TAG_BYTES = 4 * 1024 * 1024
+
+_ID3_FRAMES = {
+    "TPE1": "artist", "TP1": "artist",
+    "TIT2": "title", "TT2": "title",
+    "TALB": "album", "TAL": "album",
+    "TRCK": "track", "TRK": "track",
+    "TDRC": "date", "TYER": "date", "TYE": "date",
+}
+
+_VORBIS_FIELDS = {
+    "ARTIST": "artist",
+    "TITLE": "title",
+    "ALBUM": "album",
+    "TRACKNUMBER": "track",
+    "DATE": "date",
+}
+
+_MP4_ATOMS = {
+    b"\xa9ART": "artist",
+    b"\xa9nam": "title",
+    b"\xa9alb": "album",
+    b"trkn": "track",
+    b"\xa9day": "date",
+}
+
+_ID3_ENCODINGS = ("latin-1", "utf-16", "utf-16-be", "utf-8")
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _set(tags, name, value):
+    # The first occurrence of a field wins
+    value = value.strip() if value else ""
+    if value and name not in tags:
+        tags[name] = value
+
+
+def _id3_text(data):
+    if not data or data[0] >= len(_ID3_ENCODINGS):
+        return None
+    encoding = _ID3_ENCODINGS[data[0]]
+    text = data[1:].decode(encoding, "replace")
+    # v2.4 separates multiple values with NUL; keep the first
+    return text.split("\0", 1)[0]
+
+
+def _read_id3v2(f, tags):
+    """Parse an ID3v2 tag at the current position. Returns its total size."""
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"ID3":
+        return 0
+    version = header[3]
+    flags = header[5]
+    size = _syncsafe(header[6:10])
+    total = 10 + size + (10 if flags & 0x10 else 0)
+    if version not in (2, 3, 4):
+        return total
+
+    data = f.read(size)
+    if flags & 0x80 and version < 4:
+        # v2.2/2.3 unsynchronise the whole tag; v2.4 does it per frame
+        data = data.replace(b"\xff\x00", b"\xff")
+
+    pos = 0
+    if flags & 0x40 and version == 3:
+        pos = 4 + struct.unpack(">I", data[:4])[0]
+    elif flags & 0x40 and version == 4:
+        pos = _syncsafe(data[:4])
+
+    id_size, header_size = (3, 6) if version == 2 else (4, 10)
+    while pos + header_size <= len(data):
+        frame_id = data[pos:pos + id_size]
+        if not frame_id.isalnum():
+            # Padding
+            break
+        if version == 2:
+            frame_size = int.from_bytes(data[pos + 3:pos + 6], "big")
+            frame_flags = 0
+        elif version == 3:
+            frame_size = struct.unpack(">I", data[pos + 4:pos + 8])[0]
+            frame_flags = struct.unpack(">H", data[pos + 8:pos + 10])[0]
+        else:
+            frame_size = _syncsafe(data[pos + 4:pos + 8])
+            frame_flags = struct.unpack(">H", data[pos + 8:pos + 10])[0]
+        start = pos + header_size
+        pos = start + frame_size
+
+        name = _ID3_FRAMES.get(frame_id.decode("ascii"))
+        if name is None or name in tags:
+            continue
+        frame = data[start:pos]
+        if version == 3:
+            if frame_flags & 0x0040:
+                # Encrypted
+                continue
+            if frame_flags & 0x0020:
+                frame = frame[1:]
+            if frame_flags & 0x0080:
+                frame = zlib.decompress(frame[4:])
+        elif version == 4:
+            if frame_flags & 0x0004:
+                continue
+            if frame_flags & 0x0040:
+                frame = frame[1:]
+            if frame_flags & 0x0001:
+                frame = frame[4:]
+            if frame_flags & 0x0002 or flags & 0x80:
+                frame = frame.replace(b"\xff\x00", b"\xff")
+            if frame_flags & 0x0008:
+                frame = zlib.decompress(frame)
+        _set(tags, name, _id3_text(frame))
+    return total
+
+
+def _read_id3v1(f, tags):
+    try:
+        f.seek(-128, 2)
+    except OSError:
+        return
+    data = f.read(128)
+    if len(data) < 128 or data[:3] != b"TAG":
+        return
+
+    def field(start, end):
+        return data[start:end].split(b"\0", 1)[0].decode("latin-1")
+
+    _set(tags, "title", field(3, 33))
+    _set(tags, "artist", field(33, 63))
+    _set(tags, "album", field(63, 93))
+    _set(tags, "date", field(93, 97))
+    # ID3v1.1 keeps the track number in the last byte of the comment
+    if data[125] == 0 and data[126]:
+        _set(tags, "track", str(data[126]))
+
+
+def _parse_vorbis_comment(data, tags):
+    """Parse a Vorbis comment block; a truncated block yields what it holds."""
+    if len(data) < 8:
+        return
+    vendor_length = struct.unpack_from("<I", data, 0)[0]
+    pos = 4 + vendor_length
+    if pos + 4 > len(data):
+        return
+    count = struct.unpack_from("<I", data, pos)[0]
+    pos += 4
+    for _i in range(count):
+        if pos + 4 > len(data):
+            return
+        length = struct.unpack_from("<I", data, pos)[0]
+        pos += 4
+        comment = data[pos:pos + length]
+        pos += length
+        key, sep, value = comment.partition(b"=")
+        if not sep:
+            continue
+        name = _VORBIS_FIELDS.get(key.decode("ascii", "replace").upper())
+        if name is not None:
+            _set(tags, name, value.decode("utf-8", "replace"))
+
+
+def _read_flac(f, tags):
+    if f.read(4) != b"fLaC":
+        return
+    while True:
+        header = f.read(4)
+        if len(header) < 4:
+            return
+        last = header[0] & 0x80
+        block_type = header[0] & 0x7F
+        length = int.from_bytes(header[1:4], "big")
+        if block_type == 4:
+            _parse_vorbis_comment(f.read(min(length, MAX_TAG_BYTES)), tags)
+            return
+        if last:
+            return
+        f.seek(length, 1)
+
+
+def _ogg_packets(f):
+    """Yield the packets of the first logical stream of an Ogg file."""
+    packet = b""
+    serial = None
+    while True:
+        header = f.read(27)
+        if len(header) < 27 or header[:4] != b"OggS":
+            return
+        page_serial = struct.unpack_from("<I", header, 14)[0]
+        segments = f.read(header[26])
+        body = f.read(sum(segments))
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            # Interleaved page of another stream
+            continue
+        pos = 0
+        for lacing in segments:
+            packet += body[pos:pos + lacing]
+            pos += lacing
+            if lacing < 255:
+                yield packet
+                packet = b""
+        if len(packet) >= MAX_TAG_BYTES:
+            yield packet
+            return
+
+
+def _read_ogg(f, tags):
+    packets = _ogg_packets(f)
+    head = next(packets, b"")
+    if head.startswith(b"OpusHead"):
+        prefix = b"OpusTags"
+    elif head.startswith(b"\x01vorbis"):
+        prefix = b"\x03vorbis"
+    else:
+        return
+    comment = next(packets, b"")
+    if comment.startswith(prefix):
+        _parse_vorbis_comment(comment[len(prefix):], tags)
+
+
+def _atoms(f, start, end):
+    """Yield (type, payload offset, atom end) for MP4 atoms in [start, end)."""
+    pos = start
+    while end is None or pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, atom_type = struct.unpack(">I4s", header)
+        payload = pos + 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            f.seek(0, 2)
+            size = f.tell() - pos
+        if size < payload - pos:
+            return
+        yield atom_type, payload, pos + size
+        pos += size
+
+
+def _find_atom(f, start, end, atom_type):
+    return next(((s, e) for t, s, e in _atoms(f, start, end) if t == atom_type), None)
+
+
+def _read_mp4(f, tags):
+    moov = _find_atom(f, 0, None, b"moov")
+    udta = moov and _find_atom(f, moov[0], moov[1], b"udta")
+    meta = udta and _find_atom(f, udta[0], udta[1], b"meta")
+    if not meta:
+        return
+    # meta is a full box in MP4 files but not in some QuickTime writers
+    f.seek(meta[0] + 4)
+    start = meta[0] + (0 if f.read(4) == b"hdlr" else 4)
+    ilst = _find_atom(f, start, meta[1], b"ilst")
+    if not ilst:
+        return
+    for item_type, item_start, item_end in list(_atoms(f, ilst[0], ilst[1])):
+        name = _MP4_ATOMS.get(item_type)
+        if name is None or name in tags:
+            continue
+        data = _find_atom(f, item_start, item_end, b"data")
+        if not data or data[1] - data[0] > MAX_TAG_BYTES:
+            continue
+        f.seek(data[0])
+        payload = f.read(data[1] - data[0])
+        # 4 bytes of type/flags and 4 of locale precede the value
+        value = payload[8:]
+        if item_type == b"trkn":
+            if len(value) >= 4:
+                track = struct.unpack(">H", value[2:4])[0]
+                if track:
+                    _set(tags, name, str(track))
+        elif payload[1:4] == b"\0\0\x01":
+            _set(tags, name, value.decode("utf-8", "replace"))
+
+
+def read_tags(path):
+    """Return {name: value} for the TAG_NAMES present in path's tags.
+
+    The container is recognised by its magic bytes, not its extension.
+    Returns an empty dict for untagged or unreadable files.
+    """
+    tags = {}
+    try:
+        with open(path, "rb") as f:
+            head = f.read(12)
+            f.seek(0)
+            if head[:3] == b"ID3":
+                tag_size = _read_id3v2(f, tags)
+                f.seek(tag_size)
+                if f.read(4) == b"fLaC":
+                    # FLAC with a (non-standard) leading ID3 tag
+                    f.seek(tag_size)
+                    _read_flac(f, tags)
+                elif not ("artist" in tags and "title" in tags):
+                    _read_id3v1(f, tags)
+            elif head[:4] == b"fLaC":
+                _read_flac(f, tags)
+            elif head[:4] == b"OggS":
+                _read_ogg(f, tags)
+            elif head[4:8] == b"ftyp":
+                _read_mp4(f, tags)
+            else:
+                _read_id3v1(f, tags)
+    except (OSError, struct.error, IndexError, ValueError, zlib.error) as e:
+        logger.debug("Tag read failed for %s: %s", path, str(e))
+    return tags
+
+
+def have_ffprobe():
+    return _ffprobe is not None
+
+
+def _parse_probe(output):
+    try:
+        fmt = json.loads(output or b"{}").get("format", {})
+    except ValueError:
+        return {}
+    tags = {}
+    # Tag case depends on the container (ARTIST in Matroska, artist elsewhere)
+    for key, value in fmt.get("tags", {}).items():
+        key = key.lower()
+        name = "track" if key == "tracknumber" else key
+        if name in TAG_NAMES:
+            _set(tags, name, str(value))
+    if fmt.get("duration"):
+        tags["duration"] = fmt["duration"]
+    return tags
+
+
+def probe_many(paths):
+    """Yield (path, tags) for each path using ffprobe, in completion order.
+
+    tags is like read_tags() plus "duration" (seconds, as a string). Up to
+    PROBE_PROCS ffprobe processes run concurrently, shared with every other
+    caller, and each one's JSON is parsed as soon as its output closes.
+    """
+    pending = list(reversed(paths))
+    running = {}
+    selector = selectors.DefaultSelector()
+
+    def launch(path):
+        try:
+            proc = subprocess.Popen(
+                [_ffprobe, "-v", "quiet", "-of", "json",
+                 "-show_entries", "format=duration:format_tags", path],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            logger.debug("ffprobe failed for %s: %s", path, str(e))
+            _probe_slots.release()
+            return False
+        running[proc.stdout] = (proc, path, [], time.monotonic() + PROBE_TIMEOUT_SECONDS)
+        selector.register(proc.stdout, selectors.EVENT_READ)
+        return True
+
+    def reap(stdout):
+        proc, _path, chunks, _deadline = running.pop(stdout)
+        selector.unregister(stdout)
+        stdout.close()
+        proc.wait()
+        _probe_slots.release()
+        return proc.returncode == 0, b"".join(chunks)
+
+    try:
+        while pending or running:
+            # Block for a slot only when nothing of ours is running to free one
+            while pending and _probe_slots.acquire(blocking=not running):
+                path = pending.pop()
+                if not launch(path):
+                    yield path, {}
+
+            for key, _events in selector.select(timeout=1):
+                _proc, path, chunks, _deadline = running[key.fileobj]
+                data = os.read(key.fd, 65536)
+                if data:
+                    chunks.append(data)
+                    continue
+                ok, output = reap(key.fileobj)
+                yield path, _parse_probe(output) if ok else {}
+
+            now = time.monotonic()
+            expired = [stdout for stdout, (_proc, _path, _chunks, deadline) in running.items()
+                       if now > deadline]
+            for stdout in expired:
+                proc, path, _chunks, _deadline = running[stdout]
+                logger.debug("ffprobe timed out for %s", path)
+                proc.kill()
+                reap(stdout)
+                yield path, {}
+    finally:
+        for stdout in list(running):
+            running[stdout][0].kill()
+            reap(stdout)
+        selector.close()
+
+
+def probe_tags(path):
+    """ffprobe tags for a single file; see probe_many()."""
+    for _path, tags in probe_many([path]):
+        return tags
+    return {}
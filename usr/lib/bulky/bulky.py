@@ -10,12 +10,19 @@ import setproctitle
 import warnings
 import sys
 import functools
-import unidecode
+import itertools
 import time
 import threading
-import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 
+import hashing
+import normalize
+import templates
+from metacache import MetadataCache
+from thumbcache import SurfaceCache, ThumbnailStore, identity_key
+
 # Cache and logging locations
 CACHE_ROOT = Path(os.getenv("BULKY_CACHE_DIR", os.path.expanduser("~/.cache/bulky")))
 LOG_DIR = CACHE_ROOT / "logs"
@@ -49,8 +56,13 @@ ENABLE_TELEMETRY = os.getenv('BULKY_TELEMETRY', '0') == '1'
 _perf_markers = {}
 
 THUMB_DISABLE = os.getenv('BULKY_DISABLE_THUMBS', '0') == '1'
+# Read and write the shared freedesktop thumbnail cache instead of our own store
+THUMB_XDG = os.getenv('BULKY_THUMB_XDG', '0') == '1'
 THUMB_CACHE_MAX_MB = float(os.getenv('BULKY_THUMB_CACHE_MAX_MB', '100'))
 THUMB_CACHE_MAX_AGE_DAYS = int(os.getenv('BULKY_THUMB_CACHE_MAX_AGE_DAYS', '30'))
+SURFACE_CACHE_MAX_MB = float(os.getenv('BULKY_SURFACE_CACHE_MAX_MB', '32'))
+META_CACHE_MAX_ENTRIES = int(os.getenv('BULKY_META_CACHE_MAX_ENTRIES', '200000'))
+THUMB_WORKERS = max(1, int(os.getenv('BULKY_THUMB_WORKERS', str(min(4, os.cpu_count() or 1)))))
 
 def mark_time(label):
     """Record timing marker for performance analysis."""
@@ -71,6 +83,10 @@ warnings.filterwarnings("ignore")
 gi.require_version("Gtk", "3.0")
 from gi.repository import Gtk, Gdk, Gio, GdkPixbuf, GLib
 
+import phash
+from thumbgen import (can_generate, generate_thumbnail, is_video, load_xdg_thumbnail,
+                      save_xdg_thumbnail, scale_to_fit, video_thumbnailer, xdg_flavor_for)
+
 setproctitle.setproctitle("bulky")
 
 # i18n
@@ -81,7 +97,11 @@ gettext.bindtextdomain(APP, LOCALE_DIR)
 gettext.textdomain(APP)
 _ = gettext.gettext
 
-COL_ICON, COL_NAME, COL_NEW_NAME, COL_FILE, COL_PIXBUF = range(5)
+from tools import (DuplicateTool, ExifDateTool, ExtensionTool, HashTool, Id3Tool, NormalizeTool,
+                   SimilarImageTool)
+from toolrunner import ToolRunner
+
+COL_ICON, COL_NAME, COL_NEW_NAME, COL_FILE = range(4)
 SCOPE_NAME_ONLY = "name"
 SCOPE_EXTENSION_ONLY = "extension"
 SCOPE_ALL = "all"
@@ -119,12 +139,30 @@ class FolderFileChooserDialog(Gtk.Dialog):
 
         return Gdk.EVENT_PROPAGATE
 
+# Gio.Icon objects interned by content type: 10k JPEGs share one icon
+_icons_by_type = {}
+_icons_lock = threading.Lock()
+FOLDER_ICON = Gio.ThemedIcon.new("folder")
+GENERIC_ICON = Gio.ThemedIcon.new("text-x-generic")
+
+def shared_icon(content_type, icon):
+    if not content_type or icon is None:
+        return icon or GENERIC_ICON
+    with _icons_lock:
+        return _icons_by_type.setdefault(content_type, icon)
+
 # This is a data structure representing
 # the file object
 class FileObject():
     def __init__(self, path_or_uri, scale):
         self.gfile = self.create_gfile(path_or_uri)
         self.scale = scale
+        # Stable identity of the model row showing this file (set by MainWindow)
+        self.row_id = None
+        # Name proposed by the last tool run; operations apply on top of it
+        self.tool_name = None
+        # Tool cache_kind -> (identity, value) of values already extracted
+        self.tool_values = {}
         self._update_info()
 
     def create_gfile(self, path_or_uri):
@@ -139,13 +177,15 @@ class FileObject():
 
     def _update_info(self):
         self.info = None
+        # Template field -> value, looked up on first use (see templates.py)
+        self.template_values = {}
         self.uri = self.gfile.get_uri()
         self.name = self.gfile.get_basename() # temp in case query_info fails to get edit-name
-        self.icon = Gio.ThemedIcon.new("text-x-generic")
-        self.pixbuf = None
+        self.icon = GENERIC_ICON
 
         attrs = ",".join([
             "standard::type",
+            "standard::content-type",
             "standard::icon",
             "standard::edit-name",
             "standard::size",
@@ -160,18 +200,10 @@ class FileObject():
             self.name = self.info.get_edit_name()
 
             if self.info.get_file_type() == Gio.FileType.DIRECTORY:
-                self.icon = Gio.ThemedIcon.new("folder")
+                self.icon = FOLDER_ICON
             else:
-                # Defer thumbnail loading to lazy path (UI renderer)
-                # Keep metadata only; pixbuf will be populated asynchronously
-                self.pixbuf = None
-
-                info_icon = self.info.get_icon()
-
-                if info_icon:
-                    self.icon = info_icon
-                else:
-                    self.icon = Gio.ThemedIcon.new("text-x-generic")
+                # Thumbnails are loaded lazily by the UI renderer
+                self.icon = shared_icon(self.info.get_content_type(), self.info.get_icon())
         except GLib.Error as e:
             if e.code == Gio.IOErrorEnum.NOT_FOUND:
                 logger.warning("file %s does not exist", self.uri)
@@ -234,6 +266,136 @@ class FileObject():
     def is_a_dir(self):
         return self.info.get_file_type() == Gio.FileType.DIRECTORY
 
+    def template_value(self, field):
+        try:
+            return self.template_values[field]
+        except KeyError:
+            pass
+        value = None
+        try:
+            if field == "d":
+                if self.info is not None and self.info.has_attribute("time::modified"):
+                    value = datetime.fromtimestamp(self.info.get_attribute_uint64("time::modified"))
+            elif field == "s":
+                if self.info is not None:
+                    value = self.info.get_size()
+            elif field == "p":
+                parent = self.gfile.get_parent()
+                if parent is not None:
+                    value = parent.get_basename()
+            elif field == "e":
+                # Read off the main loop by MainWindow._load_template_exif()
+                # or an EXIF tool run; empty and not memoized until then
+                memo = self.tool_values.get("exif")
+                if memo is None:
+                    return None
+                value = memo[1]
+        except Exception as e:
+            logger.debug("Failed to get '%s' for %s: %s", field, self.uri, str(e))
+        self.template_values[field] = value
+        return value
+
+@functools.lru_cache(maxsize=32)
+def compile_regex(pattern, flags):
+    """Cache compiled regex patterns to avoid recompilation.
+
+    Raises:
+        ValueError: If pattern is invalid regex syntax
+    """
+    try:
+        compiled = re.compile(pattern, flags)
+        return compiled
+    except re.error as e:
+        logger.warning(f"Invalid regex '{pattern}': {e}")
+        raise ValueError(f"Invalid regular expression: {e}")
+
+def escape_replacement(value):
+    """value with its backslashes doubled if it is a string, so that
+    metadata put into a re.sub() replacement is taken literally."""
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\")
+    return value
+
+def find_pattern(params):
+    """The compiled search of replace params, None if the search is empty."""
+    find = params['find']
+    if not find:
+        return None
+    if not params['regex']:
+        find = find.replace("*", "~~~REGSTAR~~~")
+        find = find.replace("?", "~~~REGQUES~~~")
+        find = re.escape(find)
+        find = find.replace(re.escape("~~~REGSTAR~~~"), ".+")
+        find = find.replace(re.escape("~~~REGQUES~~~"), ".")
+    flags = 0 if params['case'] else re.IGNORECASE
+    return compile_regex(find, flags)
+
+# One step of the operation chain: which operation, a snapshot of its
+# settings and the last result for each row. A row is only recomputed
+# when its input or position differ from the memo, or after the settings
+# change (which clears the memo).
+class OperationStage():
+    def __init__(self, operation_id, params):
+        self.operation_id = operation_id
+        # row_id -> (index, input name, output name)
+        self.memo = {}
+        # input -> output, for stages whose result does not depend on the index
+        self.results = {}
+        self.set_params(params)
+
+    def set_params(self, params):
+        self.params = params
+        # Set when the params cannot be applied; the stage is then skipped
+        self.error = None
+        if self.operation_id == "replace":
+            # Compiled here rather than per row, so an invalid expression
+            # is reported once; replace_text() gets it as params['pattern']
+            try:
+                pattern = find_pattern(params)
+            except ValueError as e:
+                pattern = None
+                self.error = str(e)
+            self.params = dict(params, pattern=pattern)
+            template = templates.compile(params['replace'])
+        elif self.operation_id == "insert":
+            template = templates.compile(params['text'])
+        else:
+            template = None
+        self.uses_index = template is not None and template.uses_index
+        # Metadata fields the template looks up, e.g. ("e",)
+        self.fields = template.row_fields if template is not None else ()
+        # Metadata tokens make the result depend on the file, not just the name
+        self.uses_file = bool(self.fields)
+        self.reset()
+
+    def reset(self):
+        self.memo.clear()
+        self.results.clear()
+
+    def apply(self, compute, file_obj, index, name):
+        if self.error is not None:
+            return name
+        # Moving a row only matters if the stage numbers rows
+        key_index = index if self.uses_index else None
+        entry = self.memo.get(file_obj.row_id)
+        if entry is not None and entry[0] == key_index and entry[1] == name:
+            return entry[2]
+        new_name = compute(self, file_obj, index, name)
+        self.memo[file_obj.row_id] = (key_index, name, new_name)
+        return new_name
+
+    def evaluate(self, function, file_obj, index, string):
+        """function(index, string, params, file_obj), computed only once per
+        distinct string when the stage uses neither the index nor the file
+        (e.g. a case change of the extensions of 100k files has a handful
+        of distinct inputs)."""
+        if self.uses_index or self.uses_file:
+            return function(index, string, self.params, file_obj)
+        result = self.results.get(string)
+        if result is None:
+            result = self.results[string] = function(index, string, self.params, file_obj)
+        return result
+
 class MyApplication(Gtk.Application):
     # Main initialization routine
     def __init__(self, application_id, flags):
@@ -258,7 +420,20 @@ class MainWindow():
         self.application = application
         self.settings = Gio.Settings(schema_id="org.x.bulky")
         self.icon_theme = Gtk.IconTheme.get_default()
-        self.operation_function = self.replace_text
+        self._icon_pixbufs = {}
+        self._icon_surfaces = {}
+        self._icon_pixbufs_lock = threading.Lock()
+        self.operation_functions = {
+            "replace": self.replace_text,
+            "remove": self.remove_text,
+            "insert": self.insert_text,
+            "case": self.change_case,
+        }
+        # The operation chain; the widgets show the settings of the active stage
+        self.stages = []
+        self.active_stage = None
+        # Set while stage settings are loaded into the widgets
+        self.loading_stage = True
         self.scope = SCOPE_NAME_ONLY
         # used to prevent collisions
         self.uris = []
@@ -269,14 +444,16 @@ class MainWindow():
         self._thumb_cache_dir = CACHE_ROOT / "thumbnails"
         self._thumb_cache_max_mb = max(1, THUMB_CACHE_MAX_MB)
         self._thumb_max_age_days = max(1, THUMB_CACHE_MAX_AGE_DAYS)
+        self._thumb_store = None
         try:
-            self._thumb_cache_dir.mkdir(parents=True, exist_ok=True)
-            # Cleanup old thumbnails on startup
-            self._cleanup_old_thumbnails(max_age_days=self._thumb_max_age_days,
-                                        max_size_mb=self._thumb_cache_max_mb)
+            self._thumb_store = ThumbnailStore(self._thumb_cache_dir)
         except Exception as e:
-            logger.debug("Failed to create cache dir: %s", str(e))
+            logger.debug("Failed to open thumbnail store: %s", str(e))
         self._thumb_pending = set()
+        self._thumb_pool = ThreadPoolExecutor(max_workers=THUMB_WORKERS,
+                                              thread_name_prefix="bulky-thumb")
+        # Ready-to-paint surfaces, keyed by FileObject so they follow renames
+        self._surface_cache = SurfaceCache(int(max(1, SURFACE_CACHE_MAX_MB) * 1024 * 1024))
 
         # Set the Glade file
         gladefile = "/usr/share/bulky/bulky.ui"
@@ -351,6 +528,24 @@ class MainWindow():
         item.connect("activate", self.on_tool_hash_rename)
         tools_menu.append(item)
         
+        # Duplicate Finder
+        item = Gtk.ImageMenuItem(label=_("Find Duplicates..."))
+        item.set_image(Gtk.Image.new_from_icon_name("edit-copy-symbolic", Gtk.IconSize.MENU))
+        item.connect("activate", self.on_tool_find_duplicates)
+        tools_menu.append(item)
+        
+        # Similar Images
+        item = Gtk.ImageMenuItem(label=_("Group Similar Images..."))
+        item.set_image(Gtk.Image.new_from_icon_name("image-x-generic-symbolic", Gtk.IconSize.MENU))
+        item.connect("activate", self.on_tool_similar_images)
+        tools_menu.append(item)
+        
+        # Extension Fixer
+        item = Gtk.ImageMenuItem(label=_("Fix Extensions from Content..."))
+        item.set_image(Gtk.Image.new_from_icon_name("dialog-question-symbolic", Gtk.IconSize.MENU))
+        item.connect("activate", self.on_tool_fix_extensions)
+        tools_menu.append(item)
+        
         # Normalize Names
         item = Gtk.ImageMenuItem(label=_("Normalize Names..."))
         item.set_image(Gtk.Image.new_from_icon_name("preferences-desktop-locale-symbolic", Gtk.IconSize.MENU))
@@ -358,6 +553,12 @@ class MainWindow():
         tools_menu.append(item)
         
         tools_menu.append(Gtk.SeparatorMenuItem())
+        
+        # Clear Tool Results
+        item = Gtk.ImageMenuItem(label=_("Clear Tool Results"))
+        item.set_image(Gtk.Image.new_from_icon_name("edit-clear-symbolic", Gtk.IconSize.MENU))
+        item.connect("activate", self.on_tool_clear)
+        tools_menu.append(item)
         menu.append(tools_item)
         
         # About
@@ -403,7 +604,7 @@ class MainWindow():
         self.treeview.append_column(column)
 
         self.treeview.show()
-        self.model = Gtk.TreeStore(Gio.Icon, str, str, object, GdkPixbuf.Pixbuf) # icon, name, new_name, file, pixbuf
+        self.model = Gtk.TreeStore(Gio.Icon, str, str, object) # icon, name, new_name, file
         self.model.set_sort_column_id(COL_NAME, Gtk.SortType.ASCENDING)
         self.treeview.set_model(self.model)
         self.treeview.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
@@ -416,6 +617,12 @@ class MainWindow():
         self.combo_scope = self.builder.get_object("combo_scope")
         self.combo_scope.set_active_id(self.settings.get_string(MRU_SCOPE))
         self.combo_scope.connect("changed", self.on_scope_changed)
+        self.operation_labels = {row[1]: row[0] for row in self.combo_operation.get_model()}
+        self.combo_stage = self.builder.get_object("combo_stage")
+        self.combo_stage.connect("changed", self.on_stage_changed)
+        self.builder.get_object("add_stage_button").connect("clicked", self.on_add_stage_button)
+        self.remove_stage_button = self.builder.get_object("remove_stage_button")
+        self.remove_stage_button.connect("clicked", self.on_remove_stage_button)
 
         self.stack = self.builder.get_object("stack")
         self.infobar = self.builder.get_object("infobar")
@@ -506,8 +713,14 @@ class MainWindow():
         self.radio_firstuppercase.connect("toggled", self.on_widget_change)
         self.radio_accents.connect("toggled", self.on_widget_change)
 
+        # The chain starts with a single stage holding the current settings
+        operation_id = self.combo_operation.get_active_id()
+        self.stages.append(OperationStage(operation_id, self.read_params(operation_id)))
+        self.loading_stage = False
+        self.select_stage(0)
+
         # Tooltips
-        variables_tooltip = _("Use %n, %0n, %00n, %000n, etc. to enumerate.")
+        variables_tooltip = _("Use %n, %0n, %00n, %000n, etc. to enumerate, %d{%Y%m%d} for the modification date, %e{%Y%m%d} for the EXIF date, %s for the size, %p for the folder name and %% for a literal %.")
         self.replace_entry.set_tooltip_text(variables_tooltip)
         self.insert_entry.set_tooltip_text(variables_tooltip)
 
@@ -522,11 +735,30 @@ class MainWindow():
         
         # Initialize thread lock for model access
         self._model_lock = threading.Lock()
+
+        # Async producers address rows by id; results are applied once per frame
+        self._row_ids = itertools.count(1)
+        self._row_refs = {}
+        self._row_updates = []
+        self._row_updates_lock = threading.Lock()
+        self._row_flush_scheduled = False
+        self._row_flush_tick = None
         
+        self._meta_cache = None
+        # Background reads of the EXIF dates used by %e templates
+        self._exif_runners = set()
+        self._exif_requested = set()
+
         # Rollback state tracking
         self._last_rename_backup = []
         self._last_rename_success = []
 
+        self.icon_theme.connect("changed", self._on_icon_theme_changed)
+
+        # Evict old thumbnails once the window is up, off the startup path
+        GLib.idle_add(self._schedule_thumbnail_cleanup, priority=GLib.PRIORITY_LOW)
+        self.application.connect("shutdown", self._on_application_shutdown)
+
         if ENABLE_TELEMETRY:
             logger.info(
                 "startup_ms=%.1f ui_init_ms=%.1f cache_dir=%s log_dir=%s",
@@ -546,6 +778,7 @@ class MainWindow():
             ('<Control>e', self.on_tool_exif_rename),
             ('<Control>i', self.on_tool_id3_rename),
             ('<Control>h', self.on_tool_hash_rename),
+            ('<Control>u', self.on_tool_find_duplicates),
             ('<Control>l', self.on_tool_normalize),  # L for "limpar/clean"
         ]
         
@@ -555,40 +788,72 @@ class MainWindow():
                 accel_group.connect(key, mod, Gtk.AccelFlags.VISIBLE, 
                                    lambda *args, h=handler: (h(None) or True))
 
+    def _schedule_thumbnail_cleanup(self):
+        threading.Thread(target=self._cleanup_old_thumbnails,
+                         kwargs={"max_age_days": self._thumb_max_age_days,
+                                 "max_size_mb": self._thumb_cache_max_mb},
+                         daemon=True).start()
+        return False
+
     def _cleanup_old_thumbnails(self, max_age_days=30, max_size_mb=100):
-        """Remove old thumbnails or if cache exceeds max size."""
-        import time
-        
+        """Evict old thumbnails from the store and compact it if mostly dead space.
+
+        Runs on a background thread: entries are evicted by last access in
+        small batches, and only until the size budget is met.
+        """
+        store = self._thumb_store
+        if store is None:
+            return
+
+        t_start = time.perf_counter()
+        evicted = 0
+        compacted = False
         try:
-            cache_files = list(self._thumb_cache_dir.glob('*.png'))
-            if not cache_files:
-                return
-            
-            # Calculate total cache size
-            cache_size = sum(f.stat().st_size for f in cache_files)
-            cache_size_mb = cache_size / (1024 * 1024)
-            
-            if cache_size_mb > max_size_mb:
-                logger.info(f"Thumbnail cache is {cache_size_mb:.1f}MB, cleaning...")
-                # Remove oldest files first
-                files = sorted(cache_files, key=lambda f: f.stat().st_mtime)
-                for f in files[:len(files)//2]:  # Remove half of the oldest
-                    try:
-                        f.unlink()
-                    except Exception:
-                        pass
-            
-            # Remove thumbnails older than max_age_days
-            cutoff = time.time() - (max_age_days * 86400)
-            for f in cache_files:
+            # Drop the PNG files written by the old one-file-per-thumbnail cache
+            for f in self._thumb_cache_dir.glob('*.png'):
                 try:
-                    if f.stat().st_mtime < cutoff:
-                        f.unlink()
+                    f.unlink()
                 except Exception:
                     pass
+
+            for removed in store.iter_evict(max_age_days=max_age_days,
+                                             max_bytes=int(max_size_mb * 1024 * 1024)):
+                evicted += removed
+                time.sleep(0.005)  # Let thumbnail workers at the store lock
+            if evicted:
+                logger.info(f"Evicted {evicted} cached thumbnails")
+
+            if store.dead_bytes > max(store.live_bytes, 1024 * 1024):
+                store.compact()
+                compacted = True
+            elif store.stale_records > max(len(store), 4096):
+                # Mostly superseded access times: the index alone is rewritten
+                store.compact_index()
+                compacted = True
         except Exception as e:
             logger.warning(f"Failed to cleanup thumbnails: {e}")
 
+        if ENABLE_TELEMETRY:
+            logger.info("thumb_cleanup_ms=%.1f evicted=%d compacted=%s entries=%d",
+                        (time.perf_counter() - t_start) * 1000, evicted, compacted, len(store))
+
+    def _on_application_shutdown(self, application):
+        self._thumb_pool.shutdown(wait=False, cancel_futures=True)
+        video_thumbnailer.shutdown()
+        for runner in self._exif_runners:
+            runner.cancel()
+        if self._meta_cache is not None:
+            try:
+                self._meta_cache.close()
+            except Exception as e:
+                logger.debug("Failed to close metadata cache: %s", str(e))
+        if self._thumb_store is not None:
+            try:
+                self._thumb_store.flush_access_times()
+                self._thumb_store.close()
+            except Exception as e:
+                logger.debug("Failed to flush thumbnail store: %s", str(e))
+
     def _load_custom_css(self):
         """Load custom CSS for improved accessibility and visual focus."""
         try:
@@ -622,7 +887,6 @@ class MainWindow():
         Gtk.drag_finish(context, True, False, _time)
 
     def data_func_icon(self, column, cell, model, iter_, *args):
-        pixbuf = model.get_value(iter_, COL_PIXBUF)
         icon = model.get_value(iter_, COL_ICON)
         file_obj = model.get_value(iter_, COL_FILE)
 
@@ -631,8 +895,8 @@ class MainWindow():
             cell.set_property("gicon", icon)
             return
 
-        if pixbuf is not None:
-            surface = Gdk.cairo_surface_create_from_pixbuf(pixbuf, self.window.get_scale_factor())
+        surface = self._surface_cache.get(file_obj) if file_obj else None
+        if surface is not None:
             cell.set_property("gicon", None)
             cell.set_property("surface", surface)
         else:
@@ -642,36 +906,162 @@ class MainWindow():
             try:
                 if file_obj and (not file_obj.is_a_dir()) and file_obj.uri not in self._thumb_pending:
                     self._thumb_pending.add(file_obj.uri)
-                    self._load_thumbnail_async(iter_, file_obj)
+                    self._load_thumbnail_async(file_obj)
             except Exception as e:
                 logger.debug("Lazy thumbnail queue failed: %s", str(e))
 
-    def _thumb_cache_path(self, file_obj: 'FileObject'):
+    def _post_row_update(self, row_id, callback):
+        """Queue callback(iter) to run on the main loop against the row that
+        row_id refers to at that time. Safe to call from any thread; updates
+        for removed rows are dropped."""
+        with self._row_updates_lock:
+            self._row_updates.append((row_id, callback))
+            if self._row_flush_scheduled:
+                return
+            self._row_flush_scheduled = True
+        GLib.idle_add(self._schedule_row_flush)
+
+    def _schedule_row_flush(self):
+        # The frame clock only ticks while the treeview is mapped; otherwise
+        # flush from this idle callback straight away
+        if not self.treeview.get_mapped():
+            self._flush_row_updates(self.treeview, None)
+            return False
+        tick = self.treeview.add_tick_callback(self._flush_row_updates)
+        self._row_flush_tick = tick
+        # In case the treeview is unmapped before the next frame
+        GLib.timeout_add(250, self._row_flush_fallback, tick)
+        return False
+
+    def _row_flush_fallback(self, tick):
+        if self._row_flush_tick == tick:
+            self.treeview.remove_tick_callback(tick)
+            self._flush_row_updates(self.treeview, None)
+        return GLib.SOURCE_REMOVE
+
+    def _flush_row_updates(self, widget, frame_clock):
+        self._row_flush_tick = None
+        with self._row_updates_lock:
+            updates = self._row_updates
+            self._row_updates = []
+            self._row_flush_scheduled = False
+
+        with self._model_lock:
+            for row_id, callback in updates:
+                ref = self._row_refs.get(row_id)
+                if ref is None or not ref.valid():
+                    continue
+                try:
+                    callback(self.model.get_iter(ref.get_path()))
+                except Exception as e:
+                    logger.debug("Row update failed: %s", str(e))
+        return GLib.SOURCE_REMOVE
+
+    def _icon_pixbuf(self, icon, size, scale):
+        """Render icon once per (icon, size, scale); rows of the same content
+        type share the result until the icon theme changes."""
+        if icon is None:
+            return None
+        key = (icon.to_string(), size, scale)
+        with self._icon_pixbufs_lock:
+            pix = self._icon_pixbufs.get(key)
+            if pix is None:
+                info = self.icon_theme.lookup_by_gicon_for_scale(icon, size, scale,
+                                                                 Gtk.IconLookupFlags.FORCE_SIZE)
+                if info:
+                    pix = info.load_icon()
+                    self._icon_pixbufs[key] = pix
+            return pix
+
+    def _icon_surface(self, icon, size, scale):
+        """The surface of _icon_pixbuf(), likewise created once per
+        (icon, size, scale)."""
+        if icon is None:
+            return None
+        key = (icon.to_string(), size, scale)
+        with self._icon_pixbufs_lock:
+            surface = self._icon_surfaces.get(key)
+        if surface is None:
+            pix = self._icon_pixbuf(icon, size, scale)
+            if pix is None:
+                return None
+            surface = Gdk.cairo_surface_create_from_pixbuf(pix, scale, None)
+            with self._icon_pixbufs_lock:
+                surface = self._icon_surfaces.setdefault(key, surface)
+        return surface
+
+    def _on_icon_theme_changed(self, theme):
+        with self._icon_pixbufs_lock:
+            self._icon_pixbufs.clear()
+            self._icon_surfaces.clear()
+        self._surface_cache.clear()
+        self.treeview.queue_draw()
+
+    def _thumb_cache_key(self, file_obj: 'FileObject'):
+        # Key on file identity rather than its URI so thumbnails survive the
+        # renames this application exists to perform.
         try:
-            mtime = 0
+            scale = self.window.get_scale_factor()
             if file_obj.gfile.is_native():
-                try:
-                    path = file_obj.gfile.get_path()
-                    if path and os.path.exists(path):
-                        mtime = int(os.path.getmtime(path))
-                except Exception:
-                    mtime = 0
-            key_raw = f"{file_obj.uri}|{mtime}|{self.window.get_scale_factor()}"
-            key = hashlib.sha256(key_raw.encode('utf-8')).hexdigest()
-            return self._thumb_cache_dir / f"{key}.png"
+                path = file_obj.gfile.get_path()
+                if path:
+                    return f"{identity_key(os.stat(path))}|{scale}"
+            info = file_obj.info
+            mtime = info.get_attribute_uint64("time::modified") if info else 0
+            size = info.get_size() if info else 0
+            return f"{file_obj.uri}|{size}|{mtime}|{scale}"
         except Exception as e:
             logger.debug("Cache key error: %s", str(e))
             return None
 
-    def _load_thumbnail_async(self, iter_, file_obj: 'FileObject'):
-        # Run in a background thread to avoid blocking UI
+    def _thumb_mtime(self, file_obj: 'FileObject'):
+        try:
+            if file_obj.gfile.is_native():
+                return int(os.stat(file_obj.gfile.get_path()).st_mtime)
+            return file_obj.info.get_attribute_uint64("time::modified")
+        except Exception:
+            return 0
+
+    def _thumb_cache_load(self, key):
+        if self._thumb_store is None or key is None:
+            return None
+        hit = self._thumb_store.get(key)
+        if hit is None:
+            return None
+        pixels, width, height, rowstride, has_alpha = hit
+        return GdkPixbuf.Pixbuf.new_from_bytes(GLib.Bytes.new(pixels),
+                                               GdkPixbuf.Colorspace.RGB, has_alpha, 8,
+                                               width, height, rowstride)
+
+    def _thumb_cache_save(self, key, pix):
+        if self._thumb_store is None or key is None:
+            return
+        if pix.get_bits_per_sample() != 8 or pix.get_colorspace() != GdkPixbuf.Colorspace.RGB:
+            return
+        self._thumb_store.put(key, pix.read_pixel_bytes().get_data(),
+                              pix.get_width(), pix.get_height(),
+                              pix.get_rowstride(), pix.get_has_alpha())
+
+    def _load_thumbnail_async(self, file_obj: 'FileObject'):
+        # Run on the bounded thumbnail pool to avoid blocking UI
+        scale = self.window.get_scale_factor()
+        size = 22 * scale
+
         def worker():
             pix = None
+            cached = False
+            cache_key = None
+            mtime = None
             try:
-                cache_path = self._thumb_cache_path(file_obj)
-                if cache_path and cache_path.exists():
+                if THUMB_XDG:
+                    mtime = self._thumb_mtime(file_obj)
+                    pix = load_xdg_thumbnail(file_obj.uri, mtime, size)
+                    cached = pix is not None
+                else:
+                    cache_key = self._thumb_cache_key(file_obj)
                     try:
-                        pix = GdkPixbuf.Pixbuf.new_from_file(str(cache_path))
+                        pix = self._thumb_cache_load(cache_key)
+                        cached = pix is not None
                     except Exception:
                         pix = None
                 if pix is None:
@@ -683,46 +1073,62 @@ class MainWindow():
                     except Exception:
                         thumb_ok = False
                     if thumb_ok and thumb_path and os.path.exists(thumb_path):
-                        pix = GdkPixbuf.Pixbuf.new_from_file_at_scale(thumb_path, 22 * self.window.get_scale_factor(), 22 * self.window.get_scale_factor(), True)
-                    # Fallback: render themed icon to pixbuf
-                    if pix is None:
-                        try:
-                            icon = file_obj.icon
-                            if icon:
-                                theme = self.icon_theme
-                                info = theme.lookup_by_gicon(icon, 22, Gtk.IconLookupFlags.FORCE_SIZE)
-                                if info:
-                                    pix = info.load_icon()
-                        except Exception:
-                            pix = None
+                        pix = GdkPixbuf.Pixbuf.new_from_file_at_scale(thumb_path, size, size, True)
+                    # No XDG thumbnail yet: decode the image or video at reduced size ourselves
+                    if pix is None and file_obj.gfile.is_native():
+                        path = file_obj.gfile.get_path()
+                        if path and can_generate(path):
+                            # Share a spec-sized thumbnail with other applications
+                            gen_size = xdg_flavor_for(size)[1] if THUMB_XDG else size
+                            if is_video(path):
+                                # Batched on the video threads; don't hold this worker
+                                video_thumbnailer.submit(
+                                    path, gen_size, lambda frame: finish(frame, False, True, cache_key, mtime))
+                                return
+                            pix = generate_thumbnail(path, gen_size)
+                            finish(pix, cached, True, cache_key, mtime)
+                            return
+            except Exception as e:
+                logger.debug("Thumb worker error: %s", str(e))
+            finish(pix, cached, False, cache_key, mtime)
+
+        def finish(pix, cached, generated, cache_key, mtime):
+            surface = None
+            try:
+                if generated and pix is not None and THUMB_XDG:
+                    save_xdg_thumbnail(file_obj.uri, mtime, pix)
+                    pix = scale_to_fit(pix, size)
                 # Save to cache if new pix
-                if pix is not None:
+                if pix is not None and not cached and not THUMB_XDG:
                     try:
-                        cache_path = self._thumb_cache_path(file_obj)
-                        if cache_path:
-                            pix.savev(str(cache_path), 'png', [], [])
+                        self._thumb_cache_save(cache_key, pix)
                     except Exception:
                         pass
             except Exception as e:
                 logger.debug("Thumb worker error: %s", str(e))
             finally:
-                # Update UI on GTK main loop
-                def apply_pix():
-                    try:
-                        if pix is not None:
-                            try:
-                                with self._model_lock:
-                                    self.model.set_value(iter_, COL_PIXBUF, pix)
-                            except Exception:
-                                pass
-                        self._thumb_pending.discard(file_obj.uri)
-                    except Exception:
-                        pass
-                    return False
-                GLib.idle_add(apply_pix)
-
-        t = threading.Thread(target=worker, daemon=True)
-        t.start()
+                try:
+                    if pix is not None:
+                        surface = Gdk.cairo_surface_create_from_pixbuf(pix, scale, None)
+                        cost = pix.get_width() * pix.get_height() * 4
+                    else:
+                        # Fallback: the themed icon, whose surface every row of
+                        # the same content type shares, so it costs the budget
+                        # nothing and never evicts real thumbnails. Not saved
+                        # to the thumbnail cache, where it would shadow a real
+                        # thumbnail generated later.
+                        surface = self._icon_surface(file_obj.icon, 22, scale)
+                        cost = 0
+                    if surface is not None:
+                        self._surface_cache.put(file_obj, surface, cost)
+                        # Repaint whichever row holds the file by now
+                        self._post_row_update(file_obj.row_id,
+                                              lambda iter_: self.model.row_changed(self.model.get_path(iter_), iter_))
+                except Exception as e:
+                    logger.debug("Thumb surface error: %s", str(e))
+                self._thumb_pending.discard(file_obj.uri)
+
+        self._thumb_pool.submit(worker)
 
     def _create_tool_dialog(self, title, widgets, width=400, height=200):
         """Factory method for creating tool dialogs with consistent styling.
@@ -774,30 +1180,12 @@ class MainWindow():
 
     def on_tool_exif_rename(self, widget):
         """EXIF-based photo renaming tool."""
-        try:
-            from PIL import Image
-            from PIL.ExifTags import TAGS
-        except ImportError:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("Pillow library required")
-            )
-            dialog.format_secondary_text(
-                _("Please install Pillow:\npip3 install --user Pillow")
-            )
-            dialog.run()
-            dialog.destroy()
-            return
-        
         # Create widgets
         prefix_entry = Gtk.Entry()
         prefix_entry.set_placeholder_text(_("Optional (e.g., 'vacation_')"))
         
         info_label = Gtk.Label()
-        info_label.set_markup(_("<small>Only processes JPEG files with EXIF DateTimeOriginal</small>"))
+        info_label.set_markup(_("<small>Only processes JPEG, TIFF/RAW, HEIC, PNG and WebP files with EXIF DateTimeOriginal</small>"))
         
         widgets = [
             Gtk.Label(label=_("Format: YYYYMMDD_HHMMSS_NNN.ext")),
@@ -816,99 +1204,10 @@ class MainWindow():
     
     def _run_exif_rename(self, prefix=""):
         """Execute EXIF rename on loaded files."""
-        from datetime import datetime
-        try:
-            from PIL import Image
-            from PIL.ExifTags import TAGS
-        except ImportError:
-            return
-        
-        counter = 1
-        renamed_count = 0
-        
-        iter = self.model.get_iter_first()
-        while iter is not None:
-            file_obj = self.model.get_value(iter, COL_FILE)
-            old_name = file_obj.name
-            
-            # Only process images
-            if not old_name.lower().endswith(('.jpg', '.jpeg', '.JPG', '.JPEG')):
-                iter = self.model.iter_next(iter)
-                continue
-            
-            # Extract EXIF date
-            exif_date = None
-            try:
-                if file_obj.gfile.is_native():
-                    path = file_obj.gfile.get_path()
-                    img = Image.open(path)
-                    exif = img._getexif()
-                    if exif:
-                        for tag, value in exif.items():
-                            if TAGS.get(tag) == 'DateTimeOriginal':
-                                exif_date = datetime.strptime(value, '%Y:%m:%d %H:%M:%S')
-                                break
-            except Exception as e:
-                logger.debug(f"EXIF error for {old_name}: {e}")
-            
-            if exif_date:
-                ext = os.path.splitext(old_name)[1].lower()
-                new_name = f"{prefix}{exif_date.strftime('%Y%m%d_%H%M%S')}_{counter:03d}{ext}"
-                self.model.set_value(iter, COL_NEW_NAME, new_name)
-                renamed_count += 1
-            
-            counter += 1
-            iter = self.model.iter_next(iter)
-        
-        # Refresh preview
-        self.preview_changes()
-        
-        # Show result
-        if renamed_count > 0:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("EXIF Rename Complete")
-            )
-            dialog.format_secondary_text(
-                _("{} files renamed based on EXIF data.\nClick 'Rename' to apply changes.").format(renamed_count)
-            )
-            dialog.run()
-            dialog.destroy()
-        else:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.WARNING,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("No EXIF data found")
-            )
-            dialog.format_secondary_text(_("No JPEG files with valid EXIF DateTimeOriginal found."))
-            dialog.run()
-            dialog.destroy()
+        self._run_tool(ExifDateTool(prefix))
 
     def on_tool_id3_rename(self, widget):
         """ID3-based music renaming tool."""
-        import subprocess
-        
-        # Check for ffprobe
-        try:
-            subprocess.run(['ffprobe', '-version'], capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.ERROR,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("ffprobe required")
-            )
-            dialog.format_secondary_text(_("Please install ffmpeg:\nsudo apt install ffmpeg"))
-            dialog.run()
-            dialog.destroy()
-            return
-        
         # Simple confirmation dialog
         dialog = Gtk.MessageDialog(
             transient_for=self.window,
@@ -918,7 +1217,8 @@ class MainWindow():
             text=_("Rename by ID3 Tags")
         )
         dialog.format_secondary_text(
-            _("Format: Artist_-_Title.mp3\n\nOnly processes MP3 files with ID3 tags.")
+            _("Format: Artist_-_Title.ext\n\nProcesses MP3, FLAC, Ogg, Opus and M4A files with artist and title tags, "
+              "and WMA, WAV, APE and other formats when ffprobe is installed.")
         )
         
         response = dialog.run()
@@ -929,85 +1229,7 @@ class MainWindow():
     
     def _run_id3_rename(self):
         """Execute ID3 rename on loaded files."""
-        import subprocess
-        
-        renamed_count = 0
-        
-        iter = self.model.get_iter_first()
-        while iter is not None:
-            file_obj = self.model.get_value(iter, COL_FILE)
-            old_name = file_obj.name
-            
-            # Only process MP3
-            if not old_name.lower().endswith(('.mp3', '.MP3')):
-                iter = self.model.iter_next(iter)
-                continue
-            
-            # Extract ID3 tags
-            artist = None
-            title = None
-            try:
-                if file_obj.gfile.is_native():
-                    path = file_obj.gfile.get_path()
-                    
-                    # Get artist
-                    result = subprocess.run(
-                        ['ffprobe', '-v', 'quiet', '-show_entries', 'format_tags=artist',
-                         '-of', 'default=noprint_wrappers=1:nokey=1', path],
-                        capture_output=True, text=True
-                    )
-                    if result.returncode == 0:
-                        artist = result.stdout.strip()
-                    
-                    # Get title
-                    result = subprocess.run(
-                        ['ffprobe', '-v', 'quiet', '-show_entries', 'format_tags=title',
-                         '-of', 'default=noprint_wrappers=1:nokey=1', path],
-                        capture_output=True, text=True
-                    )
-                    if result.returncode == 0:
-                        title = result.stdout.strip()
-            except Exception as e:
-                logger.debug(f"ID3 error for {old_name}: {e}")
-            
-            if artist and title:
-                # Clean strings
-                artist_clean = unidecode.unidecode(artist).replace(' ', '_')
-                title_clean = unidecode.unidecode(title).replace(' ', '_')
-                new_name = f"{artist_clean}_-_{title_clean}.mp3"
-                self.model.set_value(iter, COL_NEW_NAME, new_name)
-                renamed_count += 1
-            
-            iter = self.model.iter_next(iter)
-        
-        # Refresh preview
-        self.preview_changes()
-        
-        # Show result
-        if renamed_count > 0:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("ID3 Rename Complete")
-            )
-            dialog.format_secondary_text(
-                _("{} files renamed based on ID3 tags.\nClick 'Rename' to apply changes.").format(renamed_count)
-            )
-            dialog.run()
-            dialog.destroy()
-        else:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.WARNING,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("No ID3 tags found")
-            )
-            dialog.format_secondary_text(_("No MP3 files with valid ID3 artist/title found."))
-            dialog.run()
-            dialog.destroy()
+        self._run_tool(Id3Tool())
 
     def on_tool_hash_rename(self, widget):
         """Hash-based file renaming tool."""
@@ -1037,9 +1259,8 @@ class MainWindow():
         hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
         hbox.pack_start(Gtk.Label(label=_("Algorithm:")), False, False, 0)
         algo_combo = Gtk.ComboBoxText()
-        algo_combo.append("sha256", "SHA256")
-        algo_combo.append("sha1", "SHA1")
-        algo_combo.append("md5", "MD5")
+        for algorithm, label in hashing.available_algorithms():
+            algo_combo.append(algorithm, label)
         algo_combo.set_active(0)
         hbox.pack_start(algo_combo, True, True, 0)
         box.pack_start(hbox, False, False, 6)
@@ -1071,68 +1292,94 @@ class MainWindow():
     
     def _run_hash_rename(self, algorithm="sha256", length=16):
         """Execute hash-based rename on loaded files."""
-        renamed_count = 0
-        seen_hashes = set()
-        
-        iter = self.model.get_iter_first()
-        while iter is not None:
-            file_obj = self.model.get_value(iter, COL_FILE)
-            old_name = file_obj.name
-            
-            # Calculate hash
-            file_hash = None
-            try:
-                if file_obj.gfile.is_native():
-                    path = file_obj.gfile.get_path()
-                    h = hashlib.new(algorithm)
-                    with open(path, 'rb') as f:
-                        while chunk := f.read(65536):
-                            h.update(chunk)
-                    file_hash = h.hexdigest()[:length]
-            except Exception as e:
-                logger.debug(f"Hash error for {old_name}: {e}")
-            
-            if file_hash:
-                # Check for duplicates
-                if file_hash in seen_hashes:
-                    logger.warning(f"Duplicate hash {file_hash} for {old_name}")
-                else:
-                    seen_hashes.add(file_hash)
-                    ext = os.path.splitext(old_name)[1]
-                    new_name = f"{file_hash}{ext}"
-                    self.model.set_value(iter, COL_NEW_NAME, new_name)
-                    renamed_count += 1
-            
-            iter = self.model.iter_next(iter)
-        
-        # Refresh preview
-        self.preview_changes()
-        
-        # Show result
-        if renamed_count > 0:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.INFO,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("Hash Rename Complete")
-            )
-            dialog.format_secondary_text(
-                _("{} files renamed by hash.\nClick 'Rename' to apply changes.").format(renamed_count)
-            )
-            dialog.run()
-            dialog.destroy()
-        else:
-            dialog = Gtk.MessageDialog(
-                transient_for=self.window,
-                flags=0,
-                message_type=Gtk.MessageType.WARNING,
-                buttons=Gtk.ButtonsType.OK,
-                text=_("Hash rename failed")
-            )
-            dialog.format_secondary_text(_("Unable to hash files. Check permissions."))
-            dialog.run()
-            dialog.destroy()
+        self._run_tool(HashTool(algorithm, length))
+
+    def on_tool_find_duplicates(self, widget):
+        """Duplicate content finder."""
+        algo_combo = Gtk.ComboBoxText()
+        for algorithm, label in hashing.available_algorithms():
+            algo_combo.append(algorithm, label)
+        algo_combo.set_active_id("blake2b")
+
+        action_combo = Gtk.ComboBoxText()
+        action_combo.append("suffix", _("Add _dupN suffix to copies"))
+        action_combo.append("mark", _("Prefix groups with their number"))
+        action_combo.append("exclude", _("Remove copies from the list"))
+        action_combo.set_active(0)
+
+        info_label = Gtk.Label()
+        info_label.set_markup(_("<small>The first file of each group is kept as the original</small>"))
+
+        widgets = [
+            self._create_labeled_entry(_("Algorithm:"), algo_combo),
+            self._create_labeled_entry(_("Action:"), action_combo),
+            info_label
+        ]
+
+        dialog = self._create_tool_dialog(_("Find Duplicates"), widgets)
+        response = dialog.run()
+        algorithm = algo_combo.get_active_id()
+        action = action_combo.get_active_id()
+        dialog.destroy()
+
+        if response == Gtk.ResponseType.OK:
+            self._run_find_duplicates(algorithm, action)
+
+    def _run_find_duplicates(self, algorithm="blake2b", action="suffix"):
+        """Execute duplicate detection on loaded files."""
+        self._run_tool(DuplicateTool(algorithm, action))
+
+    def on_tool_similar_images(self, widget):
+        """Perceptual-hash image grouping tool."""
+        distance_spin = Gtk.SpinButton()
+        distance_spin.set_range(0, phash.MAX_DISTANCE)
+        distance_spin.set_value(phash.DEFAULT_DISTANCE)
+        distance_spin.set_increments(1, 4)
+
+        info_label = Gtk.Label()
+        info_label.set_markup(_("<small>Finds resized and re-encoded copies; lower values are stricter</small>"))
+
+        widgets = [
+            Gtk.Label(label=_("Format: simNNNN_name.ext")),
+            self._create_labeled_entry(_("Max. difference (bits):"), distance_spin),
+            info_label
+        ]
+
+        dialog = self._create_tool_dialog(_("Group Similar Images"), widgets)
+        response = dialog.run()
+        max_distance = int(distance_spin.get_value())
+        dialog.destroy()
+
+        if response == Gtk.ResponseType.OK:
+            self._run_similar_images(max_distance)
+
+    def _run_similar_images(self, max_distance=phash.DEFAULT_DISTANCE):
+        """Execute perceptual-hash grouping on loaded images."""
+        self._run_tool(SimilarImageTool(max_distance))
+
+    def on_tool_fix_extensions(self, widget):
+        """Content-based extension fixing tool."""
+        dialog = Gtk.MessageDialog(
+            transient_for=self.window,
+            flags=0,
+            message_type=Gtk.MessageType.QUESTION,
+            buttons=Gtk.ButtonsType.OK_CANCEL,
+            text=_("Fix Extensions from Content")
+        )
+        dialog.format_secondary_text(
+            _("Identifies each file from its first 4 KB and proposes the matching extension "
+              "for files whose extension is wrong or missing.")
+        )
+
+        response = dialog.run()
+        dialog.destroy()
+
+        if response == Gtk.ResponseType.OK:
+            self._run_fix_extensions()
+
+    def _run_fix_extensions(self):
+        """Execute extension sniffing on loaded files."""
+        self._run_tool(ExtensionTool())
 
     def on_tool_normalize(self, widget):
         """Normalize file names (remove accents, special chars, etc.)."""
@@ -1156,33 +1403,196 @@ class MainWindow():
     
     def _run_normalize(self):
         """Execute name normalization on loaded files."""
-        renamed_count = 0
-        
+        self._run_tool(NormalizeTool())
+
+    def on_tool_clear(self, widget):
+        """Drop the names proposed by tools, back to the operation alone."""
+        iter = self.model.get_iter_first()
+        while iter is not None:
+            self.model.get_value(iter, COL_FILE).tool_name = None
+            iter = self.model.iter_next(iter)
+        self.preview_changes()
+
+    def _run_tool(self, tool):
+        """Run a Tools menu plugin over the loaded files without blocking the UI.
+
+        Per-file extraction happens on ToolRunner worker threads behind a
+        progress dialog that can cancel it; the proposed names are applied
+        once every file has been processed. Tools that need several passes
+        (see Tool.next_pass) get one runner per pass, each over the rows
+        the tool asked for.
+        """
+        rows = []
         iter = self.model.get_iter_first()
         while iter is not None:
             file_obj = self.model.get_value(iter, COL_FILE)
-            old_name = file_obj.name
-            
-            # Split name and extension
-            base, ext = os.path.splitext(old_name)
-            
-            # Normalize base name
-            normalized = unidecode.unidecode(base)
-            normalized = normalized.lower()
-            normalized = normalized.replace(' ', '_')
-            normalized = re.sub(r'[^a-z0-9._-]', '', normalized)
-            normalized = re.sub(r'__+', '_', normalized)
-            
-            if normalized and normalized != base:
-                new_name = normalized + ext.lower()
-                self.model.set_value(iter, COL_NEW_NAME, new_name)
-                renamed_count += 1
-            
+            if tool.accepts(file_obj):
+                rows.append(file_obj)
             iter = self.model.iter_next(iter)
-        
-        # Refresh preview
+
+        values = {}
+        tool.cache = self._get_meta_cache()
+        tool.start(len(rows))
+
+        # Show progress bar only for > 10 files
+        show_progress = len(rows) > 10
+        progress_dialog = None
+        progress_bar = None
+        runner = None
+        elapsed = 0.0
+        completed = 0
+
+        if show_progress:
+            progress_dialog = Gtk.Dialog(
+                title=tool.title,
+                transient_for=self.window,
+                modal=True
+            )
+            progress_dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL)
+            progress_bar = Gtk.ProgressBar()
+            progress_bar.set_show_text(True)
+            progress_bar.set_margin_top(12)
+            progress_bar.set_margin_bottom(12)
+            progress_bar.set_margin_start(12)
+            progress_bar.set_margin_end(12)
+            progress_dialog.get_content_area().add(progress_bar)
+            progress_dialog.set_default_size(400, 100)
+            progress_dialog.connect("response", lambda dialog, response: runner.cancel())
+            progress_dialog.connect("delete-event", lambda *args: runner.cancel() or True)
+            progress_dialog.show_all()
+        else:
+            self.window.set_sensitive(False)
+
+        def on_results(batch):
+            for index, file_obj, value in batch:
+                values[file_obj.row_id] = value
+
+        def on_progress(done, total):
+            if show_progress and total:
+                progress_bar.set_fraction(done / total)
+                progress_bar.set_text(f"{done}/{total}")
+
+        def on_done(cancelled):
+            nonlocal elapsed, completed
+            elapsed += runner.elapsed
+            completed += runner.completed
+            if not cancelled:
+                next_rows = tool.next_pass(runner.items, [values.get(f.row_id) for f in runner.items])
+                if next_rows:
+                    run_pass(next_rows)
+                    return
+
+            tool.finish()
+            if tool.cache is not None:
+                threading.Thread(target=tool.cache.flush, daemon=True).start()
+            if show_progress:
+                progress_dialog.destroy()
+            else:
+                self.window.set_sensitive(True)
+            if ENABLE_TELEMETRY:
+                logger.info("tool=%s tool_ms=%.1f count=%d workers=%d cancelled=%s",
+                            type(tool).__name__, elapsed * 1000, completed,
+                            runner.workers, cancelled)
+                if tool.cache is not None:
+                    logger.info(f"Metadata cache stats: {tool.cache.stats()}")
+                tool_stats = tool.stats()
+                if tool_stats:
+                    logger.info(f"{type(tool).__name__} stats: {tool_stats}")
+            if not cancelled:
+                self._apply_tool_results(tool, rows, [values.get(f.row_id) for f in rows])
+
+        def run_pass(pass_rows):
+            nonlocal runner
+            runner = ToolRunner(tool.cached_extract, pass_rows, GLib.idle_add,
+                                on_results=on_results, on_progress=on_progress,
+                                on_done=on_done, workers=tool.workers,
+                                chunk_size=tool.chunk_size,
+                                extract_chunk=tool.cached_extract_chunk if tool.chunk_size else None)
+            if show_progress and tool.pass_title:
+                progress_dialog.set_title(tool.pass_title)
+            runner.start()
+
+        run_pass(rows)
+
+    def _load_template_exif(self):
+        """Read the EXIF dates of %e templates on ToolRunner threads, through
+        the metadata cache, and preview again as they arrive. Each row is
+        requested once; rows without a date keep rendering %e empty."""
+        if not any("e" in stage.fields for stage in self.stages):
+            return
+        tool = ExifDateTool()
+        rows = []
+        iter = self.model.get_iter_first()
+        while iter is not None:
+            file_obj = self.model.get_value(iter, COL_FILE)
+            if "exif" not in file_obj.tool_values and file_obj.row_id not in self._exif_requested \
+                    and tool.accepts(file_obj):
+                rows.append(file_obj)
+            iter = self.model.iter_next(iter)
+        if not rows:
+            return
+        self._exif_requested.update(file_obj.row_id for file_obj in rows)
+        tool.cache = self._get_meta_cache()
+        tool.start(len(rows))
+
+        def on_results(batch):
+            if runner.cancelled or all(value is None for _index, _file_obj, value in batch):
+                return
+            for stage in self.stages:
+                if "e" in stage.fields:
+                    stage.reset()
+            self.preview_changes()
+
+        def on_done(cancelled):
+            self._exif_runners.discard(runner)
+            tool.finish()
+            if tool.cache is not None:
+                threading.Thread(target=tool.cache.flush, daemon=True).start()
+
+        # Batches a second apart: each one previews every row again
+        runner = ToolRunner(tool.cached_extract, rows, GLib.idle_add,
+                            on_results=on_results, on_done=on_done, workers=tool.workers,
+                            interval=1.0, chunk_size=tool.chunk_size,
+                            extract_chunk=tool.cached_extract_chunk if tool.chunk_size else None)
+        self._exif_runners.add(runner)
+        runner.start()
+
+    def _get_meta_cache(self):
+        # Opened on first use so startup does not pay for it
+        if self._meta_cache is None:
+            try:
+                self._meta_cache = MetadataCache(CACHE_ROOT / "metadata.db", META_CACHE_MAX_ENTRIES)
+            except Exception as e:
+                logger.warning(f"Failed to open metadata cache: {e}")
+        return self._meta_cache
+
+    def _apply_tool_results(self, tool, rows, results):
+        tool.begin()
+        proposed = {}
+        for file_obj, value in zip(rows, results):
+            new_name = tool.new_name(file_obj, value)
+            if new_name is not None:
+                proposed[file_obj.row_id] = new_name
+        renamed_count = len(proposed)
+
+        # The tool's names become the base the active operation works on,
+        # replacing whatever an earlier tool proposed
+        iter = self.model.get_iter_first()
+        while iter is not None:
+            file_obj = self.model.get_value(iter, COL_FILE)
+            file_obj.tool_name = proposed.get(file_obj.row_id)
+            iter = self.model.iter_next(iter)
+
+        excluded = []
+        for file_obj in rows:
+            ref = self._row_refs.get(file_obj.row_id)
+            if ref is not None and ref.valid() and tool.excludes(file_obj):
+                excluded.append(self.model.get_iter(ref.get_path()))
+        if excluded:
+            self._remove_rows(excluded)
+            renamed_count += len(excluded)
         self.preview_changes()
-        
+
         # Show result
         if renamed_count > 0:
             dialog = Gtk.MessageDialog(
@@ -1190,24 +1600,20 @@ class MainWindow():
                 flags=0,
                 message_type=Gtk.MessageType.INFO,
                 buttons=Gtk.ButtonsType.OK,
-                text=_("Normalization Complete")
+                text=tool.done_title
             )
-            dialog.format_secondary_text(
-                _("{} files normalized.\nClick 'Rename' to apply changes.").format(renamed_count)
-            )
-            dialog.run()
-            dialog.destroy()
+            dialog.format_secondary_text(tool.done_text.format(renamed_count))
         else:
             dialog = Gtk.MessageDialog(
                 transient_for=self.window,
                 flags=0,
-                message_type=Gtk.MessageType.INFO,
+                message_type=Gtk.MessageType.WARNING if tool.empty_is_warning else Gtk.MessageType.INFO,
                 buttons=Gtk.ButtonsType.OK,
-                text=_("Already Normalized")
+                text=tool.empty_title
             )
-            dialog.format_secondary_text(_("All file names are already normalized."))
-            dialog.run()
-            dialog.destroy()
+            dialog.format_secondary_text(tool.empty_text)
+        dialog.run()
+        dialog.destroy()
 
     def open_about(self, widget):
         dlg = Gtk.AboutDialog()
@@ -1237,6 +1643,10 @@ class MainWindow():
         if ENABLE_TELEMETRY:
             stats = self.get_regex_cache_stats()
             logger.info(f"Regex cache stats: {stats}")
+            logger.info(f"Transliteration cache stats: {normalize.cache_stats()}")
+            logger.info(f"Surface cache stats: {self._surface_cache.stats()}")
+            if self._thumb_store is not None:
+                logger.info(f"Thumbnail cache stats: {self._thumb_store.stats()}")
         self.application.quit()
 
     def on_files_selected(self, selection):
@@ -1258,12 +1668,20 @@ class MainWindow():
             # Add selected iters to a list, we can't remove while we iterate
             # since removing changes the paths
             iters.append(self.model.get_iter(path))
+        self._remove_rows(iters)
+        self.preview_changes()
+
+    def _remove_rows(self, iters):
         for iter in iters:
-            file_uri = self.model.get_value(iter, COL_FILE).uri
-            self.uris.remove(file_uri)
+            file_obj = self.model.get_value(iter, COL_FILE)
+            self.uris.remove(file_obj.uri)
+            self._row_refs.pop(file_obj.row_id, None)
+            self._surface_cache.discard(file_obj)
+            for stage in self.stages:
+                stage.memo.pop(file_obj.row_id, None)
+            self._exif_requested.discard(file_obj.row_id)
             self.model.remove(iter)
         self.treeview.columns_autosize()
-        self.preview_changes()
 
     def on_add_button(self, widget):
         dialog = FolderFileChooserDialog(_("Add files"), self.window, self.last_chooser_location)
@@ -1285,6 +1703,13 @@ class MainWindow():
     def on_clear_button(self, widget):
         self.model.clear()
         self.uris.clear()
+        self._row_refs.clear()
+        self._surface_cache.clear()
+        for stage in self.stages:
+            stage.reset()
+        for runner in self._exif_runners:
+            runner.cancel()
+        self._exif_requested.clear()
 
     def on_close_button(self, widget):
         self.application.quit()
@@ -1379,20 +1804,23 @@ class MainWindow():
                         old_uri = file_obj.uri
                         success = file_obj.rename(new_name)
                         if success:
+                            # The tool's name has been applied; don't build on it again
+                            file_obj.tool_name = None
                             with self._model_lock:
                                 self._last_rename_success.append((file_obj.uri, old_uri, name))
                             
-                            def apply_update():
+                            def apply_update(old_uri=old_uri, new_uri=file_obj.uri):
                                 try:
                                     with self._model_lock:
                                         if old_uri in self.uris:
                                             self.uris.remove(old_uri)
-                                        self.uris.append(file_obj.uri)
-                                        self.model.set_value(it, COL_NAME, new_name)
+                                        self.uris.append(new_uri)
                                 except Exception:
                                     pass
                                 return False
                             GLib.idle_add(apply_update)
+                            self._post_row_update(file_obj.row_id,
+                                                  lambda iter_, name=new_name: self.model.set_value(iter_, COL_NAME, name))
                             
                             processed[0] += 1
                             if show_progress:
@@ -1528,32 +1956,28 @@ class MainWindow():
                 return
             self.uris.append(file_obj.uri)
             iter = self.model.insert_before(None, None)
+            file_obj.row_id = next(self._row_ids)
+            self._row_refs[file_obj.row_id] = Gtk.TreeRowReference.new(self.model, self.model.get_path(iter))
             self.model.set_value(iter, COL_ICON, file_obj.icon)
             self.model.set_value(iter, COL_NAME, file_obj.name)
             self.model.set_value(iter, COL_NEW_NAME, file_obj.name)
             self.model.set_value(iter, COL_FILE, file_obj)
-            self.model.set_value(iter, COL_PIXBUF, file_obj.pixbuf)
 
     def on_operation_changed(self, widget):
         operation_id = widget.get_active_id()
-        if operation_id == "replace":
-            self.stack.set_visible_child_name("replace_page")
-            self.operation_function = self.replace_text
-        elif operation_id == "remove":
-            self.stack.set_visible_child_name("remove_page")
-            self.operation_function = self.remove_text
-        elif operation_id == "insert":
-            self.stack.set_visible_child_name("insert_page")
-            self.operation_function = self.insert_text
-        elif operation_id == "case":
-            self.stack.set_visible_child_name("case_page")
-            self.operation_function = self.change_case
+        self.stack.set_visible_child_name(f"{operation_id}_page")
+        if self.loading_stage:
+            return
 
+        self.stages[self.active_stage] = OperationStage(operation_id, self.read_params(operation_id))
+        self.update_stage_combo()
         self.settings.set_string(MRU_OPERATION, operation_id)
         self.preview_changes()
 
     def on_scope_changed(self, widget):
         self.scope = widget.get_active_id()
+        for stage in self.stages:
+            stage.reset()
 
         self.settings.set_string(MRU_SCOPE, self.scope)
         self.preview_changes()
@@ -1563,8 +1987,135 @@ class MainWindow():
             self.find_entry.set_placeholder_text("Enter a regular expression; example: .+")
         else:
             self.find_entry.set_placeholder_text("Enter a search string; wildcards ? and * are supported.")
+        if self.loading_stage:
+            return
+        stage = self.stages[self.active_stage]
+        stage.set_params(self.read_params(stage.operation_id))
         self.preview_changes()
 
+    def on_stage_changed(self, widget):
+        position = widget.get_active()
+        if position < 0 or position == self.active_stage:
+            return
+        self.select_stage(position)
+
+    def on_add_stage_button(self, widget):
+        # A new stage does nothing until it is edited: replace with an empty search
+        params = {'find': "", 'replace': "", 'regex': False, 'case': False, 'start': 1, 'inc': 1}
+        self.stages.insert(self.active_stage + 1, OperationStage("replace", params))
+        self.select_stage(self.active_stage + 1)
+        self.preview_changes()
+
+    def on_remove_stage_button(self, widget):
+        if len(self.stages) < 2:
+            return
+        del self.stages[self.active_stage]
+        self.select_stage(min(self.active_stage, len(self.stages) - 1))
+        self.preview_changes()
+
+    def select_stage(self, position):
+        """Make a stage the one being edited and show its settings."""
+        self.active_stage = position
+        stage = self.stages[position]
+        self.loading_stage = True
+        try:
+            self.combo_operation.set_active_id(stage.operation_id)
+            self.load_params(stage.operation_id, stage.params)
+        finally:
+            self.loading_stage = False
+        self.update_stage_combo()
+
+    def update_stage_combo(self):
+        self.combo_stage.remove_all()
+        for position, stage in enumerate(self.stages):
+            self.combo_stage.append(str(position), "%d. %s" % (position + 1, self.operation_labels[stage.operation_id]))
+        self.combo_stage.set_active(self.active_stage)
+        self.remove_stage_button.set_sensitive(len(self.stages) > 1)
+
+    def read_params(self, operation_id):
+        """Snapshot of the widgets of an operation."""
+        if operation_id == "replace":
+            return {
+                'find': self.find_entry.get_text(),
+                'replace': self.replace_entry.get_text(),
+                'regex': self.replace_regex_check.get_active(),
+                'case': self.replace_case_check.get_active(),
+                'start': self.replace_start_spin.get_value_as_int(),
+                'inc': self.replace_inc_spin.get_value_as_int(),
+            }
+        elif operation_id == "remove":
+            return {
+                'from': self.remove_from_spin.get_value_as_int(),
+                'from_end': self.remove_from_check.get_active(),
+                'to': self.remove_to_spin.get_value_as_int(),
+                'to_end': self.remove_to_check.get_active(),
+            }
+        elif operation_id == "insert":
+            return {
+                'text': self.insert_entry.get_text(),
+                'position': self.insert_spin.get_value_as_int(),
+                'from_end': self.insert_reverse_check.get_active(),
+                'overwrite': self.overwrite_check.get_active(),
+                'start': self.insert_start_spin.get_value_as_int(),
+                'inc': self.insert_inc_spin.get_value_as_int(),
+            }
+        else:
+            if self.radio_titlecase.get_active():
+                mode = "title"
+            elif self.radio_lowercase.get_active():
+                mode = "lower"
+            elif self.radio_uppercase.get_active():
+                mode = "upper"
+            elif self.radio_firstuppercase.get_active():
+                mode = "first"
+            else:
+                mode = "accents"
+            return {'mode': mode}
+
+    def load_params(self, operation_id, params):
+        """Show a snapshot taken by read_params() in the widgets."""
+        if operation_id == "replace":
+            self.find_entry.set_text(params['find'])
+            self.replace_entry.set_text(params['replace'])
+            self.replace_regex_check.set_active(params['regex'])
+            self.replace_case_check.set_active(params['case'])
+            self.replace_start_spin.set_value(params['start'])
+            self.replace_inc_spin.set_value(params['inc'])
+        elif operation_id == "remove":
+            self.remove_from_spin.set_value(params['from'])
+            self.remove_from_check.set_active(params['from_end'])
+            self.remove_to_spin.set_value(params['to'])
+            self.remove_to_check.set_active(params['to_end'])
+        elif operation_id == "insert":
+            self.insert_entry.set_text(params['text'])
+            self.insert_spin.set_value(params['position'])
+            self.insert_reverse_check.set_active(params['from_end'])
+            self.overwrite_check.set_active(params['overwrite'])
+            self.insert_start_spin.set_value(params['start'])
+            self.insert_inc_spin.set_value(params['inc'])
+        else:
+            radios = {
+                "title": self.radio_titlecase,
+                "lower": self.radio_lowercase,
+                "upper": self.radio_uppercase,
+                "first": self.radio_firstuppercase,
+                "accents": self.radio_accents,
+            }
+            radios[params['mode']].set_active(True)
+
+    def run_stage(self, stage, file_obj, index, base_name):
+        function = self.operation_functions[stage.operation_id]
+        if self.scope == SCOPE_ALL:
+            return stage.evaluate(function, file_obj, index, base_name)
+        name, ext = os.path.splitext(base_name)
+        if ext and ext.startswith('.'):
+            ext = ext[1:]
+        if self.scope == SCOPE_NAME_ONLY:
+            name = stage.evaluate(function, file_obj, index, name)
+        else:
+            ext = stage.evaluate(function, file_obj, index, ext)
+        return name + ('.' if ext else '') + ext
+
     def preview_changes(self):
         self.infobar.hide()
 
@@ -1591,25 +2142,26 @@ class MainWindow():
         self.renamed_uris = []
         any_changes = False
 
+        # Stages with invalid settings are skipped, and reported once here
+        # rather than for every row
+        invalid_stages = [number for number, stage in enumerate(self.stages, 1) if stage.error is not None]
+        for number in invalid_stages:
+            self.infobar.show()
+            self.error_label.set_text(_("Step %d: %s") % (number, self.stages[number - 1].error))
+
+        self._load_template_exif()
+
         iter = self.model.get_iter_first()
         index = 1
         while iter != None:
             try:
                 file_obj = self.model.get_value(iter, COL_FILE)
                 orig_name = self.model.get_value(iter, COL_NAME)
-                name, ext = os.path.splitext(orig_name)
-                if ext and ext.startswith('.'):
-                    ext = ext[1:]
-                if self.scope == SCOPE_NAME_ONLY:
-                    name = self.operation_function(index, name)
-                elif self.scope == SCOPE_EXTENSION_ONLY:
-                    ext = self.operation_function(index, ext)
-                else:
-                    full_name = self.operation_function(index, orig_name)
-                if self.scope == SCOPE_ALL:
-                    new_name = full_name
-                else:
-                    new_name = name + ('.' if ext else '') + ext
+                # Each stage works on the output of the previous one; stages
+                # whose input did not change reuse their last result
+                new_name = file_obj.tool_name or orig_name
+                for stage in self.stages:
+                    new_name = stage.apply(self.run_stage, file_obj, index, new_name)
 
                 self.model.set_value(iter, COL_NEW_NAME, new_name)
                 renamed_uri = file_obj.get_pending_uri(new_name)
@@ -1635,25 +2187,11 @@ class MainWindow():
                 self.renamed_uris.append(file_obj.uri)
             iter = self.model.iter_next(iter)
             index += 1
-        self.rename_button.set_sensitive(any_changes)
-
-    @functools.lru_cache(maxsize=32)
-    def _compile_regex(self, pattern, flags):
-        """Cache compiled regex patterns to avoid recompilation.
-        
-        Raises:
-            ValueError: If pattern is invalid regex syntax
-        """
-        try:
-            compiled = re.compile(pattern, flags)
-            return compiled
-        except re.error as e:
-            logger.warning(f"Invalid regex '{pattern}': {e}")
-            raise ValueError(f"Invalid regular expression: {e}")
+        self.rename_button.set_sensitive(any_changes and not invalid_stages)
 
     def get_regex_cache_stats(self):
         """Get cache hit rate and usage statistics."""
-        info = self._compile_regex.cache_info()
+        info = compile_regex.cache_info()
         hit_rate = info.hits / (info.hits + info.misses) if (info.hits + info.misses) > 0 else 0
         return {
             'hits': info.hits,
@@ -1663,94 +2201,69 @@ class MainWindow():
             'maxsize': info.maxsize
         }
 
-    def replace_text(self, index, string):
-        case = self.replace_case_check.get_active()
-        regex = self.replace_regex_check.get_active()
-        find = self.find_entry.get_text()
-        if not find:  #ignore empty search string
+    def replace_text(self, index, string, params, file_obj):
+        reg = params['pattern']
+        if reg is None:  #ignore empty search string
             return string
-        inc  = self.replace_inc_spin.get_value_as_int()
-        start= self.replace_start_spin.get_value_as_int()
-        replace = self.replace_entry.get_text()
-        replace = self.inject((index-1)*inc + start, replace)
+        inc  = params['inc']
+        start= params['start']
+        # The template's own backslashes are group references in regex
+        # mode; those in a folder name are not
+        lookup = lambda field: escape_replacement(file_obj.template_value(field))
+        replace = templates.compile(params['replace']).render((index-1)*inc + start, lookup)
         try:
-            if regex:
-                flags = 0 if case else re.IGNORECASE
-                try:
-                    reg = self._compile_regex(find, flags)
-                    return reg.sub(replace, string)
-                except ValueError as e:
-                    # Show error in infobar for invalid regex
-                    GLib.idle_add(lambda: self.infobar.show())
-                    GLib.idle_add(lambda: self.error_label.set_text(str(e)))
-                    return string  # Don't apply substitution
-            else:
-                find = find.replace("*", "~~~REGSTAR~~~")
-                find = find.replace("?", "~~~REGQUES~~~")
-                find = re.escape(find)
-                find = find.replace(re.escape("~~~REGSTAR~~~"), ".+")
-                find = find.replace(re.escape("~~~REGQUES~~~"), ".")
-                flags = 0 if case else re.IGNORECASE
-                reg = self._compile_regex(find, flags)
-                return reg.sub(replace, string)
+            return reg.sub(replace, string)
         except re.error:
             return string
 
-    def remove_text(self, index, string):
+    def remove_text(self, index, string, params, file_obj):
         length = len(string)
 
-        from_index = self.remove_from_spin.get_value_as_int() - 1
-        if self.remove_from_check.get_active():
+        from_index = params['from'] - 1
+        if params['from_end']:
             from_index = max(length - from_index, 0)
         else:
             from_index = min(length, from_index)
 
-        to_index = self.remove_to_spin.get_value_as_int() - 1
-        if self.remove_to_check.get_active():
+        to_index = params['to'] - 1
+        if params['to_end']:
             to_index = max(length - to_index, 0)
         else:
             to_index = min(length, to_index)
 
         return string[0:min(from_index, to_index)] + string[max(from_index, to_index):]
 
-    def insert_text(self, index, string):
-        text = self.insert_entry.get_text()
-        inc  = self.insert_inc_spin.get_value_as_int()
-        start= self.insert_start_spin.get_value_as_int()
-        text = self.inject((index-1)*inc + start, text)
-        from_index = self.insert_spin.get_value_as_int() - 1
+    def insert_text(self, index, string, params, file_obj):
+        inc  = params['inc']
+        start= params['start']
+        text = templates.compile(params['text']).render((index-1)*inc + start, file_obj.template_value)
+        from_index = params['position'] - 1
         a = len(string)
         b = len(text)
-        if self.insert_reverse_check.get_active():
+        if params['from_end']:
             diff = max(0, a - from_index)
-            if self.overwrite_check.get_active():
+            if params['overwrite']:
                 return string[0:diff] + text + string[diff + b:]
             else:
                 return string[0:diff] + text + string[diff:]
         else:
-            if self.overwrite_check.get_active():
+            if params['overwrite']:
                 return string[0:from_index] + text + string[from_index + b:]
             else:
                 return string[0:from_index] + text + string[from_index:]
 
-    def change_case(self, index, string):
-        if self.radio_titlecase.get_active():
+    def change_case(self, index, string, params, file_obj):
+        mode = params['mode']
+        if mode == "title":
             return string.title()
-        elif self.radio_lowercase.get_active():
+        elif mode == "lower":
             return string.lower()
-        elif self.radio_uppercase.get_active():
+        elif mode == "upper":
             return string.upper()
-        elif self.radio_firstuppercase.get_active():
+        elif mode == "first":
             return string.capitalize()
         else:
-            return unidecode.unidecode(string)
-
-    def inject(self, index, string):
-        def repl(match):
-            zeros = match.group(1)
-            width = len(zeros) + 1
-            return f"{index:0{width}d}"
-        return re.sub(r'%([0]*)n', repl, string)
+            return normalize.transliterate(string)
 
 if __name__ == "__main__":
     application = MyApplication("org.x.bulky", Gio.ApplicationFlags.FLAGS_NONE)
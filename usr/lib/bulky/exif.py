@@ -0,0 +1,349 @@
+"""Header-only EXIF date reader.
+
+Only the bytes needed to reach DateTimeOriginal are read: the JPEG APP1
+segment, the IFD chain of a TIFF-based raw file, the Exif item of a
+HEIF/HEIC file, or the eXIf/EXIF chunk of PNG and WebP. Pixel data is
+never touched and nothing is decoded, so the cost per file is a couple
+of small reads - usually well under 64 KB.
+"""
+import logging
+import multiprocessing
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ExifDate = namedtuple("ExifDate", ("timestamp", "subsec", "camera"))
+
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_SUBSEC_ORIGINAL = 0x9291
+
+TYPE_ASCII = 2
+TYPE_SHORT = 3
+TYPE_LONG = 4
+
+EXTENSIONS = frozenset((
+    "jpg", "jpeg", "jpe",
+    "tif", "tiff", "dng", "cr2", "nef", "nrw", "arw", "srf", "sr2", "orf", "rw2", "pef", "srw",
+    "heic", "heif", "hif", "avif",
+    "png", "webp",
+))
+
+_MAX_IFD_ENTRIES = 1024
+
+# Below this many files the pool start-up costs more than it saves
+PROCESS_THRESHOLD = int(os.getenv("BULKY_EXIF_PROCESS_THRESHOLD", "2000"))
+PROCESS_CHUNK = 256
+PROCESSES = max(1, int(os.getenv("BULKY_EXIF_PROCESSES", str(os.cpu_count() or 1))))
+
+
+class _FileReader():
+    """Random access to a TIFF structure starting at base in an open file."""
+
+    def __init__(self, f, base=0):
+        self.f = f
+        self.base = base
+
+    def __call__(self, offset, size):
+        self.f.seek(self.base + offset)
+        return self.f.read(size)
+
+
+class _BytesReader():
+    def __init__(self, data):
+        self.data = data
+
+    def __call__(self, offset, size):
+        return self.data[offset:offset + size]
+
+
+def _read_ifd(read, order, offset):
+    """Return {tag: (type, count, raw value/offset field)} for one IFD."""
+    head = read(offset, 2)
+    if len(head) < 2:
+        return {}
+    count = struct.unpack(order + "H", head)[0]
+    if count > _MAX_IFD_ENTRIES:
+        return {}
+    data = read(offset + 2, count * 12)
+    entries = {}
+    for i in range(len(data) // 12):
+        tag, typ, n = struct.unpack_from(order + "HHI", data, i * 12)
+        entries[tag] = (typ, n, data[i * 12 + 8:i * 12 + 12])
+    return entries
+
+
+def _ascii(read, order, entry):
+    typ, count, raw = entry
+    if typ != TYPE_ASCII or count == 0:
+        return None
+    if count <= 4:
+        value = raw[:count]
+    else:
+        value = read(struct.unpack(order + "I", raw)[0], count)
+    return value.split(b"\0", 1)[0].decode("ascii", "replace").strip() or None
+
+
+def _long(order, entry):
+    typ, count, raw = entry
+    if typ == TYPE_LONG:
+        return struct.unpack(order + "I", raw)[0]
+    if typ == TYPE_SHORT:
+        return struct.unpack(order + "H", raw[:2])[0]
+    return None
+
+
+def parse_tiff(read):
+    """Extract the date fields from a TIFF structure, or return None."""
+    header = read(0, 8)
+    if len(header) < 8 or header[:2] not in (b"II", b"MM"):
+        return None
+    order = "<" if header[:2] == b"II" else ">"
+    ifd0 = _read_ifd(read, order, struct.unpack(order + "I", header[4:8])[0])
+
+    exif_offset = _long(order, ifd0[TAG_EXIF_IFD]) if TAG_EXIF_IFD in ifd0 else None
+    if not exif_offset:
+        return None
+    exif_ifd = _read_ifd(read, order, exif_offset)
+    if TAG_DATETIME_ORIGINAL not in exif_ifd:
+        return None
+
+    text = _ascii(read, order, exif_ifd[TAG_DATETIME_ORIGINAL]) or ""
+    # strptime() takes single digits, so a value cut short by a truncated
+    # file would parse as a wrong date
+    if len(text) != 19:
+        return None
+    try:
+        timestamp = datetime.strptime(text, "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        # Unset dates are commonly written as "0000:00:00 00:00:00"
+        return None
+
+    subsec = _ascii(read, order, exif_ifd[TAG_SUBSEC_ORIGINAL]) if TAG_SUBSEC_ORIGINAL in exif_ifd else None
+    make = _ascii(read, order, ifd0[TAG_MAKE]) if TAG_MAKE in ifd0 else None
+    model = _ascii(read, order, ifd0[TAG_MODEL]) if TAG_MODEL in ifd0 else None
+    camera = " ".join(part for part in (make, model) if part) or None
+    return ExifDate(timestamp, subsec, camera)
+
+
+def _jpeg_tiff(f):
+    pos = 2
+    while True:
+        f.seek(pos)
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            return None
+        marker = header[1]
+        if marker == 0xFF:
+            # Fill byte
+            pos += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan: no EXIF before the pixel data
+            return None
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Standalone markers carry no length
+            pos += 2
+            continue
+        length = struct.unpack(">H", header[2:4])[0]
+        if marker == 0xE1:
+            segment = f.read(length - 2)
+            if segment.startswith(b"Exif\0\0"):
+                return _BytesReader(segment[6:])
+        pos += 2 + length
+
+
+def _boxes(f, start, end):
+    """Yield (type, payload offset, payload end) for ISO BMFF boxes."""
+    pos = start
+    while end is None or pos + 8 <= end:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        payload = pos + 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            payload += 8
+        elif size == 0:
+            f.seek(0, 2)
+            size = f.tell() - pos
+        if size < payload - pos:
+            return
+        yield box_type, payload, pos + size
+        pos += size
+
+
+def _uint(data, offset, size):
+    if size == 0:
+        return 0, offset
+    return int.from_bytes(data[offset:offset + size], "big"), offset + size
+
+
+def _heif_tiff(f):
+    meta = next(((start, end) for box_type, start, end in _boxes(f, 0, None) if box_type == b"meta"), None)
+    if meta is None:
+        return None
+
+    exif_id = None
+    locations = {}
+    # meta is a full box: skip version and flags
+    for box_type, start, end in _boxes(f, meta[0] + 4, meta[1]):
+        if box_type not in (b"iinf", b"iloc"):
+            continue
+        f.seek(start)
+        data = f.read(end - start)
+        version = data[0]
+        if box_type == b"iinf":
+            offset = 6 if version == 0 else 8
+            for entry_type, entry_start, entry_end in _boxes(f, start + offset, end):
+                if entry_type != b"infe":
+                    continue
+                f.seek(entry_start)
+                infe = f.read(min(entry_end - entry_start, 64))
+                if infe[0] < 2:
+                    continue
+                id_size = 2 if infe[0] == 2 else 4
+                item_id, pos = _uint(infe, 4, id_size)
+                item_type = infe[pos + 2:pos + 6]
+                if item_type == b"Exif":
+                    exif_id = item_id
+        elif box_type == b"iloc":
+            offset_size = data[4] >> 4
+            length_size = data[4] & 0x0F
+            base_offset_size = data[5] >> 4
+            index_size = data[5] & 0x0F if version in (1, 2) else 0
+            count, pos = _uint(data, 6, 2 if version < 2 else 4)
+            for _i in range(count):
+                item_id, pos = _uint(data, pos, 2 if version < 2 else 4)
+                if version in (1, 2):
+                    pos += 2  # construction_method
+                pos += 2  # data_reference_index
+                base_offset, pos = _uint(data, pos, base_offset_size)
+                extent_count, pos = _uint(data, pos, 2)
+                for extent in range(extent_count):
+                    _index, pos = _uint(data, pos, index_size)
+                    extent_offset, pos = _uint(data, pos, offset_size)
+                    _length, pos = _uint(data, pos, length_size)
+                    if extent == 0:
+                        locations[item_id] = base_offset + extent_offset
+
+    if exif_id is None or exif_id not in locations:
+        return None
+    # The Exif item starts with the offset of the TIFF header past this field
+    f.seek(locations[exif_id])
+    prefix = f.read(4)
+    if len(prefix) < 4:
+        return None
+    return _FileReader(f, locations[exif_id] + 4 + struct.unpack(">I", prefix)[0])
+
+
+def _png_tiff(f):
+    pos = 8
+    while True:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type == b"eXIf":
+            return _BytesReader(f.read(length))
+        if chunk_type in (b"IDAT", b"IEND"):
+            return None
+        pos += 12 + length
+
+
+def _webp_tiff(f):
+    pos = 12
+    while True:
+        f.seek(pos)
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_type, length = struct.unpack("<4sI", header)
+        if chunk_type == b"EXIF":
+            data = f.read(length)
+            if data.startswith(b"Exif\0\0"):
+                data = data[6:]
+            return _BytesReader(data)
+        pos += 8 + length + (length & 1)
+
+
+def read_exif_date(path):
+    """Return ExifDate(timestamp, subsec, camera) for path, or None.
+
+    timestamp is DateTimeOriginal as a naive datetime; subsec and camera
+    ("Make Model") are strings or None.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(16)
+            if head[:2] == b"\xff\xd8":
+                reader = _jpeg_tiff(f)
+            elif head[:4] in (b"II*\0", b"MM\0*") or head[:4] in (b"IIRO", b"IIU\0"):
+                reader = _FileReader(f)
+            elif head[4:8] == b"ftyp":
+                reader = _heif_tiff(f)
+            elif head[:8] == b"\x89PNG\r\n\x1a\n":
+                reader = _png_tiff(f)
+            elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                reader = _webp_tiff(f)
+            else:
+                return None
+            if reader is None:
+                return None
+            return parse_tiff(reader)
+    except (OSError, struct.error, IndexError, ValueError) as e:
+        logger.debug("EXIF read failed for %s: %s", path, str(e))
+        return None
+
+
+def read_chunk(paths):
+    """Read a list of files in one call, returning compact
+    (path, timestamp, subsec, camera) tuples. Runs in pool processes."""
+    results = []
+    for path in paths:
+        info = read_exif_date(path)
+        if info is None:
+            results.append((path, None, None, None))
+        else:
+            results.append((path, info.timestamp, info.subsec, info.camera))
+    return results
+
+
+# Interpreter for pool processes, see poolworker.py
+WORKER_EXECUTABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "poolworker.py")
+
+
+def process_pool(workers=None):
+    """A process pool for read_chunk().
+
+    Forking a process that runs GTK and worker threads is not safe, so
+    workers are forked from a forkserver instead: a fresh process that
+    has imported nothing but this module. The forkserver is started
+    through poolworker.py so that neither it nor the workers re-run the
+    application script. It outlives the pool, so later pools start
+    quickly. The caller owns the pool and must shut it down.
+    """
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    context.set_executable(WORKER_EXECUTABLE)
+    return ProcessPoolExecutor(max_workers=workers or PROCESSES, mp_context=context)
+
+
+def read_exif_dates(paths, workers=None):
+    """read_chunk() over many paths, spread across processes in chunks when
+    there are enough of them to pay for it, serially otherwise."""
+    paths = list(paths)
+    if len(paths) < PROCESS_THRESHOLD:
+        return read_chunk(paths)
+    chunks = [paths[i:i + PROCESS_CHUNK] for i in range(0, len(paths), PROCESS_CHUNK)]
+    with process_pool(workers) as pool:
+        return [row for rows in pool.map(read_chunk, chunks) for row in rows]
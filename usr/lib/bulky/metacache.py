@@ -0,0 +1,97 @@
+"""Persistent cache of per-file metadata extracted by the Tools.
+
+Entries are keyed on the file's identity (see thumbcache.identity_key) plus
+the kind of metadata ("exif", "id3", "hash:sha256", ...), so renaming a
+file keeps its entries while rewriting it invalidates them. Values are
+stored as JSON in a SQLite database under the cache directory. Writes and
+access-time updates are batched until flush(), which also evicts the
+least recently used entries beyond the size limit.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# get() result for keys that are not cached; None is a valid cached value
+MISSING = object()
+
+
+class MetadataCache():
+
+    def __init__(self, path, max_entries=200000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._touched = set()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta ("
+                         "id TEXT NOT NULL, kind TEXT NOT NULL, value TEXT, atime REAL NOT NULL, "
+                         "PRIMARY KEY (id, kind)) WITHOUT ROWID")
+        self._db.execute("CREATE INDEX IF NOT EXISTS meta_atime ON meta (atime)")
+        self._db.commit()
+
+    def get(self, identity, kind):
+        with self._lock:
+            key = (identity, kind)
+            if key in self._pending:
+                self.hits += 1
+                return json.loads(self._pending[key])
+            row = self._db.execute("SELECT value FROM meta WHERE id = ? AND kind = ?", key).fetchone()
+            if row is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            self._touched.add(key)
+            return json.loads(row[0])
+
+    def put(self, identity, kind, value):
+        with self._lock:
+            self._pending[(identity, kind)] = json.dumps(value)
+
+    def flush(self):
+        """Write pending entries and access times, then enforce the size limit."""
+        now = time.time()
+        with self._lock:
+            try:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO meta (id, kind, value, atime) VALUES (?, ?, ?, ?)",
+                        [(identity, kind, value, now) for (identity, kind), value in self._pending.items()])
+                    self._db.executemany(
+                        "UPDATE meta SET atime = ? WHERE id = ? AND kind = ?",
+                        [(now, identity, kind) for identity, kind in self._touched])
+                    count = self._db.execute("SELECT COUNT(*) FROM meta").fetchone()[0]
+                    if count > self.max_entries:
+                        self._db.execute(
+                            "DELETE FROM meta WHERE (id, kind) IN "
+                            "(SELECT id, kind FROM meta ORDER BY atime LIMIT ?)",
+                            (count - self.max_entries,))
+            except sqlite3.Error as e:
+                logger.warning("Failed to write metadata cache: %s", str(e))
+            self._pending.clear()
+            self._touched.clear()
+
+    def stats(self):
+        """Get hit rate and usage statistics."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0,
+            'pending': len(self._pending),
+        }
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._db.close()
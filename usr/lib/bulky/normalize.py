@@ -0,0 +1,64 @@
+"""Name normalization for NormalizeTool and the "remove accents" case option.
+
+Transliteration is the expensive step, and names in a library repeat the
+same words over and over, so unidecode is only called on runs of non-ASCII
+characters, through an LRU cache keyed by the run; names that are already
+ASCII skip it altogether. unidecode maps each character independently, so
+transliterating runs gives the same result as transliterating the whole
+name. Lower-casing and the character filter are a single str.translate()
+table, leaving one precompiled regex to collapse underscores.
+"""
+import functools
+import os
+import re
+import string
+
+import unidecode
+
+TRANSLIT_CACHE_SIZE = int(os.getenv("BULKY_TRANSLIT_CACHE_SIZE", "65536"))
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]+")
+_UNDERSCORES = re.compile(r"__+")
+
+_ALLOWED = set(string.ascii_lowercase + string.digits + "._-")
+# Applied to ASCII text: lower-case, spaces to underscores, drop the rest
+_FILTER = {
+    code: (None if chr(code).lower() not in _ALLOWED else chr(code).lower())
+    for code in range(128)
+}
+_FILTER[ord(" ")] = "_"
+
+
+@functools.lru_cache(maxsize=TRANSLIT_CACHE_SIZE)
+def _transliterate_run(run):
+    return unidecode.unidecode(run)
+
+
+def _transliterate_match(match):
+    return _transliterate_run(match.group())
+
+
+def transliterate(text):
+    """ASCII transliteration of text, same as unidecode.unidecode(text)."""
+    if text.isascii():
+        return text
+    return _NON_ASCII.sub(_transliterate_match, text)
+
+
+def normalize(text):
+    """Transliterate, lower-case, turn spaces into underscores, drop anything
+    but [a-z0-9._-] and collapse repeated underscores."""
+    return _UNDERSCORES.sub("_", transliterate(text).translate(_FILTER))
+
+
+def cache_stats():
+    """Get transliteration cache hit rate and usage statistics."""
+    info = _transliterate_run.cache_info()
+    hit_rate = info.hits / (info.hits + info.misses) if (info.hits + info.misses) > 0 else 0
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'hit_rate': hit_rate,
+        'size': info.currsize,
+        'maxsize': info.maxsize
+    }
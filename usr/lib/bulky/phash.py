@@ -0,0 +1,189 @@
+"""Perceptual image hashes and Hamming-distance clustering.
+
+Images are decoded straight to a small size (the JPEG loader scales while
+decoding, see thumbgen) and reduced to a 9x8 grid. The 64-bit dHash has
+one bit per horizontally adjacent pair of cells, set when brightness
+increases, so resized, re-encoded or lightly edited copies of a photo end
+up a few bits apart.
+
+Grayscale conversion and hashing run over a whole batch at once with
+NumPy when it is installed, and in plain Python otherwise. Grouping uses
+multi-index hashing, so only hashes that share a band of bits are ever
+compared instead of every pair of images. The comparisons are queries on
+a HashIndex, one image at a time, so callers can spread them over worker
+threads and stop early. (A BK-tree was tried first:
+with 64-bit hashes and a useful distance limit it ends up visiting
+nearly every node.)
+"""
+import bisect
+
+import gi
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import GdkPixbuf
+
+import thumbgen
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+GRID_WIDTH = 9
+GRID_HEIGHT = 8
+# Decoded size before the final reduction to the grid; large enough for
+# HYPER filtering to average out JPEG noise
+DECODE_SIZE = 64
+DEFAULT_DISTANCE = 6
+# Above this the bands get so narrow (radius + 1 bands of 64 bits) that
+# buckets hold most of the hashes, and chained grouping merges unrelated
+# images anyway
+MAX_DISTANCE = 10
+
+
+def load_pixels(path):
+    """Return the 9x8 RGB grid for path as 216 bytes, or None."""
+    pix = thumbgen.generate_image_thumbnail(path, DECODE_SIZE)
+    if pix is None:
+        return None
+    pix = pix.scale_simple(GRID_WIDTH, GRID_HEIGHT, GdkPixbuf.InterpType.HYPER)
+    channels = pix.get_n_channels()
+    stride = pix.get_rowstride()
+    data = pix.get_pixels()
+    rgb = bytearray()
+    for y in range(GRID_HEIGHT):
+        row = data[y * stride:y * stride + GRID_WIDTH * channels]
+        if channels == 3:
+            rgb += row
+        else:
+            for x in range(GRID_WIDTH):
+                rgb += row[x * channels:x * channels + 3]
+    return bytes(rgb)
+
+
+def _dhash(rgb):
+    gray = [(299 * rgb[i] + 587 * rgb[i + 1] + 114 * rgb[i + 2]) // 1000 for i in range(0, len(rgb), 3)]
+    value = 0
+    for y in range(GRID_HEIGHT):
+        row = gray[y * GRID_WIDTH:(y + 1) * GRID_WIDTH]
+        for x in range(GRID_WIDTH - 1):
+            value = (value << 1) | (row[x + 1] > row[x])
+    return value
+
+
+def dhash_batch(grids):
+    """64-bit dHash for each grid returned by load_pixels()."""
+    if not grids:
+        return []
+    if numpy is None:
+        return [_dhash(rgb) for rgb in grids]
+    rgb = numpy.frombuffer(b"".join(grids), dtype=numpy.uint8).reshape(-1, GRID_HEIGHT, GRID_WIDTH, 3)
+    gray = (rgb.astype(numpy.uint32) * numpy.array([299, 587, 114], dtype=numpy.uint32)).sum(axis=3) // 1000
+    bits = (gray[:, :, 1:] > gray[:, :, :-1]).reshape(len(grids), 64)
+    return [int(value) for value in numpy.packbits(bits, axis=1).view(">u8").ravel()]
+
+
+def _bands(radius):
+    """Split the 64 bits into radius + 1 (shift, mask) bands. Two hashes at
+    most radius bits apart are equal on at least one band."""
+    count = min(radius + 1, 64)
+    bounds = [64 * k // count for k in range(count + 1)]
+    return [(bounds[k], (1 << (bounds[k + 1] - bounds[k])) - 1) for k in range(count)]
+
+
+if numpy is not None:
+    _POPCOUNT8 = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+
+
+def _popcount(values):
+    # numpy.bitwise_count is new in NumPy 2.0
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(values)
+    return _POPCOUNT8[values.view(numpy.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+class HashIndex():
+    """Hashes bucketed by each band (see _bands) for neighbour queries.
+
+    earlier(i) only compares hashes[i] with the hashes sharing one of its
+    buckets, and only with lower indexes, so querying every index yields
+    each close pair once. Queries may run on several threads; building
+    the index does not have to happen on the thread that queries it.
+    """
+
+    def __init__(self, hashes, radius=DEFAULT_DISTANCE):
+        if not 0 <= radius <= MAX_DISTANCE:
+            raise ValueError(f"distance must be between 0 and {MAX_DISTANCE}")
+        self.hashes = hashes
+        self.radius = radius
+        # Indexes with a hash, ascending; None entries are skipped
+        self.indexes = [i for i, value in enumerate(hashes) if value is not None]
+        self._bands = []
+        if numpy is None:
+            for shift, mask in _bands(radius):
+                buckets = {}
+                for i in self.indexes:
+                    buckets.setdefault((hashes[i] >> shift) & mask, []).append(i)
+                self._bands.append((shift, mask, buckets))
+            return
+        self._values = numpy.array([value or 0 for value in hashes], dtype=numpy.uint64)
+        present = numpy.array(self.indexes, dtype=numpy.int64)
+        for shift, mask in _bands(radius):
+            shift, mask = numpy.uint64(shift), numpy.uint64(mask)
+            keys = (self._values[present] >> shift) & mask
+            # Stable, so each bucket keeps its indexes in ascending order
+            order = numpy.argsort(keys, kind="stable")
+            self._bands.append((shift, mask, keys[order], present[order]))
+
+    def earlier(self, i):
+        """The indexes below i whose hashes are within radius bits of
+        hashes[i], sorted."""
+        value = self.hashes[i]
+        found = set()
+        if numpy is None:
+            for shift, mask, buckets in self._bands:
+                bucket = buckets[(value >> shift) & mask]
+                for j in bucket[:bisect.bisect_left(bucket, i)]:
+                    if j not in found and bin(value ^ self.hashes[j]).count("1") <= self.radius:
+                        found.add(j)
+            return sorted(found)
+        value = self._values[i]
+        for shift, mask, keys, members in self._bands:
+            key = (value >> shift) & mask
+            bucket = members[numpy.searchsorted(keys, key, "left"):numpy.searchsorted(keys, key, "right")]
+            bucket = bucket[:numpy.searchsorted(bucket, i)]
+            if len(bucket):
+                found.update(bucket[_popcount(self._values[bucket] ^ value) <= self.radius].tolist())
+        return sorted(found)
+
+
+def group(indexes, pairs):
+    """Chain (i, j) pairs of indexes into groups. Returns the groups with
+    more than one member, each sorted, ordered by their first index."""
+    parent = {i: i for i in indexes}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in pairs:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in sorted(parent):
+        groups.setdefault(find(i), []).append(i)
+    return [members for _root, members in sorted(groups.items()) if len(members) > 1]
+
+
+def cluster(hashes, radius=DEFAULT_DISTANCE):
+    """Group the indexes of hashes that are chained within radius bits.
+
+    Candidates come from multi-index hashing, see HashIndex. Returns the
+    groups with more than one member, each sorted, ordered by their first
+    index. None entries are skipped. radius is at most MAX_DISTANCE.
+    """
+    index = HashIndex(hashes, radius)
+    return group(index.indexes, ((j, i) for i in index.indexes for j in index.earlier(i)))
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+"""Interpreter for process pools (see exif.process_pool()).
+
+multiprocessing starts pool processes by running the interpreter with
+"-c <bootstrap>", and the bootstrap re-runs the parent's main script as
+__mp_main__ so that functions defined there can be unpickled. For Bulky
+that script is the GTK application: every worker would import GTK, set
+up logging again on the shared rotating log file and retitle itself.
+
+This script stands in for the interpreter. It marks the application
+script as the main module already, so the bootstrap skips it, then runs
+the bootstrap. Pool functions live in small modules (exif) and do not
+need it. Interpreter flags that come before -c are ignored.
+"""
+import os
+import sys
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bulky.py")
+
+index = sys.argv.index("-c")
+code = sys.argv[index + 1]
+sys.argv = ["-c"] + sys.argv[index + 2:]
+
+main = sys.modules["__main__"]
+main.__file__ = APP_SCRIPT
+exec(compile(code, "<string>", "exec"), main.__dict__)
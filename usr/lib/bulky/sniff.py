@@ -0,0 +1,214 @@
+"""File type sniffing from the first bytes of a file.
+
+The signature table is compiled into one anchored regular expression, so
+identifying a buffer is a single match() however many types are known.
+Container formats are refined from the same buffer: ZIP-based documents
+by their first member, ISO media by the ftyp brand, Ogg and Matroska by
+their codec headers. A leading ID3v2 tag is skipped and the audio after
+it sniffed instead. Anything the table does not know goes to
+Gio.content_type_guess() with the same buffer.
+
+Only SNIFF_SIZE bytes are ever read per file.
+"""
+import mimetypes
+import re
+
+from gi.repository import Gio
+
+SNIFF_SIZE = 4096
+
+# (regex at offset 0, extension, other extensions meaning the same content)
+# More specific signatures come before the ones they overlap with.
+SIGNATURES = (
+    (rb"\xff\xd8\xff", "jpg", ("jpeg", "jpe", "jfif")),
+    (rb"\x89PNG\r\n\x1a\n", "png", ("apng",)),
+    (rb"GIF8[79]a", "gif", ()),
+    (rb"RIFF....WEBP", "webp", ()),
+    (rb"RIFF....WAVE", "wav", ()),
+    (rb"RIFF....AVI ", "avi", ()),
+    (rb"FORM....AIF[FC]", "aiff", ("aif", "aifc")),
+    (rb"II\*\x00\x10\x00\x00\x00CR", "cr2", ()),
+    (rb"II\*\x00|MM\x00\*", "tif", ("tiff", "dng", "nef", "nrw", "arw", "srf", "sr2", "orf", "pef",
+                                    "srw", "rw2", "3fr", "erf", "kdc", "mos", "raw")),
+    (rb"IIRO", "orf", ()),
+    (rb"IIU\x00", "rw2", ()),
+    (rb"BM.{4}\x00\x00\x00\x00", "bmp", ("dib",)),
+    (rb"\x00\x00\x01\x00", "ico", ()),
+    (rb"8BPS", "psd", ()),
+    (rb"\x00\x00\x00\x0cJXL \r\n\x87\n|\xff\x0a", "jxl", ()),
+    (rb"\x00\x00\x00\x0cjP  \r\n\x87\n", "jp2", ("j2k", "jpf", "jpx")),
+    (rb"%PDF-", "pdf", ("ai",)),
+    (rb"%!PS", "ps", ("eps",)),
+    (rb"\{\\rtf", "rtf", ()),
+    (rb"PK\x03\x04", "zip", ()),
+    (rb"\x1f\x8b", "gz", ("tgz",)),
+    (rb"BZh", "bz2", ("tbz2",)),
+    (rb"\xfd7zXZ\x00", "xz", ("txz",)),
+    (rb"\x28\xb5\x2f\xfd", "zst", ()),
+    (rb"7z\xbc\xaf\x27\x1c", "7z", ()),
+    (rb"Rar!\x1a\x07", "rar", ()),
+    (rb".{257}ustar", "tar", ()),
+    (rb"SQLite format 3\x00", "sqlite", ("db", "sqlite3")),
+    (rb"fLaC", "flac", ()),
+    (rb"OggS", "ogg", ("oga", "ogv", "opus", "spx")),
+    (rb"\xff[\xe2\xe3\xf2\xf3\xfa\xfb]", "mp3", ()),
+    (rb"\xff[\xf1\xf9]", "aac", ("adts",)),
+    (rb"MThd", "mid", ("midi",)),
+    (rb"\x1a\x45\xdf\xa3", "mkv", ("mka", "mks", "webm")),
+    (rb"FLV\x01", "flv", ()),
+    (rb"....ftyp", "mp4", ()),
+    (rb"wOFF", "woff", ()),
+    (rb"wOF2", "woff2", ()),
+    (rb"OTTO", "otf", ()),
+    (rb"\x00\x01\x00\x00\x00", "ttf", ()),
+)
+
+# ISO base media brands that have their own extension
+FTYP_BRANDS = {
+    b"heic": "heic", b"heix": "heic", b"hevc": "heic", b"hevx": "heic",
+    b"heim": "heic", b"heis": "heic", b"mif1": "heif", b"msf1": "heif",
+    b"avif": "avif", b"avis": "avif",
+    b"crx ": "cr3",
+    b"M4A ": "m4a", b"M4B ": "m4b", b"M4V ": "m4v",
+    b"qt  ": "mov",
+    b"3gp4": "3gp", b"3gp5": "3gp", b"3gp6": "3gp", b"3g2a": "3g2",
+}
+
+# Container formats: any of these extensions fits content sniffed as any other
+_FAMILIES = (
+    frozenset(("zip", "jar", "apk", "xpi", "cbz", "docx", "xlsx", "pptx", "odt", "ods", "odp", "odg",
+               "ott", "ots", "otp", "otg", "odm", "oth", "odf", "odc", "odb",
+               "epub", "kmz", "whl", "nupkg", "vsix", "3mf")),
+    frozenset(("mp4", "m4v", "m4a", "m4b", "m4p", "mov", "qt", "f4v", "3gp", "3g2")),
+    frozenset(("heic", "heif", "hif")),
+    frozenset(("ogg", "oga", "ogv", "ogx", "opus", "spx")),
+    frozenset(("mkv", "mka", "mks", "webm")),
+    frozenset(("tif", "tiff", "cr2")),
+)
+
+# Contents of the mimetype member first in a ZIP file -> document type
+_ZIP_MIMETYPES = {
+    b"application/epub+zip": "epub",
+    b"application/vnd.oasis.opendocument.text": "odt",
+    b"application/vnd.oasis.opendocument.text-template": "ott",
+    b"application/vnd.oasis.opendocument.text-master": "odm",
+    b"application/vnd.oasis.opendocument.text-web": "oth",
+    b"application/vnd.oasis.opendocument.spreadsheet": "ods",
+    b"application/vnd.oasis.opendocument.spreadsheet-template": "ots",
+    b"application/vnd.oasis.opendocument.presentation": "odp",
+    b"application/vnd.oasis.opendocument.presentation-template": "otp",
+    b"application/vnd.oasis.opendocument.graphics": "odg",
+    b"application/vnd.oasis.opendocument.graphics-template": "otg",
+    b"application/vnd.oasis.opendocument.formula": "odf",
+    b"application/vnd.oasis.opendocument.chart": "odc",
+    b"application/vnd.oasis.opendocument.base": "odb",
+}
+_OOXML_PARTS = ((b"word/", "docx"), (b"xl/", "xlsx"), (b"ppt/", "pptx"))
+
+_signatures = re.compile(
+    b"|".join(b"(?P<s%d>%s)" % (i, pattern) for i, (pattern, _ext, _aliases) in enumerate(SIGNATURES)),
+    re.DOTALL)
+_group_ext = {f"s{i}": ext for i, (_pattern, ext, _aliases) in enumerate(SIGNATURES)}
+_aliases = {ext: frozenset(aliases) for _pattern, ext, aliases in SIGNATURES}
+
+# Types that can follow an ID3v2 tag
+_ID3_AUDIO = frozenset(("mp3", "aac", "flac"))
+
+# Loaded up front: lazy initialisation is not thread safe
+mimetypes.init()
+
+
+def _refine_zip(data):
+    name_length = int.from_bytes(data[26:28], "little")
+    extra_length = int.from_bytes(data[28:30], "little")
+    name = data[30:30 + name_length]
+    if name == b"mimetype":
+        # The member is stored uncompressed: compare all of it, so that
+        # e.g. a text-template is not taken for a text
+        start = 30 + name_length + extra_length
+        size = int.from_bytes(data[18:22], "little")
+        return _ZIP_MIMETYPES.get(data[start:start + size], "zip")
+    elif name == b"[Content_Types].xml" or b"[Content_Types].xml" in data:
+        for part, ext in _OOXML_PARTS:
+            if part in data:
+                return ext
+    elif name == b"META-INF/MANIFEST.MF" or name == b"META-INF/":
+        return "jar"
+    return "zip"
+
+
+def _refine(ext, data):
+    if ext == "mp4":
+        return FTYP_BRANDS.get(data[8:12], "mp4")
+    if ext == "zip":
+        return _refine_zip(data)
+    if ext == "ogg":
+        if b"OpusHead" in data[28:64]:
+            return "opus"
+        if b"\x80theora" in data[28:64]:
+            return "ogv"
+    if ext == "mkv" and b"webm" in data[:64]:
+        return "webm"
+    return ext
+
+
+def _after_id3(data):
+    """data past its leading ID3v2 tag, None if the tag does not end
+    within data."""
+    if len(data) < 10:
+        return None
+    # Syncsafe size: 7 bits per byte, excluding the header and footer
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7f)
+    end = 10 + size + (10 if data[5] & 0x10 else 0)
+    return data[end:] if end < len(data) else None
+
+
+def _guess_with_gio(data):
+    content_type, uncertain = Gio.content_type_guess(None, data)
+    if uncertain or Gio.content_type_is_unknown(content_type) or \
+       Gio.content_type_is_a(content_type, "text/plain"):
+        # Text has no reliable extension
+        return None
+    mime = Gio.content_type_get_mime_type(content_type)
+    ext = mimetypes.guess_extension(mime) if mime else None
+    return ext[1:] if ext else None
+
+
+def sniff(data):
+    """Return the extension (lower-case, no dot) data looks like, or None."""
+    if data.startswith(b"ID3"):
+        # MP3, ADTS AAC and FLAC may all start with a tag; when the audio
+        # is past the buffer the type is unknown rather than MP3
+        while data is not None and data.startswith(b"ID3"):
+            data = _after_id3(data)
+        match = _signatures.match(data) if data else None
+        if match is None or _group_ext[match.lastgroup] not in _ID3_AUDIO:
+            return None
+        return _group_ext[match.lastgroup]
+    match = _signatures.match(data)
+    if match is not None:
+        return _refine(_group_ext[match.lastgroup], data)
+    return _guess_with_gio(data)
+
+
+def read_head(path):
+    with open(path, "rb", buffering=0) as f:
+        return f.read(SNIFF_SIZE)
+
+
+def matches(ext, sniffed):
+    """True if a file named with ext can hold content sniffed as sniffed."""
+    ext = ext.lower()
+    if not ext:
+        return False
+    if ext == sniffed or ext in _aliases.get(sniffed, ()):
+        return True
+    if any(ext in family and sniffed in family for family in _FAMILIES):
+        return True
+    # Extensions unknown to the table: trust the system's type database
+    name_type, _uncertain = Gio.content_type_guess(f"file.{ext}", None)
+    mime = mimetypes.types_map.get(f".{sniffed}")
+    sniffed_type = Gio.content_type_from_mime_type(mime) if mime else None
+    return sniffed_type is not None and Gio.content_type_is_a(name_type, sniffed_type)
@@ -0,0 +1,130 @@
+"""Replace/insert templates: text with enumeration and metadata tokens.
+
+    %n, %0n, %00n...   row number, zero-padded to 1, 2, 3... digits
+    %d or %d{format}   modification date, strftime() format (default %Y%m%d)
+    %e or %e{format}   EXIF date taken, same formats
+    %s                 size in bytes
+    %p                 name of the parent folder
+    %%                 a literal %, e.g. 100%%s for "100%s"
+
+A template is parsed once into a str.format() pattern, literal text with
+one replacement field per token, so rendering a row is a single format()
+call instead of a regular expression pass over the template. For the
+usual numbering-only template, render is that format method itself.
+Templates are memoized by their text, and rendering a template without
+tokens returns its text.
+
+New tokens are added to TOKENS: a field name, the regular expression
+matching the token and a function turning the match into the format
+spec of the field.
+
+Fields other than the row number are looked up through a function given
+to render(), only for the fields the template uses, so files are never
+queried for metadata a template does not reference. Values that are not
+available render as an empty string.
+"""
+import functools
+import re
+
+TEMPLATE_CACHE_SIZE = 64
+
+DEFAULT_DATE_FORMAT = "%Y%m%d"
+
+
+def _date_spec(group):
+    return lambda match: match.group(group) or DEFAULT_DATE_FORMAT
+
+
+# (field, regex, match -> format spec); group names must be unique
+TOKENS = (
+    ("n", r"%(?P<n_zeros>0*)n", lambda match: "0%dd" % (len(match.group("n_zeros")) + 1)),
+    ("d", r"%d(?:\{(?P<d_format>[^{}]*)\})?", _date_spec("d_format")),
+    ("e", r"%e(?:\{(?P<e_format>[^{}]*)\})?", _date_spec("e_format")),
+    ("s", r"%s", lambda match: ""),
+    ("p", r"%p", lambda match: ""),
+)
+
+# %% comes first so that %%n is a literal "%n", not "%" and a row number
+_tokens = re.compile("|".join(["(?P<percent>%%)"] +
+                              [f"(?P<{field}>{pattern})" for field, pattern, _spec in TOKENS]))
+_specs = {field: spec for field, _pattern, spec in TOKENS}
+
+
+def _escape(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class _Empty():
+    # Stands in for missing values whatever the format spec
+    def __format__(self, spec):
+        return ""
+
+
+_EMPTY = _Empty()
+
+
+class Template():
+    def __init__(self, text):
+        self.text = text
+        # Names of the fields used, e.g. {"n"} when the template numbers rows
+        self.fields = set()
+        literals = []
+        specs = []
+        # Text since the last token, split around %% escapes
+        literal = []
+        position = 0
+        for match in _tokens.finditer(text):
+            literal.append(text[position:match.start()])
+            position = match.end()
+            if match.lastgroup == "percent":
+                literal.append("%")
+                continue
+            literals.append("".join(literal))
+            literal = []
+            specs.append((match.lastgroup, _specs[match.lastgroup](match)))
+            self.fields.add(match.lastgroup)
+        literal.append(text[position:])
+        literals.append("".join(literal))
+
+        if not self.fields:
+            self._text = literals[0]
+            self.render = self._render_text
+        elif self.fields == {"n"}:
+            # Positional: render is the str.format of the pattern itself,
+            # which ignores the lookup argument
+            self.render = self._join(literals, [("0", spec) for _field, spec in specs]).format
+        else:
+            self._format = self._join(literals, specs).format
+        # Fields looked up per row
+        self.row_fields = tuple(sorted(self.fields - {"n"}))
+
+    @staticmethod
+    def _join(literals, specs):
+        parts = [_escape(literals[0])]
+        for (field, spec), literal in zip(specs, literals[1:]):
+            parts.append("{%s:%s}" % (field, spec))
+            parts.append(_escape(literal))
+        return "".join(parts)
+
+    @property
+    def uses_index(self):
+        return "n" in self.fields
+
+    def _render_text(self, index, lookup=None):
+        return self._text
+
+    def render(self, index, lookup=None):
+        """The template with its tokens filled in for row number index.
+        lookup(field) returns the value of the other fields for the row,
+        or None if it is not available."""
+        values = {}
+        for field in self.row_fields:
+            value = lookup(field)
+            values[field] = _EMPTY if value is None else value
+        return self._format(n=index, **values)
+
+
+@functools.lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile(text):
+    """The Template for text, parsed once."""
+    return Template(text)
@@ -0,0 +1,434 @@
+"""Packed on-disk thumbnail store.
+
+All thumbnails live in a single append-only data file (``thumbs.pack``)
+next to a fixed-size record index (``thumbs.idx``). The index is loaded
+into a dict once, so a lookup is a hash probe plus a slice of an mmap of
+the data file - no per-thumbnail file opens or stat() calls. Replaced and
+evicted blobs leave dead space behind, which compact() reclaims by
+rewriting both files with only the live entries; the blobs are copied
+without holding the lock, so thumbnail workers keep going meanwhile.
+Access-time updates and tombstones only grow the index, which
+compact_index() rewrites on its own when it is mostly stale records.
+"""
+import collections
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PACK_MAGIC = b"BLKYPAK1"
+INDEX_MAGIC = b"BLKYIDX1"
+
+# key digest, offset, length, width, height, rowstride, has_alpha, atime
+_RECORD = struct.Struct("<16sQIHHIBd")
+
+
+def identity_key(st):
+    """Key a file by what it is rather than where it is.
+
+    (device, inode, size, mtime_ns) is unchanged by a rename or a move within
+    the same filesystem, but changes as soon as the contents are rewritten.
+    """
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+class ThumbEntry():
+    __slots__ = ("offset", "length", "width", "height", "rowstride", "has_alpha", "atime")
+
+    def __init__(self, offset, length, width, height, rowstride, has_alpha, atime):
+        self.offset = offset
+        self.length = length
+        self.width = width
+        self.height = height
+        self.rowstride = rowstride
+        self.has_alpha = has_alpha
+        self.atime = atime
+
+
+class ThumbnailStore():
+    """Raw RGB(A) thumbnail blobs keyed by an arbitrary string."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.pack_path = os.path.join(str(directory), "thumbs.pack")
+        self.index_path = os.path.join(str(directory), "thumbs.idx")
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._live_bytes = 0
+        self._pack_fd = None
+        self._index_fd = None
+        self._pack_size = 0
+        self._map = None
+        self._touched = set()
+        # Records in the index file, live or not
+        self._index_records = 0
+        # Only one compaction at a time; the store lock is taken only briefly
+        self._compact_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._open()
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def _open(self):
+        os.makedirs(str(self.directory), exist_ok=True)
+        try:
+            self._load()
+        except (OSError, ValueError) as e:
+            logger.warning("Thumbnail store unreadable, resetting: %s", str(e))
+            self._close_fds()
+            self._reset_files()
+            self._load()
+
+    def _reset_files(self):
+        for path, magic in ((self.pack_path, PACK_MAGIC), (self.index_path, INDEX_MAGIC)):
+            with open(path, "wb") as f:
+                f.write(magic)
+        self._entries = {}
+        self._live_bytes = 0
+        self._index_records = 0
+
+    def _load(self):
+        if not (os.path.exists(self.pack_path) and os.path.exists(self.index_path)):
+            self._reset_files()
+
+        self._pack_fd = os.open(self.pack_path, os.O_RDWR | os.O_APPEND)
+        self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_APPEND)
+        if os.pread(self._pack_fd, len(PACK_MAGIC), 0) != PACK_MAGIC:
+            raise ValueError("bad pack header")
+        self._pack_size = os.fstat(self._pack_fd).st_size
+
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        if not data.startswith(INDEX_MAGIC):
+            raise ValueError("bad index header")
+
+        entries = {}
+        size = _RECORD.size
+        end = len(INDEX_MAGIC) + ((len(data) - len(INDEX_MAGIC)) // size) * size
+        for digest, offset, length, width, height, rowstride, alpha, atime in \
+                _RECORD.iter_unpack(data[len(INDEX_MAGIC):end]):
+            if length == 0:
+                # Tombstone
+                entries.pop(digest, None)
+            elif offset + length <= self._pack_size:
+                entries[digest] = ThumbEntry(offset, length, width, height, rowstride, bool(alpha), atime)
+        if end != len(data):
+            # Drop a torn trailing record left by an interrupted write
+            os.ftruncate(self._index_fd, end)
+
+        self._entries = entries
+        self._live_bytes = sum(e.length for e in entries.values())
+        self._index_records = (end - len(INDEX_MAGIC)) // size
+        self._touched = set()
+
+    def _release_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _close_fds(self):
+        self._release_map()
+        for fd in (self._pack_fd, self._index_fd):
+            if fd is not None:
+                os.close(fd)
+        self._pack_fd = None
+        self._index_fd = None
+
+    def close(self):
+        with self._lock:
+            self._close_fds()
+
+    def _read(self, entry):
+        if self._map is None or len(self._map) < entry.offset + entry.length:
+            self._release_map()
+            self._map = mmap.mmap(self._pack_fd, 0, access=mmap.ACCESS_READ)
+        return self._map[entry.offset:entry.offset + entry.length]
+
+    def get(self, key):
+        """Return (pixels, width, height, rowstride, has_alpha) or None.
+
+        pixels is a bytes copy of the blob, taken under the lock, so it
+        stays valid whatever compact() does afterwards.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or self._pack_fd is None:
+                self.misses += 1
+                return None
+            try:
+                pixels = self._read(entry)
+            except (OSError, ValueError) as e:
+                logger.debug("Thumbnail store read failed: %s", str(e))
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry.atime = time.time()
+            self._touched.add(digest)
+            return pixels, entry.width, entry.height, entry.rowstride, entry.has_alpha
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._digest(key) in self._entries
+
+    def put(self, key, pixels, width, height, rowstride, has_alpha):
+        digest = self._digest(key)
+        now = time.time()
+        with self._lock:
+            if self._pack_fd is None:
+                return
+            offset = self._pack_size
+            os.write(self._pack_fd, pixels)
+            self._pack_size += len(pixels)
+            entry = ThumbEntry(offset, len(pixels), width, height, rowstride, has_alpha, now)
+            os.write(self._index_fd, self._pack_record(digest, entry))
+            self._index_records += 1
+            old = self._entries.get(digest)
+            if old is not None:
+                self._live_bytes -= old.length
+            self._entries[digest] = entry
+            self._live_bytes += entry.length
+
+    def remove(self, key):
+        self._remove_digest(self._digest(key))
+
+    def _remove_digest(self, digest):
+        with self._lock:
+            entry = self._entries.pop(digest, None)
+            if entry is None or self._index_fd is None:
+                return
+            self._live_bytes -= entry.length
+            os.write(self._index_fd, _RECORD.pack(digest, 0, 0, 0, 0, 0, 0, 0.0))
+            self._index_records += 1
+
+    @staticmethod
+    def _pack_record(digest, entry):
+        return _RECORD.pack(digest, entry.offset, entry.length, entry.width, entry.height,
+                            entry.rowstride, 1 if entry.has_alpha else 0, entry.atime)
+
+    def stats(self):
+        """Get hit rate and usage statistics."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0,
+            'entries': len(self._entries),
+            'live_bytes': self._live_bytes,
+            'dead_bytes': self.dead_bytes,
+            'index_records': self._index_records,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def live_bytes(self):
+        return self._live_bytes
+
+    @property
+    def dead_bytes(self):
+        return max(0, self._pack_size - len(PACK_MAGIC) - self._live_bytes)
+
+    @property
+    def stale_records(self):
+        return max(0, self._index_records - len(self._entries))
+
+    def evict(self, max_age_days=30, max_bytes=None):
+        """Drop entries older than max_age_days, then oldest-accessed until
+        the live data fits in max_bytes. Returns the number of evicted entries."""
+        return sum(self.iter_evict(max_age_days, max_bytes))
+
+    def iter_evict(self, max_age_days=30, max_bytes=None, batch=256):
+        """Incremental evict(): removes up to batch entries per step and
+        yields how many went, so callers can pace the work."""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock:
+            # get() updates atime in place: keep the value seen by the scan
+            by_age = sorted(((digest, entry, entry.atime) for digest, entry in self._entries.items()),
+                            key=lambda item: item[2])
+            live = self._live_bytes
+        victims = []
+        for digest, entry, atime in by_age:
+            if atime >= cutoff and (max_bytes is None or live <= max_bytes):
+                break
+            victims.append((digest, entry, atime))
+            live -= entry.length
+            if len(victims) >= batch:
+                yield self._remove_entries(victims)
+                victims = []
+        if victims:
+            yield self._remove_entries(victims)
+
+    def _remove_entries(self, victims):
+        removed = 0
+        with self._lock:
+            for digest, entry, atime in victims:
+                # Skip entries that were rewritten or read since the scan
+                current = self._entries.get(digest)
+                if current is not entry or current.atime != atime or self._index_fd is None:
+                    continue
+                del self._entries[digest]
+                self._live_bytes -= entry.length
+                os.write(self._index_fd, _RECORD.pack(digest, 0, 0, 0, 0, 0, 0, 0.0))
+                self._index_records += 1
+                removed += 1
+        return removed
+
+    def flush_access_times(self):
+        """Persist access times updated by get() so that eviction order
+        survives a restart. Only touched entries are rewritten."""
+        with self._lock:
+            if self._index_fd is None or not self._touched:
+                return
+            records = [self._pack_record(digest, self._entries[digest])
+                       for digest in self._touched if digest in self._entries]
+            os.write(self._index_fd, b"".join(records))
+            self._index_records += len(records)
+            self._touched.clear()
+
+    def _write_index(self, path, entries):
+        with open(path, "wb") as index:
+            index.write(INDEX_MAGIC + b"".join(self._pack_record(digest, entry)
+                                                for digest, entry in entries.items()))
+
+    def compact_index(self):
+        """Rewrite the index with one record per live entry, dropping the
+        superseded access times and tombstones."""
+        with self._lock:
+            if self._index_fd is None:
+                return
+            self._touched.clear()  # Current access times are written below
+            tmp_index = self.index_path + ".tmp"
+            self._write_index(tmp_index, self._entries)
+            os.replace(tmp_index, self.index_path)
+            os.close(self._index_fd)
+            self._index_fd = os.open(self.index_path, os.O_RDWR | os.O_APPEND)
+            self._index_records = len(self._entries)
+
+    def compact(self):
+        """Rewrite the store with only live entries, reclaiming dead space.
+
+        The blobs live at the time of the call are copied to a new data
+        file without the lock: the data file is append-only, so they cannot
+        change under us. The lock is then taken to copy what was added
+        meanwhile, write the index and swap the files in.
+        """
+        with self._compact_lock:
+            with self._lock:
+                if self._pack_fd is None:
+                    return
+                snapshot = dict(self._entries)
+            tmp_pack = self.pack_path + ".tmp"
+            tmp_index = self.index_path + ".tmp"
+            moved = {}
+            with open(self.pack_path, "rb") as src, open(tmp_pack, "wb") as pack:
+                pack.write(PACK_MAGIC)
+                offset = len(PACK_MAGIC)
+                for digest, entry in sorted(snapshot.items(), key=lambda item: item[1].offset):
+                    src.seek(entry.offset)
+                    blob = src.read(entry.length)
+                    if len(blob) != entry.length:
+                        continue
+                    pack.write(blob)
+                    moved[digest] = offset
+                    offset += entry.length
+
+                with self._lock:
+                    if self._pack_fd is None:
+                        os.unlink(tmp_pack)
+                        return
+                    entries = {}
+                    for digest, entry in self._entries.items():
+                        if snapshot.get(digest) is entry and digest in moved:
+                            new_offset = moved[digest]
+                        else:
+                            # Put since the snapshot: copy it now
+                            src.seek(entry.offset)
+                            blob = src.read(entry.length)
+                            if len(blob) != entry.length:
+                                continue
+                            pack.write(blob)
+                            new_offset = offset
+                            offset += entry.length
+                        # Current atime: includes the not yet flushed ones
+                        entries[digest] = ThumbEntry(new_offset, entry.length, entry.width, entry.height,
+                                                     entry.rowstride, entry.has_alpha, entry.atime)
+                    pack.flush()
+                    self._write_index(tmp_index, entries)
+                    self._close_fds()
+                    os.replace(tmp_pack, self.pack_path)
+                    os.replace(tmp_index, self.index_path)
+                    self._load()
+
+
+class SurfaceCache():
+    """In-memory LRU map bounded by a byte budget rather than an entry count.
+
+    Rows drawn most recently sit at the end; when the budget is exceeded the
+    least recently painted entries - the ones scrolled out of view - go first.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            # Never evict the entry that was just inserted
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _key, (_value, old_size) = self._items.popitem(last=False)
+                self._bytes -= old_size
+
+    def discard(self, key):
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """Get hit rate and usage statistics."""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0,
+            'entries': len(self._items),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes,
+        }
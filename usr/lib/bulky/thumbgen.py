@@ -0,0 +1,320 @@
+"""In-process thumbnail generation for files without an XDG thumbnail.
+
+Images are decoded straight to icon size: GdkPixbuf's loaders are told the
+target size up front, which lets the JPEG loader use libjpeg's DCT scaling
+(1/2, 1/4, 1/8) instead of decoding the full-resolution frame and scaling
+it down afterwards.
+
+Videos get a keyframe extracted by ffmpeg, off the image thumbnail
+workers: requests are queued to VideoThumbnailer, whose threads (at most
+BULKY_VIDEO_THUMB_PROCS) each take whatever arrived within a short window,
+up to VIDEO_BATCH_SIZE clips, and run a single ffmpeg with one input and
+one output per clip. Scrolling through 5k clips therefore costs a few
+hundred ffmpeg runs, never more than the cap at once.
+
+With BULKY_THUMB_XDG=1 the shared freedesktop thumbnail cache is read and
+written directly, so thumbnails are shared with the file manager.
+"""
+import hashlib
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import gi
+gi.require_version("GdkPixbuf", "2.0")
+from gi.repository import GdkPixbuf, GLib
+
+logger = logging.getLogger(__name__)
+
+_extensions = None
+_extensions_lock = threading.Lock()
+
+VIDEO_EXTENSIONS = frozenset((
+    "3gp", "avi", "flv", "m2ts", "m4v", "mkv", "mov", "mp4", "mpeg", "mpg",
+    "mts", "ogv", "ts", "webm", "wmv",
+))
+VIDEO_SEEK_SECONDS = 1
+VIDEO_TIMEOUT_SECONDS = 20
+VIDEO_PROCS = max(1, int(os.getenv("BULKY_VIDEO_THUMB_PROCS", "2")))
+VIDEO_BATCH_SIZE = 16
+# How long a batch waits for more requests after the first one
+VIDEO_BATCH_WAIT = 0.05
+_ffmpeg = shutil.which("ffmpeg")
+
+
+def image_extensions():
+    """Lower-case file extensions the installed GdkPixbuf loaders can read."""
+    global _extensions
+    with _extensions_lock:
+        if _extensions is None:
+            exts = set()
+            for fmt in GdkPixbuf.Pixbuf.get_formats():
+                if fmt.is_disabled():
+                    continue
+                exts.update(ext.lower() for ext in fmt.get_extensions())
+            _extensions = frozenset(exts)
+        return _extensions
+
+
+def is_video(path):
+    return os.path.splitext(path)[1][1:].lower() in VIDEO_EXTENSIONS
+
+
+def can_generate(path):
+    ext = os.path.splitext(path)[1][1:].lower()
+    return ext in image_extensions() or (_ffmpeg is not None and ext in VIDEO_EXTENSIONS)
+
+
+def generate_thumbnail(path, size):
+    """Thumbnail an image or video file to fit within size x size pixels.
+    Blocks on the video queue for videos; see VideoThumbnailer."""
+    if is_video(path):
+        return generate_video_thumbnail(path, size)
+    return generate_image_thumbnail(path, size)
+
+
+def generate_image_thumbnail(path, size):
+    """Decode path to fit within size x size pixels, or return None."""
+    try:
+        pix = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, size, size, True)
+    except GLib.Error as e:
+        logger.debug("Thumbnail generation failed for %s: %s", path, str(e))
+        return None
+    return pix.apply_embedded_orientation() or pix
+
+
+def _load_png(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    if not data:
+        return None
+    loader = GdkPixbuf.PixbufLoader.new_with_type("png")
+    try:
+        loader.write(data)
+        loader.close()
+    except GLib.Error as e:
+        logger.debug("Bad video frame %s: %s", path, str(e))
+        return None
+    return loader.get_pixbuf()
+
+
+class VideoThumbnailer():
+    """Batched ffmpeg keyframe extraction on its own threads."""
+
+    def __init__(self, procs=VIDEO_PROCS, batch_size=VIDEO_BATCH_SIZE):
+        self.procs = procs
+        self.batch_size = batch_size
+        self.runs = 0
+        self._queue = queue.Queue()
+        self._threads = []
+        self._running = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, path, size, callback):
+        """Queue path; callback(pixbuf or None) is called from a video thread."""
+        with self._lock:
+            if self._closed:
+                callback(None)
+                return
+            if len(self._threads) < self.procs:
+                thread = threading.Thread(target=self._run, name="bulky-video", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+        self._queue.put((path, size, callback))
+
+    def shutdown(self):
+        """Drop queued requests and kill the ffmpeg runs in progress."""
+        with self._lock:
+            self._closed = True
+            for proc in self._running:
+                proc.kill()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2](None)
+        for _thread in self._threads:
+            self._queue.put(None)
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + VIDEO_BATCH_WAIT
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                # Leave the stop request for the next round
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            frames = [None] * len(batch)
+            if not self._closed:
+                try:
+                    frames = self.extract([(path, size) for path, size, _callback in batch])
+                except Exception as e:
+                    logger.debug("Video batch failed: %s", str(e))
+            for (path, _size, callback), pix in zip(batch, frames):
+                try:
+                    callback(pix)
+                except Exception as e:
+                    logger.debug("Video thumbnail callback failed for %s: %s", path, str(e))
+
+    def extract(self, items):
+        """Keyframe pixbufs (or None) for [(path, size)], in order."""
+        frames = self._extract(items, VIDEO_SEEK_SECONDS)
+        # Clips shorter than the seek point: from the start
+        retry = [i for i, pix in enumerate(frames) if pix is None]
+        if retry and not self._closed:
+            for i, pix in zip(retry, self._extract([items[i] for i in retry], 0)):
+                frames[i] = pix
+        return frames
+
+    def _extract(self, items, seek):
+        frames, ok = self._run_ffmpeg(items, seek)
+        if not ok and len(items) > 1 and not any(frames) and not self._closed:
+            # One unreadable input fails the whole run: split to isolate it
+            middle = len(items) // 2
+            return self._extract(items[:middle], seek) + self._extract(items[middle:], seek)
+        return frames
+
+    def _run_ffmpeg(self, items, seek):
+        # -ss before -i seeks on the demuxer to the nearest keyframe, and
+        # -skip_frame nokey keeps the decoder from touching anything else.
+        args = [_ffmpeg, "-v", "quiet", "-nostdin"]
+        for path, _size in items:
+            args += ["-skip_frame", "nokey", "-ss", str(seek), "-i", path]
+        with tempfile.TemporaryDirectory(prefix="bulky-video-") as tmp:
+            outputs = []
+            for i, (_path, size) in enumerate(items):
+                output = os.path.join(tmp, f"{i}.png")
+                args += ["-map", f"{i}:v:0", "-frames:v", "1",
+                         "-vf", f"scale={size}:{size}:force_original_aspect_ratio=decrease",
+                         "-update", "1", output]
+                outputs.append(output)
+            try:
+                proc = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            except OSError as e:
+                logger.debug("Failed to run ffmpeg: %s", str(e))
+                return [None] * len(items), False
+            with self._lock:
+                self._running.add(proc)
+            self.runs += 1
+            try:
+                proc.wait(timeout=VIDEO_TIMEOUT_SECONDS + len(items))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+            finally:
+                with self._lock:
+                    self._running.discard(proc)
+            return [_load_png(output) for output in outputs], proc.returncode == 0
+
+
+video_thumbnailer = VideoThumbnailer()
+
+
+def generate_video_thumbnail(path, size):
+    """Grab one keyframe from a video, scaled by ffmpeg, or return None.
+    Waits for the batch it joins; prefer video_thumbnailer.submit()."""
+    if _ffmpeg is None:
+        return None
+    done = threading.Event()
+    result = []
+
+    def callback(pix):
+        result.append(pix)
+        done.set()
+
+    video_thumbnailer.submit(path, size, callback)
+    done.wait()
+    return result[0]
+
+
+# Freedesktop thumbnail spec: $XDG_CACHE_HOME/thumbnails/<flavor>/<md5(uri)>.png
+XDG_THUMB_ROOT = os.path.join(GLib.get_user_cache_dir(), "thumbnails")
+XDG_FLAVORS = (("normal", 128), ("large", 256))
+
+
+def xdg_flavor_for(size):
+    for flavor, flavor_size in XDG_FLAVORS:
+        if size <= flavor_size:
+            return flavor, flavor_size
+    return XDG_FLAVORS[-1]
+
+
+def xdg_thumbnail_path(uri, flavor):
+    name = hashlib.md5(uri.encode("utf-8")).hexdigest() + ".png"
+    return os.path.join(XDG_THUMB_ROOT, flavor, name)
+
+
+def load_xdg_thumbnail(uri, mtime, size):
+    """Return the shared thumbnail for uri scaled to size, if one exists and
+    its Thumb::MTime matches mtime."""
+    flavor, _flavor_size = xdg_flavor_for(size)
+    path = xdg_thumbnail_path(uri, flavor)
+    try:
+        pix = GdkPixbuf.Pixbuf.new_from_file(path)
+    except GLib.Error:
+        return None
+    if pix.get_option("tEXt::Thumb::URI") != uri or \
+       pix.get_option("tEXt::Thumb::MTime") != str(int(mtime)):
+        return None
+    return scale_to_fit(pix, size)
+
+
+def save_xdg_thumbnail(uri, mtime, pix):
+    """Write pix to the shared cache, atomically and private to the user as
+    the spec requires. pix should already be at flavor size."""
+    flavor, _flavor_size = xdg_flavor_for(max(pix.get_width(), pix.get_height()))
+    path = xdg_thumbnail_path(uri, flavor)
+    tmp_path = f"{path}.bulky-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        pix.savev(tmp_path, "png",
+                  ["tEXt::Thumb::URI", "tEXt::Thumb::MTime", "tEXt::Software"],
+                  [uri, str(int(mtime)), "Bulky"])
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, path)
+    except (GLib.Error, OSError) as e:
+        logger.debug("Failed to write shared thumbnail for %s: %s", uri, str(e))
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def scale_to_fit(pix, size):
+    width = pix.get_width()
+    height = pix.get_height()
+    if width <= size and height <= size:
+        return pix
+    factor = size / max(width, height)
+    return pix.scale_simple(max(1, round(width * factor)), max(1, round(height * factor)),
+                            GdkPixbuf.InterpType.BILINEAR)
@@ -0,0 +1,132 @@
+"""Run a per-file extractor over a pool of worker threads.
+
+The runner never touches GTK itself. Results, progress and completion
+are handed to a dispatch callable (GLib.idle_add in the application),
+so consumers always run on the main loop. Results are delivered in
+batches, at most once per interval, so the UI does not get one callback
+per file.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = max(1, int(os.getenv("BULKY_TOOL_WORKERS", str(min(8, (os.cpu_count() or 1) * 2)))))
+
+
+class ToolRunner():
+    """Apply extract(item) to every item on worker threads.
+
+    on_results(batch) receives lists of (index, item, result), where index is
+    the item's position in items; on_progress(done, total) follows every batch;
+    on_done(cancelled) comes last. Exceptions from extract() count as a None
+    result.
+
+    With chunk_size, workers take that many items at a time and hand them to
+    extract_chunk(items), which returns one result per item - for extractors
+    that fan out to another pool or amortize a per-call cost.
+    """
+
+    def __init__(self, extract, items, dispatch, on_results=None, on_progress=None,
+                 on_done=None, workers=None, interval=0.1, chunk_size=None, extract_chunk=None):
+        self.extract = extract
+        self.extract_chunk = extract_chunk
+        self.chunk_size = max(1, chunk_size or 1)
+        self.items = list(items)
+        self.total = len(self.items)
+        self.dispatch = dispatch
+        self.on_results = on_results
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.workers = max(1, min(workers or DEFAULT_WORKERS, self.total or 1))
+        self.interval = interval
+        self.completed = 0
+        self.elapsed = 0.0
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._next_index = 0
+        self._running = 0
+        self._last_flush = 0.0
+        self._t_start = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def start(self):
+        self._t_start = time.perf_counter()
+        self._running = self.workers
+        for _ in range(self.workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _take(self):
+        with self._lock:
+            start = self._next_index
+            if start >= self.total:
+                return None
+            self._next_index = min(self.total, start + self.chunk_size)
+            return start, self._next_index
+
+    def _extract_one(self, item):
+        try:
+            return self.extract(item)
+        except Exception as e:
+            logger.debug("Tool extractor failed: %s", str(e))
+            return None
+
+    def _work(self):
+        while not self._cancel.is_set():
+            span = self._take()
+            if span is None:
+                break
+            start, stop = span
+            items = self.items[start:stop]
+            if self.extract_chunk is not None:
+                try:
+                    results = self.extract_chunk(items)
+                except Exception as e:
+                    logger.debug("Tool chunk extractor failed: %s", str(e))
+                    results = [None] * len(items)
+            else:
+                results = [self._extract_one(item) for item in items]
+            self._publish(start, items, results)
+
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if last:
+            self.elapsed = time.perf_counter() - self._t_start
+            self._flush(final=True)
+
+    def _publish(self, start, items, results):
+        with self._lock:
+            self._pending.extend(zip(range(start, start + len(items)), items, results))
+            self.completed += len(items)
+            now = time.monotonic()
+            if now - self._last_flush < self.interval:
+                return
+            self._last_flush = now
+        self._flush()
+
+    def _flush(self, final=False):
+        with self._lock:
+            batch = self._pending
+            self._pending = []
+            completed = self.completed
+
+        def deliver():
+            if batch and self.on_results is not None:
+                self.on_results(batch)
+            if self.on_progress is not None:
+                self.on_progress(completed, self.total)
+            if final and self.on_done is not None:
+                self.on_done(self.cancelled)
+            return False
+
+        self.dispatch(deliver)
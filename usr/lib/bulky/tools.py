@@ -0,0 +1,583 @@
+"""Tools menu plugins.
+
+A tool splits its work in two: extract() does the per-file I/O and runs on
+ToolRunner worker threads, new_name() turns the extracted value into a
+name and is called on the main loop for every accepted row, in model
+order, so that counters and duplicate checks stay deterministic.
+
+Tools with a cache_kind keep their extracted values on the row
+(file_obj.tool_values) and in the persistent metadata cache, so
+re-running them on unchanged files skips the I/O. The names a tool
+proposes are stored on the row too (file_obj.tool_name) and the
+window's active operation is applied on top of them.
+
+A tool that needs to see every file before deciding what to read next
+(DuplicateTool) returns more rows from next_pass(); each pass is a
+separate ToolRunner run over just those rows.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from gettext import gettext as _
+
+import audiotags
+import exif
+import hashing
+import normalize
+import phash
+import sniff
+import thumbgen
+from metacache import MISSING
+from thumbcache import identity_key
+
+logger = logging.getLogger(__name__)
+
+
+class Tool():
+    title = ""
+    # Worker threads for extract(); None uses the runner default
+    workers = None
+    # When set, the runner calls extract_chunk() with this many rows at a time
+    chunk_size = None
+    # Kind of value kept in the metadata cache; None disables caching
+    cache_kind = None
+    cache = None
+    # Progress dialog title for the current pass, when it differs from title
+    pass_title = None
+
+    done_title = ""
+    done_text = ""
+    empty_title = ""
+    empty_text = ""
+    empty_is_warning = True
+
+    def accepts(self, file_obj):
+        return file_obj.gfile.is_native()
+
+    def begin(self):
+        """Reset per-run state before new_name() is called."""
+
+    def start(self, count):
+        """Called on the main loop before extraction of count rows starts."""
+
+    def finish(self):
+        """Called on the main loop once extraction has ended or was cancelled."""
+
+    def stats(self):
+        """Tool-specific statistics for telemetry, or None."""
+        return None
+
+    def next_pass(self, file_objs, values):
+        """Called on the main loop after a pass with the rows it extracted and
+        their values. Return the rows to extract again, or None when done."""
+        return None
+
+    def extract(self, file_obj):
+        raise NotImplementedError
+
+    def extract_chunk(self, file_objs):
+        return [self.extract(file_obj) for file_obj in file_objs]
+
+    def encode(self, value):
+        """Convert an extracted value to something JSON can store."""
+        return value
+
+    def decode(self, value):
+        return value
+
+    def _identity(self, file_obj):
+        try:
+            return identity_key(os.stat(file_obj.gfile.get_path()))
+        except (OSError, TypeError):
+            return None
+
+    def _lookup(self, file_obj):
+        identity = self._identity(file_obj)
+        if identity is None:
+            return None, MISSING
+        # Values kept on the row since it was loaded, while the file is unchanged
+        memo = file_obj.tool_values.get(self.cache_kind)
+        if memo is not None and memo[0] == identity:
+            return identity, memo[1]
+        if self.cache is None:
+            return identity, MISSING
+        value = self.cache.get(identity, self.cache_kind)
+        if value is MISSING:
+            return identity, MISSING
+        value = self.decode(value)
+        file_obj.tool_values[self.cache_kind] = (identity, value)
+        return identity, value
+
+    def _store(self, file_obj, identity, value):
+        # Failures are not cached: they may be transient
+        if identity is None or value is None:
+            return
+        file_obj.tool_values[self.cache_kind] = (identity, value)
+        if self.cache is not None:
+            self.cache.put(identity, self.cache_kind, self.encode(value))
+
+    def cached_extract(self, file_obj):
+        """extract() through the row and metadata caches."""
+        if self.cache_kind is None:
+            return self.extract(file_obj)
+        identity, value = self._lookup(file_obj)
+        if value is MISSING:
+            value = self.extract(file_obj)
+            self._store(file_obj, identity, value)
+        return value
+
+    def cached_extract_chunk(self, file_objs):
+        """extract_chunk() through the row and metadata caches; only misses
+        are extracted."""
+        if self.cache_kind is None:
+            return self.extract_chunk(file_objs)
+        lookups = [self._lookup(file_obj) for file_obj in file_objs]
+        missing = [i for i, (_identity, value) in enumerate(lookups) if value is MISSING]
+        results = [value for _identity, value in lookups]
+        if missing:
+            extracted = self.extract_chunk([file_objs[i] for i in missing])
+            for i, value in zip(missing, extracted):
+                results[i] = value
+                self._store(file_objs[i], lookups[i][0], value)
+        return results
+
+    def new_name(self, file_obj, value):
+        """Return the proposed name for file_obj, or None to leave it."""
+        raise NotImplementedError
+
+    def excludes(self, file_obj):
+        """Return True to drop file_obj from the list once the tool has run."""
+        return False
+
+
+class ExifDateTool(Tool):
+    title = _("Rename by EXIF Date")
+    done_title = _("EXIF Rename Complete")
+    done_text = _("{} files renamed based on EXIF data.\nClick 'Rename' to apply changes.")
+    empty_title = _("No EXIF data found")
+    empty_text = _("No photos with valid EXIF DateTimeOriginal found.")
+    cache_kind = "exif"
+
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self.counter = 1
+        self._pool = None
+
+    def accepts(self, file_obj):
+        ext = os.path.splitext(file_obj.name)[1][1:].lower()
+        return file_obj.gfile.is_native() and ext in exif.EXTENSIONS
+
+    def begin(self):
+        self.counter = 1
+
+    def start(self, count):
+        # Large imports: parse in a process pool so every core is used,
+        # each runner thread feeding one process a chunk at a time
+        if count >= exif.PROCESS_THRESHOLD:
+            self._pool = exif.process_pool()
+            self.workers = exif.PROCESSES
+            self.chunk_size = exif.PROCESS_CHUNK
+
+    def finish(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self.workers = None
+        self.chunk_size = None
+
+    def extract(self, file_obj):
+        result = exif.read_exif_date(file_obj.gfile.get_path())
+        return result.timestamp if result else None
+
+    def encode(self, timestamp):
+        return timestamp.isoformat()
+
+    def decode(self, value):
+        return datetime.fromisoformat(value)
+
+    def extract_chunk(self, file_objs):
+        if self._pool is None:
+            return super().extract_chunk(file_objs)
+        paths = [file_obj.gfile.get_path() for file_obj in file_objs]
+        return [timestamp for _path, timestamp, _subsec, _camera in
+                self._pool.submit(exif.read_chunk, paths).result()]
+
+    def new_name(self, file_obj, exif_date):
+        counter = self.counter
+        self.counter += 1
+        if exif_date is None:
+            return None
+        ext = os.path.splitext(file_obj.name)[1].lower()
+        return f"{self.prefix}{exif_date.strftime('%Y%m%d_%H%M%S')}_{counter:03d}{ext}"
+
+
+class Id3Tool(Tool):
+    title = _("Rename by ID3 Tags")
+    done_title = _("ID3 Rename Complete")
+    done_text = _("{} files renamed based on ID3 tags.\nClick 'Rename' to apply changes.")
+    empty_title = _("No ID3 tags found")
+    empty_text = _("No audio files with valid artist/title tags found.")
+    cache_kind = "audiotags"
+    # Chunks let the files that need ffprobe share one probe_many() call
+    chunk_size = 32
+
+    def accepts(self, file_obj):
+        if not file_obj.gfile.is_native():
+            return False
+        ext = os.path.splitext(file_obj.name)[1][1:].lower()
+        return ext in audiotags.EXTENSIONS or \
+            (ext in audiotags.FFPROBE_EXTENSIONS and audiotags.have_ffprobe())
+
+    def _needs_probe(self, path):
+        return os.path.splitext(path)[1][1:].lower() in audiotags.FFPROBE_EXTENSIONS
+
+    def extract(self, file_obj):
+        return self.extract_chunk([file_obj])[0]
+
+    def extract_chunk(self, file_objs):
+        paths = [file_obj.gfile.get_path() for file_obj in file_objs]
+        results = {}
+        probe = []
+        for path in paths:
+            if self._needs_probe(path):
+                probe.append(path)
+            else:
+                results[path] = audiotags.read_tags(path)
+        if probe:
+            results.update(audiotags.probe_many(probe))
+        return [results.get(path) or None for path in paths]
+
+    def new_name(self, file_obj, tags):
+        if not tags:
+            return None
+        artist = tags.get("artist")
+        title = tags.get("title")
+        if not (artist and title):
+            return None
+        artist_clean = normalize.transliterate(artist).replace(' ', '_')
+        title_clean = normalize.transliterate(title).replace(' ', '_')
+        ext = os.path.splitext(file_obj.name)[1].lower()
+        return f"{artist_clean}_-_{title_clean}{ext}"
+
+
+class HashTool(Tool):
+    title = _("Rename by Hash")
+    workers = hashing.WORKERS
+    done_title = _("Hash Rename Complete")
+    done_text = _("{} files renamed by hash.\nClick 'Rename' to apply changes.")
+    empty_title = _("Hash rename failed")
+    empty_text = _("Unable to hash files. Check permissions.")
+
+    def __init__(self, algorithm="sha256", length=16):
+        self.algorithm = algorithm
+        self.length = length
+        self.seen_hashes = set()
+        # Full digests are cached so any length can be cut from them
+        self.cache_kind = f"hash:{algorithm}"
+        self.hash_stats = hashing.HashStats()
+
+    def begin(self):
+        self.seen_hashes = set()
+
+    def start(self, count):
+        self.hash_stats = hashing.HashStats()
+
+    def stats(self):
+        return self.hash_stats.stats()
+
+    def extract(self, file_obj):
+        try:
+            return hashing.hash_file(file_obj.gfile.get_path(), self.algorithm, self.hash_stats)
+        except Exception as e:
+            logger.debug(f"Hash error for {file_obj.name}: {e}")
+        return None
+
+    def new_name(self, file_obj, file_hash):
+        if not file_hash:
+            return None
+        file_hash = file_hash[:self.length]
+        if file_hash in self.seen_hashes:
+            logger.warning(f"Duplicate hash {file_hash} for {file_obj.name}")
+            return None
+        self.seen_hashes.add(file_hash)
+        ext = os.path.splitext(file_obj.name)[1]
+        return f"{file_hash}{ext}"
+
+
+class NormalizeTool(Tool):
+    title = _("Normalize Names")
+    done_title = _("Normalization Complete")
+    done_text = _("{} files normalized.\nClick 'Rename' to apply changes.")
+    empty_title = _("Already Normalized")
+    empty_text = _("All file names are already normalized.")
+    empty_is_warning = False
+
+    def accepts(self, file_obj):
+        return True
+
+    def extract(self, file_obj):
+        # Split name and extension
+        base, ext = os.path.splitext(file_obj.name)
+
+        normalized = normalize.normalize(base)
+        if normalized and normalized != base:
+            return normalized + ext.lower()
+        return None
+
+    def new_name(self, file_obj, normalized):
+        return normalized
+
+
+class ExtensionTool(Tool):
+    title = _("Fix Extensions from Content")
+    done_title = _("Extensions Checked")
+    done_text = _("{} files have an extension that does not match their contents.\nClick 'Rename' to apply changes.")
+    empty_title = _("Extensions Match")
+    empty_text = _("All file extensions match the file contents.")
+    empty_is_warning = False
+    cache_kind = "sniff"
+
+    def accepts(self, file_obj):
+        return file_obj.gfile.is_native() and not file_obj.is_a_dir()
+
+    def extract(self, file_obj):
+        try:
+            return sniff.sniff(sniff.read_head(file_obj.gfile.get_path()))
+        except Exception as e:
+            logger.debug(f"Type sniffing failed for {file_obj.name}: {e}")
+        return None
+
+    def new_name(self, file_obj, sniffed):
+        if not sniffed:
+            return None
+        base, ext = os.path.splitext(file_obj.name)
+        if sniff.matches(ext[1:], sniffed):
+            return None
+        # "photo.jpg.txt": drop the wrong extension rather than stack another
+        if sniff.matches(os.path.splitext(base)[1][1:], sniffed):
+            return base
+        return f"{base}.{sniffed}"
+
+
+class DuplicateTool(Tool):
+    """Find files with identical contents, reading as little as possible.
+
+    Files are first grouped by size, and only sizes shared by several files
+    go on. Those get a partial hash of their first and last 64 KB, and only
+    files whose partial hashes collide are hashed in full. Files no larger
+    than the partial read are settled by the partial hash.
+
+    The first file of each group, in list order, is the original; action
+    decides what happens to the rest: "suffix" appends _dupN to their names,
+    "mark" prefixes the whole group with its number so groups show
+    together, "exclude" drops the copies from the list.
+    """
+    title = _("Find Duplicates")
+    workers = hashing.WORKERS
+    done_title = _("Duplicates Found")
+    done_text = _("{} duplicate files found.\nClick 'Rename' to apply changes.")
+    empty_title = _("No Duplicates")
+    empty_text = _("No files with identical contents found.")
+    empty_is_warning = False
+
+    def __init__(self, algorithm="blake2b", action="suffix"):
+        self.algorithm = algorithm
+        self.action = action
+        self.phase = "size"
+        # row_id -> (group number, position in group); position 0 is the original
+        self.groups = {}
+        self.group_count = 0
+        self.sizes = {}
+        self.counts = {}
+        self.hash_stats = hashing.HashStats()
+
+    def accepts(self, file_obj):
+        return file_obj.gfile.is_native() and not file_obj.is_a_dir()
+
+    def start(self, count):
+        self.phase = "size"
+        self.cache_kind = None
+        self.pass_title = None
+        self.groups = {}
+        self.group_count = 0
+        self.sizes = {}
+        self.counts = {'files': count}
+        self.hash_stats = hashing.HashStats()
+
+    def stats(self):
+        return dict(self.counts, groups=self.group_count, devices=self.hash_stats.stats())
+
+    def extract(self, file_obj):
+        path = file_obj.gfile.get_path()
+        try:
+            if self.phase == "size":
+                return os.stat(path).st_size
+            if self.phase == "partial":
+                return hashing.hash_partial(path, self.algorithm, stats=self.hash_stats)
+            return hashing.hash_file(path, self.algorithm, self.hash_stats)
+        except Exception as e:
+            logger.debug(f"Duplicate check failed for {file_obj.name}: {e}")
+        return None
+
+    def _collisions(self, file_objs, keys):
+        buckets = defaultdict(list)
+        for file_obj, key in zip(file_objs, keys):
+            if key is not None:
+                buckets[key].append(file_obj)
+        return [bucket for bucket in buckets.values() if len(bucket) > 1]
+
+    def _settle(self, buckets):
+        for bucket in buckets:
+            self.group_count += 1
+            for position, file_obj in enumerate(bucket):
+                self.groups[file_obj.row_id] = (self.group_count, position)
+
+    def next_pass(self, file_objs, values):
+        if self.phase == "size":
+            self.sizes = dict(zip((f.row_id for f in file_objs), values))
+            buckets = self._collisions(file_objs, values)
+            # Empty files are all alike
+            self._settle([bucket for bucket in buckets if self.sizes[bucket[0].row_id] == 0])
+            candidates = [f for bucket in buckets if self.sizes[bucket[0].row_id] > 0 for f in bucket]
+            self.counts['size_matches'] = len(candidates)
+            self.phase = "partial"
+            self.cache_kind = f"partial:{self.algorithm}"
+            self.pass_title = _("Comparing file samples")
+            return candidates or None
+
+        if self.phase == "partial":
+            keys = [None if value is None else (self.sizes[f.row_id], value)
+                    for f, value in zip(file_objs, values)]
+            small = []
+            candidates = []
+            for bucket in self._collisions(file_objs, keys):
+                if self.sizes[bucket[0].row_id] <= 2 * hashing.PARTIAL_SIZE:
+                    small.append(bucket)
+                else:
+                    candidates.extend(bucket)
+            self._settle(small)
+            self.counts['partial_matches'] = len(candidates)
+            self.phase = "full"
+            # Full digests are shared with HashTool's cache entries
+            self.cache_kind = f"hash:{self.algorithm}"
+            self.pass_title = _("Comparing file contents")
+            return candidates or None
+
+        keys = [None if value is None else (self.sizes[f.row_id], value)
+                for f, value in zip(file_objs, values)]
+        self._settle(self._collisions(file_objs, keys))
+        return None
+
+    def new_name(self, file_obj, value):
+        group = self.groups.get(file_obj.row_id)
+        if group is None:
+            return None
+        number, position = group
+        if self.action == "mark":
+            return f"dup{number:04d}_{file_obj.name}"
+        if self.action == "suffix" and position > 0:
+            base, ext = os.path.splitext(file_obj.name)
+            return f"{base}_dup{position}{ext}"
+        return None
+
+    def excludes(self, file_obj):
+        group = self.groups.get(file_obj.row_id)
+        return self.action == "exclude" and group is not None and group[1] > 0
+
+
+class SimilarImageTool(Tool):
+    """Group visually similar images by perceptual hash.
+
+    Rows are decoded in chunks so each chunk is hashed in one NumPy batch;
+    once every image has a hash, a second pass looks up the close earlier
+    hashes of each image in a phash.HashIndex, on the runner threads so
+    the comparisons keep the progress dialog and Cancel working. Images
+    within max_distance bits of each other (directly or through a chain)
+    form a group, and every member gets the group's number as a prefix so
+    groups sort together.
+    """
+    title = _("Group Similar Images")
+    done_title = _("Similar Images Grouped")
+    done_text = _("{} images grouped by similarity.\nClick 'Rename' to apply changes.")
+    empty_title = _("No Similar Images")
+    empty_text = _("No visually similar images found.")
+    empty_is_warning = False
+    cache_kind = "dhash"
+    chunk_size = 64
+
+    def __init__(self, max_distance=phash.DEFAULT_DISTANCE):
+        self.max_distance = max_distance
+        self.phase = "hash"
+        self.groups = {}
+        # Rows of the hash pass and their hashes
+        self.rows = []
+        self.hashes = []
+        # row_id -> position in rows
+        self.positions = {}
+        # Built by the first comparison chunk, off the main loop
+        self.index = None
+        self.index_lock = threading.Lock()
+
+    def accepts(self, file_obj):
+        ext = os.path.splitext(file_obj.name)[1][1:].lower()
+        return file_obj.gfile.is_native() and ext in thumbgen.image_extensions()
+
+    def start(self, count):
+        self.phase = "hash"
+        self.cache_kind = SimilarImageTool.cache_kind
+        self.pass_title = None
+        self.groups = {}
+        self.rows = []
+        self.hashes = []
+        self.positions = {}
+        self.index = None
+
+    def stats(self):
+        return {'groups': len(set(self.groups.values())), 'grouped': len(self.groups)}
+
+    def extract(self, file_obj):
+        return self.extract_chunk([file_obj])[0]
+
+    def extract_chunk(self, file_objs):
+        if self.phase == "compare":
+            with self.index_lock:
+                if self.index is None:
+                    self.index = phash.HashIndex(self.hashes, self.max_distance)
+            return [self.index.earlier(self.positions[file_obj.row_id]) for file_obj in file_objs]
+        grids = []
+        for file_obj in file_objs:
+            try:
+                grids.append(phash.load_pixels(file_obj.gfile.get_path()))
+            except Exception as e:
+                logger.debug(f"Perceptual hash failed for {file_obj.name}: {e}")
+                grids.append(None)
+        hashes = iter(phash.dhash_batch([grid for grid in grids if grid is not None]))
+        return [None if grid is None else next(hashes) for grid in grids]
+
+    def next_pass(self, file_objs, values):
+        if self.phase == "hash":
+            self.hashes = values
+            self.rows = file_objs
+            self.positions = {file_obj.row_id: i for i, file_obj in enumerate(file_objs)}
+            candidates = [f for f, value in zip(file_objs, values) if value is not None]
+            self.phase = "compare"
+            # Neighbour lists are not worth caching
+            self.cache_kind = None
+            self.pass_title = _("Comparing images")
+            return candidates if len(candidates) > 1 else None
+
+        pairs = ((j, self.positions[f.row_id]) for f, earlier in zip(file_objs, values) for j in earlier or ())
+        members = [self.positions[f.row_id] for f in file_objs]
+        for number, group in enumerate(phash.group(members, pairs), 1):
+            for i in group:
+                self.groups[self.rows[i].row_id] = number
+        self.index = None
+        return None
+
+    def new_name(self, file_obj, value):
+        number = self.groups.get(file_obj.row_id)
+        if number is None:
+            return None
+        return f"sim{number:04d}_{file_obj.name}"